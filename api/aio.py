@@ -0,0 +1,136 @@
+"""
+Soporte para las vistas asíncronas (ASGI, ver api.async_views).
+
+En un worker ASGI las esperas de red (Gemini) no ocupan un hilo: miles de
+corrutinas pueden estar esperando a la vez. El trabajo de CPU (rembg,
+decodificar, componer, codificar PNG/MP4) sí bloquea, así que se envía a un
+pool de hilos acotado (ASYNC_CPU_THREADS) con `run_stage`. Cada etapa tiene
+además su propio semáforo (ASYNC_STAGE_LIMITS) para limitar cuántas
+peticiones la ejecutan a la vez: p. ej. que las codificaciones de video no
+dejen sin hilos a rembg, o no abrir más de N llamadas simultáneas a Gemini.
+"""
+import asyncio
+import contextvars
+import functools
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+from .metrics import metrics
+
+_executor = None
+_executor_lock = threading.Lock()
+# Los semáforos y las llamadas en curso de asyncio pertenecen a un event loop
+_semaphores = weakref.WeakKeyDictionary()
+
+
+def executor():
+    """
+    Pool de hilos del proceso para el trabajo de CPU de las vistas asíncronas.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.ASYNC_CPU_THREADS, thread_name_prefix="api-cpu"
+            )
+        return _executor
+
+
+def stage_semaphore(stage):
+    """
+    Semáforo de la etapa `stage` en el event loop actual.
+    """
+    loop = asyncio.get_running_loop()
+    semaphores = _semaphores.setdefault(loop, {})
+    if stage not in semaphores:
+        semaphores[stage] = asyncio.Semaphore(settings.ASYNC_STAGE_LIMITS[stage])
+    return semaphores[stage]
+
+
+class stage:
+    """
+    Context manager asíncrono que ocupa un hueco de la etapa mientras dura
+    el bloque y registra la espera en `async_stage_wait_seconds`.
+
+        async with stage("gemini"):
+            ...
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._semaphore = None
+
+    async def __aenter__(self):
+        self._semaphore = stage_semaphore(self.name)
+        start = time.perf_counter()
+        await self._semaphore.acquire()
+        metrics.observe("async_stage_wait_seconds", time.perf_counter() - start, stage=self.name)
+        metrics.increment("async_stage_runs_total", stage=self.name)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self._semaphore.release()
+
+
+async def run_stage(name, func, *args, **kwargs):
+    """
+    Ejecuta `func(*args, **kwargs)` en el pool de hilos, dentro de la etapa
+    `name`, y devuelve su resultado sin bloquear el event loop.
+    """
+    async with stage(name):
+        loop = asyncio.get_running_loop()
+        # Se copia el contexto para que `func` vea la traza de la petición
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(
+            executor(), functools.partial(context.run, func, *args, **kwargs)
+        )
+
+
+class AsyncSingleFlight:
+    """
+    Versión asíncrona de api.singleflight dentro del event loop: las
+    peticiones con la misma clave que llegan mientras la primera se ejecuta
+    esperan su resultado (o su error) en lugar de repetirla.
+    """
+
+    def __init__(self):
+        self._calls = weakref.WeakKeyDictionary()
+
+    async def do(self, key, func):
+        """
+        Devuelve el resultado de `await func()` para `key`, compartido entre
+        las llamadas simultáneas.
+        """
+        loop = asyncio.get_running_loop()
+        calls = self._calls.setdefault(loop, {})
+        future = calls.get(key)
+        if future is not None:
+            metrics.increment("singleflight_shared_total", scope="async")
+            # shield: si esta petición se cancela no cancela la de las demás
+            return await asyncio.shield(future)
+
+        future = loop.create_future()
+        calls[key] = future
+        try:
+            result = await func()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # Sin otras peticiones esperando nadie lee el error del future
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del calls[key]
+
+
+# Compartido por todas las vistas del proceso
+async_single_flight = AsyncSingleFlight()
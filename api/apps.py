@@ -4,3 +4,36 @@ from django.apps import AppConfig
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        # Calentamiento opcional del worker (ver API_WARMUP en settings)
+        from .endpoints import rembg_enabled
+        from .procpool import in_worker
+        from .warmup import start_warmup
+
+        if rembg_enabled():
+            # En el hilo principal: pymatting (que importa rembg) deja
+            # colgado el cierre del intérprete si se importa por primera vez
+            # desde otro hilo (ver api.endpoints)
+            import rembg  # noqa: F401
+
+        # Los procesos del pool (api.procpool) se calientan al arrancar
+        if not in_worker():
+            start_warmup()
+            self.start_jobs()
+
+    def start_jobs(self):
+        """
+        Con un broker compartido (JOBS_BROKER) cualquier worker puede recibir
+        los trabajos que encoló otro, así que no se espera a un `submit`.
+        """
+        from django.conf import settings
+
+        if not settings.JOBS_AUTOSTART:
+            return
+        from .jobs import job_queue
+        # Registra los tipos de trabajo de los endpoints activos
+        from . import views  # noqa: F401
+
+        if job_queue.kinds() and getattr(job_queue.broker, 'shared', False):
+            job_queue.start()
@@ -0,0 +1,164 @@
+"""
+Almacén temporal de los ficheros generados (PNG y MP4) para servirlos por URL.
+
+Las vistas de transición devolvían las dos imágenes y el video en base64
+dentro del JSON: un 33% más de bytes y varias copias grandes en memoria por
+petición. Ahora cada fichero se guarda en disco con un id aleatorio (no
+adivinable) y la respuesta sólo lleva referencias; el cliente los descarga
+desde /api/artifacts/<id>/ o los recibe en un cuerpo multipart (ver
+api.responses).
+
+Los ficheros están en un directorio compartido por los workers de la máquina
+(ARTIFACT_DIR). La caducidad de cada uno se guarda en su mtime, así cada
+fichero puede tener su propia duración (ARTIFACT_TTL por defecto, la de los
+resultados de la cola para los trabajos).
+"""
+import mimetypes
+import os
+import re
+import secrets
+import tempfile
+import time
+
+from django.conf import settings
+from django.urls import reverse
+
+from .metrics import metrics
+
+_ID_RE = re.compile(r"^[A-Za-z0-9_-]+\.[a-z0-9]+$")
+
+EXTENSIONS = {
+    "image/png": ".png",
+    "image/jpeg": ".jpg",
+    "image/webp": ".webp",
+    "video/mp4": ".mp4",
+}
+
+
+class ArtifactNotFound(Exception):
+    """
+    El fichero no existe o ya caducó.
+    """
+
+
+class ArtifactStore:
+    """
+    Ficheros generados en un directorio, con caducidad por fichero.
+    """
+
+    def __init__(self, directory=None, ttl=None):
+        self._directory = directory
+        self._ttl = ttl
+        self._last_purge = 0
+
+    @property
+    def directory(self):
+        directory = self._directory or settings.ARTIFACT_DIR
+        if not directory:
+            directory = os.path.join(tempfile.gettempdir(), "bg-remover-artifacts")
+        return str(directory)
+
+    @property
+    def ttl(self):
+        return self._ttl if self._ttl is not None else settings.ARTIFACT_TTL
+
+    def put(self, data, content_type, ttl=None):
+        """
+        Guarda `data` y devuelve su referencia: {"id", "content_type",
+        "size", "url"}. `url` es la ruta de descarga relativa al servidor.
+        """
+        def write(path):
+            with open(path, "wb") as f:
+                f.write(data)
+
+        return self.put_from(write, content_type, ttl)
+
+    def put_from(self, write, content_type, ttl=None):
+        """
+        Como `put`, pero el contenido lo escribe `write(path)` directamente en
+        el fichero (p. ej. ffmpeg), sin pasar por memoria.
+        """
+        directory = self.directory
+        os.makedirs(directory, exist_ok=True)
+        artifact_id = secrets.token_urlsafe(18) + EXTENSIONS.get(content_type, ".bin")
+        path = os.path.join(directory, artifact_id)
+
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        os.close(fd)
+        try:
+            write(tmp_path)
+            size = os.path.getsize(tmp_path)
+            expires = time.time() + (ttl if ttl is not None else self.ttl)
+            os.utime(tmp_path, (expires, expires))
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+        metrics.increment("artifacts_stored_total")
+        metrics.increment("artifacts_stored_bytes_total", size)
+        self._maybe_purge()
+        return {
+            "id": artifact_id,
+            "content_type": content_type,
+            "size": size,
+            "url": reverse("artifact", args=[artifact_id]),
+        }
+
+    def path(self, artifact_id):
+        """
+        Ruta del fichero; lanza ArtifactNotFound si no existe o caducó.
+        """
+        if not _ID_RE.match(artifact_id):
+            raise ArtifactNotFound(artifact_id)
+        path = os.path.join(self.directory, artifact_id)
+        try:
+            if os.path.getmtime(path) < time.time():
+                raise ArtifactNotFound(artifact_id)
+        except FileNotFoundError:
+            raise ArtifactNotFound(artifact_id)
+        return path
+
+    @staticmethod
+    def content_type(artifact_id):
+        return mimetypes.guess_type(artifact_id)[0] or "application/octet-stream"
+
+    def read(self, artifact_id):
+        with open(self.path(artifact_id), "rb") as f:
+            return f.read()
+
+    def _maybe_purge(self, interval=60):
+        now = time.time()
+        if now - self._last_purge > interval:
+            self._last_purge = now
+            self.purge(now)
+
+    def purge(self, now=None):
+        """
+        Borra los ficheros caducados y devuelve cuántos se borraron.
+        """
+        now = now or time.time()
+        removed = 0
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return 0
+        for name in names:
+            path = os.path.join(self.directory, name)
+            try:
+                # Los temporales a medio escribir aún no tienen la caducidad
+                # en el mtime: se dejan una hora de margen
+                if name.endswith(".tmp"):
+                    expired = os.path.getmtime(path) < now - 3600
+                else:
+                    expired = os.path.getmtime(path) < now
+                if expired:
+                    os.unlink(path)
+                    removed += 1
+            except FileNotFoundError:
+                pass
+        return removed
+
+
+# Compartido por todas las vistas del proceso
+artifact_store = ArtifactStore()
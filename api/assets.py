@@ -0,0 +1,119 @@
+"""
+Caché de las imágenes estáticas que usan las vistas (fondo y logos).
+
+Antes cada petición volvía a abrir y decodificar `forest.jpg` (un JPEG de
+casi 2 MB) y los logos, y los redimensionaba. Aquí cada fichero se decodifica
+una vez y las variantes redimensionadas se guardan en un LRU acotado por
+bytes (ASSET_CACHE_MAX_BYTES), con el tamaño de destino como clave.
+
+En cada acceso se comprueba el mtime del fichero: si se sustituye por otro,
+la siguiente petición lo vuelve a cargar sin reiniciar el worker.
+"""
+import os
+import threading
+
+from cachetools import LRUCache
+from django.conf import settings
+from PIL import Image
+
+from .metrics import metrics
+
+API_DIR = os.path.dirname(os.path.abspath(__file__))
+
+LOGO_PATHS = (
+    os.path.join(API_DIR, "media", "images", "lgo2titan.png"),
+    os.path.join(API_DIR, "media", "images", "lgo1titan.png"),
+)
+
+
+def background_path():
+    return os.path.join(settings.BASE_DIR, "static", "images", "forest.jpg")
+
+
+def _image_bytes(image):
+    width, height = image.size
+    return width * height * len(image.getbands())
+
+
+class AssetCache:
+    """
+    Imágenes decodificadas (en RGBA) por ruta y sus variantes redimensionadas.
+    Las imágenes devueltas son compartidas: quien las vaya a modificar debe
+    trabajar sobre una copia.
+    """
+
+    def __init__(self, max_bytes=None):
+        self._max_bytes = max_bytes
+        self._originals = {}
+        self._variants = None
+        self._lock = threading.Lock()
+
+    def _get_variants(self):
+        if self._variants is None:
+            max_bytes = self._max_bytes or settings.ASSET_CACHE_MAX_BYTES
+            self._variants = LRUCache(maxsize=max_bytes, getsizeof=_image_bytes)
+        return self._variants
+
+    def original(self, path):
+        """
+        Imagen RGBA de `path`, decodificada de nuevo sólo si el fichero cambió.
+        """
+        mtime = os.stat(path).st_mtime_ns
+        with self._lock:
+            cached = self._originals.get(path)
+            if cached is not None and cached[0] == mtime:
+                return cached[1], mtime
+        with Image.open(path) as f:
+            image = f.convert("RGBA")
+        metrics.increment("asset_loads_total")
+        with self._lock:
+            self._originals[path] = (mtime, image)
+        return image, mtime
+
+    def _variant(self, path, op, size, build):
+        image, mtime = self.original(path)
+        # El mtime forma parte de la clave: las variantes de un fichero
+        # sustituido dejan de usarse y el LRU acaba descartándolas
+        key = (path, mtime, op, size)
+        with self._lock:
+            variants = self._get_variants()
+            variant = variants.get(key)
+        if variant is not None:
+            metrics.increment("asset_cache_hits_total")
+            return variant
+        metrics.increment("asset_cache_misses_total")
+        variant = build(image)
+        with self._lock:
+            if _image_bytes(variant) <= variants.maxsize:
+                variants[key] = variant
+        return variant
+
+    def resized(self, path, size):
+        """
+        La imagen de `path` redimensionada exactamente a `size`.
+        """
+        return self._variant(path, "resize", tuple(size), lambda image: image.resize(size))
+
+    def thumbnail(self, path, max_size):
+        """
+        La imagen de `path` reducida para caber en `max_size` x `max_size`
+        manteniendo la proporción (como `Image.thumbnail` con LANCZOS).
+        """
+        def build(image):
+            thumb = image.copy()
+            thumb.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
+            return thumb
+
+        return self._variant(path, "thumbnail", max_size, build)
+
+    def preload(self, paths):
+        """
+        Decodifica las imágenes existentes de `paths`.
+        """
+        for path in paths:
+            if os.path.exists(path):
+                self.original(path)
+
+
+# Compartido por todas las vistas del proceso
+asset_cache = AssetCache()
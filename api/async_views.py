@@ -0,0 +1,237 @@
+"""
+Versiones asíncronas (ASGI) de remove-background, remove-background2 y
+jurassic-explorer. Se usan en lugar de las síncronas con API_ASYNC_VIEWS
+(ver api.urls) y hacen lo mismo, con las mismas respuestas:
+
+- La llamada a Gemini usa el cliente asíncrono (ver api.gemini): mientras
+  espera no ocupa ningún hilo, así un worker puede tener cientos de
+  llamadas en curso.
+- El trabajo de CPU (leer la subida, rembg, componer, codificar) se ejecuta
+  en el pool de hilos acotado de api.aio, con un límite por etapa (y desde
+  allí, con PROCESS_POOL_SIZE, en el pool de procesos de api.procpool).
+
+DRF no admite vistas asíncronas: son vistas de Django que responden con
+JsonResponse.
+"""
+import traceback
+
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+
+from .aio import async_single_flight, run_stage, stage
+from .cache import make_key
+from .generated import generated_cache
+from .ingest import UploadError, check_request_size, read_upload
+from .outputs import content_type, extension, output_format
+from .pipeline import PipelineImage
+from .procpool import PoolSaturated, process_pool
+from .responses import artifact_data_urls, artifact_urls, multipart_response, response_mode
+from .sessions import SessionPoolTimeout, resolve_model
+from .tracing import span
+from .views import (
+    JURASSIC_MODEL,
+    JURASSIC_PROMPT,
+    JurassicExplorerView,
+    ProcessingError,
+    RemoveBackgroundView,
+    RemoveBackgroundView2,
+    requested_model,
+)
+
+
+def _error(message, status):
+    return JsonResponse({"error": message}, status=status)
+
+
+def _busy(error):
+    response = _error(str(error), 429)
+    response["Retry-After"] = str(settings.PROCESS_POOL_RETRY_AFTER)
+    return response
+
+
+@method_decorator(csrf_exempt, name="dispatch")
+class AsyncUploadView(View):
+    """
+    Base de las vistas asíncronas que reciben una imagen en el campo `file`.
+    """
+
+    async def parse(self, request):
+        """
+        Procesa el cuerpo multipart en el pool de hilos (puede escribir las
+        subidas grandes en disco). Lanza UploadError si no hay archivo.
+        """
+        check_request_size(request)
+        files = await run_stage("decode", lambda: request.FILES)
+        if "file" not in files:
+            raise UploadError("No se proporcionó ningún archivo")
+
+    async def read_file(self, request):
+        return await run_stage("decode", read_upload, request.FILES["file"])
+
+    async def render(self, request, refs, mode):
+        """
+        Igual que api.responses.render_artifacts, sin DRF.
+        """
+        if mode == "multipart":
+            return multipart_response(refs)
+        if mode == "dataurl":
+            return JsonResponse(await run_stage("encode", artifact_data_urls, refs))
+        return JsonResponse(artifact_urls(request, refs))
+
+
+class AsyncRemoveBackgroundView(AsyncUploadView):
+    """
+    Versión asíncrona de RemoveBackgroundView.
+    """
+    sync_view = RemoveBackgroundView()
+
+    async def post(self, request, *args, **kwargs):
+        try:
+            await self.parse(request)
+        except UploadError as e:
+            return _error(str(e), e.status_code)
+
+        try:
+            model_name = requested_model(request, self.sync_view.endpoint)
+            output = output_format(request)
+        except ValueError as e:
+            return _error(str(e), 400)
+
+        try:
+            input_image_bytes = await self.read_file(request)
+            output_image_bytes = await run_stage(
+                "rembg", self.sync_view.process_image, input_image_bytes, model_name, output
+            )
+        except UploadError as e:
+            return _error(str(e), e.status_code)
+        except SessionPoolTimeout as e:
+            return _error(str(e), 503)
+        except PoolSaturated as e:
+            return _busy(e)
+        except Exception as e:
+            return _error(f"Error al procesar la imagen: {str(e)}", 500)
+
+        response = HttpResponse(output_image_bytes, content_type=content_type(output))
+        filename = ("mask" if output == "mask" else "no-bg") + extension(output)
+        response["Content-Disposition"] = f'attachment; filename="{filename}"'
+        return response
+
+
+class AsyncResultView(AsyncUploadView):
+    """
+    Base de las vistas que devuelven imagen y video como ficheros.
+    """
+
+    async def post(self, request, *args, **kwargs):
+        try:
+            await self.parse(request)
+        except UploadError as e:
+            return _error(str(e), e.status_code)
+
+        try:
+            mode = response_mode(request)
+            params = self.params(request)
+        except ValueError as e:
+            return _error(str(e), 400)
+
+        try:
+            input_image_bytes = await self.read_file(request)
+            refs = await self.build_result(input_image_bytes, **params)
+            return await self.render(request, refs, mode)
+        except UploadError as e:
+            return _error(str(e), e.status_code)
+        except ProcessingError as e:
+            return _error(str(e), 500)
+        except PoolSaturated as e:
+            return _busy(e)
+        except Exception as e:
+            print(f"--- Error en {type(self).__name__} ---")
+            traceback.print_exc()
+            print("------------------------------------")
+            return _error(f"Error al procesar la imagen: {str(e)}", 500)
+
+    def params(self, request):
+        return {}
+
+
+class AsyncRemoveBackgroundView2(AsyncResultView):
+    """
+    Versión asíncrona de RemoveBackgroundView2.
+    """
+    sync_view = RemoveBackgroundView2()
+
+    def params(self, request):
+        return {"model_name": requested_model(request, self.sync_view.endpoint)}
+
+    async def build_result(self, input_image_bytes, model_name=None):
+        model_name = model_name or resolve_model(None, self.sync_view.endpoint)
+        key = make_key(input_image_bytes, model_name, view="remove-background2", ttl=None)
+
+        async def compute():
+            if process_pool.enabled:
+                # Todo en un proceso del pool
+                return await run_stage(
+                    "rembg", self.sync_view.compute_result, input_image_bytes, None, model_name
+                )
+            # Las etapas se pasan la imagen ya decodificada (ver api.pipeline)
+            original = PipelineImage(input_image_bytes)
+            no_bg = await run_stage("rembg", self.sync_view.cutout, original, model_name)
+            return await run_stage("encode", self.sync_view.compose_result, original, no_bg)
+
+        return await async_single_flight.do(key, compute)
+
+
+class AsyncJurassicExplorerView(AsyncResultView):
+    """
+    Versión asíncrona de JurassicExplorerView.
+    """
+    sync_view = JurassicExplorerView()
+
+    async def build_result(self, input_image_bytes):
+        key = make_key(input_image_bytes, None, view="jurassic-explorer", ttl=None)
+
+        async def compute():
+            generation_key = self.sync_view.generation_key(input_image_bytes)
+            jurassic_image_bytes = await run_stage("decode", generated_cache.get, generation_key)
+            if jurassic_image_bytes is None:
+                jurassic_image_bytes = await self.generate_jurassic_explorer(input_image_bytes)
+                if jurassic_image_bytes is not None:
+                    await run_stage(
+                        "encode", generated_cache.set, generation_key, "image",
+                        jurassic_image_bytes, **self.sync_view.generation_params()
+                    )
+            return await run_stage(
+                "encode", self.sync_view.compose_result, input_image_bytes,
+                jurassic_image_bytes, None, generation_key
+            )
+
+        return await async_single_flight.do(key, compute)
+
+    async def generate_jurassic_explorer(self, image_bytes):
+        """
+        Como JurassicExplorerView.generate_jurassic_explorer, con el cliente
+        asíncrono de api.gemini.
+        """
+        try:
+            async with stage("gemini"):
+                print("🎯 Generando explorador del Jurásico...")
+                from .gemini import agenerate_image
+
+                with span("gemini"):
+                    image_data = await agenerate_image(image_bytes, JURASSIC_PROMPT, JURASSIC_MODEL)
+        except ImportError as e:
+            print(f"❌ Error de importación: {e}")
+            print("Instala la librería: pip install google-genai")
+            return None
+        except Exception as e:
+            print(f"❌ Error en generate_jurassic_explorer: {e}")
+            return None
+
+        if image_data:
+            print("✅ ¡Explorador del Jurásico generado exitosamente!")
+        else:
+            print("⚠️ No se generó imagen en la respuesta")
+        return image_data
@@ -0,0 +1,179 @@
+"""
+Eliminación de fondo por lotes.
+
+Los modelos de la familia u2net (y bria-rmbg o isnet) redimensionan
+cualquier imagen a un tensor de tamaño fijo antes de la inferencia, así que
+los tensores de varias imágenes se pueden apilar y resolver con una sola
+ejecución de ONNX Runtime. El pre y postprocesado reproducen los de rembg
+(`session.predict` + `naive_cutout`), por lo que el resultado es el mismo
+que el de `remove` imagen a imagen (y se guarda en el mismo caché).
+
+Con REMBG_FAST_MASK la máscara se calcula sobre una copia reducida de cada
+imagen y sólo el alfa se amplía al tamaño original (ver api.masks).
+"""
+import zipfile
+from io import BytesIO
+
+import numpy as np
+from django.conf import settings
+from PIL import Image
+from rembg.bg import fix_image_orientation
+
+from .cache import make_key, result_cache
+from .masks import mask_params, upsample_mask, working_image
+from .metrics import metrics
+from .outputs import encode_output, output_params
+from .sessions import session_registry
+from .tracing import span
+
+# (mean, std, size) de la normalización que usa cada modelo en rembg
+_IMAGENET_NORM = ((0.485, 0.456, 0.406), (0.229, 0.224, 0.225), (320, 320))
+BATCHABLE_MODELS = {
+    "u2net": _IMAGENET_NORM,
+    "u2netp": _IMAGENET_NORM,
+    "u2net_human_seg": _IMAGENET_NORM,
+    "silueta": _IMAGENET_NORM,
+    "isnet-general-use": ((0.5, 0.5, 0.5), (1.0, 1.0, 1.0), (1024, 1024)),
+    "bria-rmbg": (_IMAGENET_NORM[0], _IMAGENET_NORM[1], (1024, 1024)),
+}
+
+
+def _supports_batching(session, model_name):
+    if model_name not in BATCHABLE_MODELS:
+        return False
+    # Algunos modelos se exportan con el tamaño de lote fijo a 1
+    batch_dim = session.inner_session.get_inputs()[0].shape[0]
+    return not isinstance(batch_dim, int) or batch_dim > 1
+
+
+def _mask_from_prediction(pred, size):
+    ma = np.max(pred)
+    mi = np.min(pred)
+    pred = (pred - mi) / (ma - mi)
+    mask = Image.fromarray((pred.clip(0, 1) * 255).astype("uint8"), mode="L")
+    return mask.resize(size, Image.Resampling.LANCZOS)
+
+
+def predict_masks(session, model_name, images):
+    """
+    Devuelve una máscara por imagen. Agrupa los tensores del mismo tamaño en
+    lotes de hasta REMBG_INFERENCE_BATCH_SIZE y los resuelve juntos; si el
+    modelo no admite lotes, cae en `session.predict` imagen a imagen.
+    """
+    if not _supports_batching(session, model_name):
+        return [session.predict(img)[0] for img in images]
+
+    mean, std, size = BATCHABLE_MODELS[model_name]
+    input_name = session.inner_session.get_inputs()[0].name
+    tensors = [session.normalize(img, mean, std, size)[input_name] for img in images]
+
+    groups = {}
+    for index, tensor in enumerate(tensors):
+        groups.setdefault(tensor.shape, []).append(index)
+
+    chunk_size = settings.REMBG_INFERENCE_BATCH_SIZE
+    masks = [None] * len(images)
+    for indexes in groups.values():
+        for start in range(0, len(indexes), chunk_size):
+            chunk = indexes[start:start + chunk_size]
+            batch = np.concatenate([tensors[i] for i in chunk], axis=0)
+            pred = session.inner_session.run(None, {input_name: batch})[0][:, 0, :, :]
+            metrics.increment("rembg_batch_runs_total", model=model_name)
+            metrics.increment("rembg_batch_images_total", len(chunk), model=model_name)
+            for offset, i in enumerate(chunk):
+                masks[i] = _mask_from_prediction(pred[offset], images[i].size)
+    return masks
+
+
+def image_masks(images, model_name):
+    """
+    Máscara a tamaño completo de cada imagen ya decodificada (y orientada),
+    en el mismo orden.
+    """
+    with span("decode"):
+        if settings.REMBG_FAST_MASK:
+            inputs = [working_image(img) for img in images]
+        else:
+            inputs = images
+
+    with span("rembg"), session_registry.session(model_name) as session:
+        masks = predict_masks(session, model_name, inputs)
+
+    results = []
+    for img, small, mask in zip(images, inputs, masks):
+        with span("mask"):
+            results.append(upsample_mask(mask, small, img))
+    return results
+
+
+def cutout_images(images_bytes, model_name, output="png"):
+    """
+    Elimina el fondo de varias imágenes, sin caché, y devuelve los resultados
+    en el formato `output` (ver api.outputs) y en el mismo orden.
+    """
+    with span("decode"):
+        images = [fix_image_orientation(Image.open(BytesIO(data))) for data in images_bytes]
+
+    results = []
+    for img, mask in zip(images, image_masks(images, model_name)):
+        with span("encode"):
+            results.append(encode_output(img, mask, output))
+    return results
+
+
+def remove_background_batch(images_bytes, model_name=None, output="png"):
+    """
+    Elimina el fondo de varias imágenes y devuelve los resultados en el
+    formato `output` y en el mismo orden. El resultado es el mismo que el de
+    la vista individual, así que comparten caché: sólo se procesan las
+    imágenes que no están en él.
+    """
+    model_name = model_name or settings.REMBG_DEFAULT_MODEL
+    params = {**mask_params(), **output_params(output)}
+    keys = [make_key(data, model_name, **params) for data in images_bytes]
+    results = [result_cache.get(key) for key in keys]
+    missing = [index for index, result in enumerate(results) if result is None]
+    if not missing:
+        return results
+
+    computed = cutout_images([images_bytes[index] for index in missing], model_name, output)
+    for index, result in zip(missing, computed):
+        results[index] = result
+        result_cache.set(keys[index], result)
+    return results
+
+
+class _ZipChunkWriter:
+    """
+    Destino no seekable para zipfile: acumula lo escrito hasta que el
+    generador lo entrega al cliente.
+    """
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def iter_zip(named_files):
+    """
+    Genera un ZIP por trozos a partir de pares (nombre, bytes), fichero a
+    fichero, para usarlo con StreamingHttpResponse. Los PNG ya van
+    comprimidos, así que se guardan sin volver a comprimir.
+    """
+    writer = _ZipChunkWriter()
+    with zipfile.ZipFile(writer, mode="w", compression=zipfile.ZIP_STORED) as archive:
+        for name, data in named_files:
+            archive.writestr(name, data)
+            yield writer.drain()
+    yield writer.drain()
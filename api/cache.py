@@ -0,0 +1,205 @@
+"""
+Caché de resultados de la eliminación de fondo.
+
+Los usuarios suben muchas veces las mismas fotos de producto. El resultado de
+rembg depende sólo de los bytes de entrada, del modelo y de los parámetros,
+así que se guarda con una clave que es el hash de todo ello y las siguientes
+subidas se sirven sin volver a ejecutar el modelo.
+
+Hay dos niveles:
+
+- Memoria: LRU acotado por el tamaño total en bytes de los resultados
+  (RESULT_CACHE_MAX_BYTES), propio de cada worker.
+- Disco (opcional, RESULT_CACHE_DIR): un fichero por resultado, compartido
+  por los workers de la máquina y con caducidad (RESULT_CACHE_TTL).
+"""
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from cachetools import LRUCache
+from django.conf import settings
+
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def make_key(data, model_name, **params):
+    """
+    Clave de caché para los bytes `data` procesados con `model_name` y
+    `params`.
+    """
+    digest = hashlib.sha256(data)
+    digest.update(json.dumps([model_name, params], sort_keys=True).encode())
+    return digest.hexdigest()
+
+
+class DiskCache:
+    """
+    Nivel en disco: un fichero por clave, repartidos en subdirectorios por
+    los dos primeros caracteres del hash. La antigüedad se mide con el mtime.
+    """
+
+    def __init__(self, directory, ttl):
+        self.directory = str(directory)
+        self.ttl = ttl
+        self._last_purge = 0
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def _expired(self, mtime, now):
+        return self.ttl is not None and now - mtime > self.ttl
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            if self._expired(os.path.getmtime(path), time.time()):
+                os.unlink(path)
+                return None
+            with open(path, "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def set(self, key, value):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Se escribe en un temporal y se renombra: otro worker nunca lee un
+        # fichero a medias
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(value)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        self._maybe_purge()
+
+    def _maybe_purge(self, interval=60 * 60):
+        now = time.time()
+        if now - self._last_purge > interval:
+            self._last_purge = now
+            self.purge(now)
+
+    def purge(self, now=None):
+        """
+        Borra los ficheros caducados y devuelve cuántos se borraron.
+        """
+        now = now or time.time()
+        removed = 0
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    if self._expired(os.path.getmtime(path), now):
+                        os.unlink(path)
+                        removed += 1
+                except FileNotFoundError:
+                    pass
+        return removed
+
+
+class ResultCache:
+    """
+    Caché de dos niveles para resultados en bytes. Los aciertos en disco se
+    copian a memoria. Los niveles se crean con el primer uso, no al importar
+    el módulo.
+    """
+
+    def __init__(self, max_bytes=None, directory=None, ttl=None):
+        self._max_bytes = max_bytes
+        self._directory = directory
+        self._ttl = ttl
+        self._memory = None
+        self._disk = None
+        self._configured = False
+        self._lock = threading.Lock()
+
+    def _configure(self):
+        with self._lock:
+            if self._configured:
+                return
+            if self._max_bytes is None:
+                self._max_bytes = settings.RESULT_CACHE_MAX_BYTES
+            directory = self._directory or settings.RESULT_CACHE_DIR
+            ttl = self._ttl if self._ttl is not None else settings.RESULT_CACHE_TTL
+            if self._max_bytes:
+                self._memory = LRUCache(maxsize=self._max_bytes, getsizeof=len)
+            if directory:
+                self._disk = DiskCache(directory, ttl)
+            self._configured = True
+
+    def _memory_get(self, key):
+        if self._memory is None:
+            return None
+        with self._lock:
+            return self._memory.get(key)
+
+    def _memory_set(self, key, value):
+        # LRUCache rechaza valores más grandes que todo el caché
+        if self._memory is None or len(value) > self._max_bytes:
+            return
+        with self._lock:
+            self._memory[key] = value
+
+    def get(self, key):
+        self._configure()
+        value = self._memory_get(key)
+        if value is not None:
+            metrics.increment("result_cache_hits_total", tier="memory")
+            return value
+        if self._disk is not None:
+            try:
+                value = self._disk.get(key)
+            except OSError as e:
+                logger.warning("No se pudo leer del caché en disco: %s", e)
+            if value is not None:
+                metrics.increment("result_cache_hits_total", tier="disk")
+                self._memory_set(key, value)
+                return value
+        metrics.increment("result_cache_misses_total")
+        return None
+
+    def set(self, key, value):
+        self._configure()
+        self._memory_set(key, value)
+        if self._disk is not None:
+            try:
+                self._disk.set(key, value)
+            except OSError as e:
+                logger.warning("No se pudo escribir en el caché en disco: %s", e)
+
+    def get_or_set(self, key, compute):
+        """
+        Devuelve el valor de `key` o lo calcula con `compute()` y lo guarda.
+        """
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.set(key, value)
+        return value
+
+    def clear(self):
+        """
+        Vacía el nivel en memoria.
+        """
+        with self._lock:
+            if self._memory is not None:
+                self._memory.clear()
+
+    @property
+    def memory_bytes(self):
+        with self._lock:
+            return self._memory.currsize if self._memory is not None else 0
+
+
+# Caché compartido por todas las vistas del proceso
+result_cache = ResultCache()
@@ -0,0 +1,55 @@
+"""
+Endpoints activos en el despliegue.
+
+Con API_ENABLED_ENDPOINTS un despliegue sirve sólo algunos endpoints (p. ej.
+pods que sólo quitan fondos con `remove-background`). Sólo moviepy y
+google-genai se importan al usarlos por primera vez (con el primer video y
+con la primera llamada a Gemini), así que un despliegue sin esos endpoints
+no los carga nunca, ni siquiera en el warm-up. rembg (y con él numpy y ONNX
+Runtime) se importa al arrancar, en ApiConfig.ready, si algún endpoint
+activo lo usa: pymatting deja colgado el cierre del intérprete si se
+importa por primera vez desde otro hilo. Sin endpoints de rembg no se
+importa. `python manage.py bench_imports` mide el arranque de cada
+combinación.
+"""
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+# Endpoints que se pueden desactivar (nombres de las URLs; `jobs` incluye
+# el envío y la consulta de trabajos). health y artifacts están siempre.
+ENDPOINTS = (
+    "remove-background",
+    "remove-background-batch",
+    "remove-background2",
+    "jurassic-explorer",
+    "jobs",
+)
+# Los que usan rembg y los que generan video (moviepy y ffmpeg)
+REMBG_ENDPOINTS = ("remove-background", "remove-background-batch", "remove-background2")
+VIDEO_ENDPOINTS = ("remove-background2", "jurassic-explorer")
+
+
+def enabled_endpoints():
+    """
+    Endpoints activos: los de API_ENABLED_ENDPOINTS, o todos si está vacío.
+    """
+    configured = settings.API_ENABLED_ENDPOINTS
+    unknown = set(configured) - set(ENDPOINTS)
+    if unknown:
+        raise ImproperlyConfigured(
+            f"API_ENABLED_ENDPOINTS: endpoints desconocidos {', '.join(sorted(unknown))}. "
+            f"Opciones: {', '.join(ENDPOINTS)}"
+        )
+    return [name for name in ENDPOINTS if not configured or name in configured]
+
+
+def is_enabled(name):
+    return name in enabled_endpoints()
+
+
+def rembg_enabled():
+    return any(is_enabled(name) for name in REMBG_ENDPOINTS)
+
+
+def video_enabled():
+    return any(is_enabled(name) for name in VIDEO_ENDPOINTS)
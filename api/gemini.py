@@ -0,0 +1,269 @@
+"""
+Cliente de Gemini compartido por las vistas que generan imágenes.
+
+- Un único `genai.Client` por proceso (y uno por event loop para las vistas
+  asíncronas): las conexiones HTTP se reutilizan entre peticiones
+  (keep-alive) en lugar de abrir una conexión TLS nueva cada vez.
+- La imagen se reduce a GEMINI_MAX_IMAGE_DIMENSION y se recodifica en JPEG
+  antes de enviarla: el modelo no aprovecha más resolución y cuesta menos
+  subirla.
+- Si ocupa menos de GEMINI_INLINE_MAX_BYTES va en la propia petición
+  (`Part.from_bytes`); si no, se sube antes con la API de ficheros.
+- Los errores transitorios (429, 5xx, errores de red) se reintentan con
+  espera exponencial (GEMINI_RETRY_ATTEMPTS intentos en total).
+
+Con GEMINI_BASE_URL se puede apuntar a otro servidor, por ejemplo al de
+pruebas: `python manage.py gemini_stub`.
+"""
+import asyncio
+import os
+import threading
+import time
+import weakref
+from io import BytesIO
+
+import httpx
+import tenacity
+from django.conf import settings
+from PIL import ExifTags, Image, ImageOps
+
+from .metrics import metrics
+
+# Códigos de error de la API que merece la pena reintentar
+RETRYABLE_STATUS_CODES = (408, 429, 500, 502, 503, 504)
+
+_client = None
+_client_lock = threading.Lock()
+# El cliente asíncrono de httpx pertenece a un event loop
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def _new_client():
+    """
+    Cliente nuevo con GOOGLE_API_KEY, o None si no está configurada.
+    """
+    from google import genai
+    from google.genai import types
+
+    api_key = os.getenv("GOOGLE_API_KEY")
+    if not api_key:
+        return None
+
+    limits = httpx.Limits(
+        max_connections=settings.GEMINI_MAX_CONNECTIONS,
+        max_keepalive_connections=settings.GEMINI_MAX_CONNECTIONS,
+        keepalive_expiry=settings.GEMINI_KEEPALIVE_SECONDS,
+    )
+    http_options = types.HttpOptions(
+        base_url=settings.GEMINI_BASE_URL,
+        timeout=int(settings.GEMINI_TIMEOUT * 1000),
+        client_args={"limits": limits},
+        async_client_args={"limits": limits},
+    )
+    return genai.Client(api_key=api_key, http_options=http_options)
+
+
+def client():
+    """
+    Cliente síncrono del proceso (None sin GOOGLE_API_KEY).
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = _new_client()
+        return _client
+
+
+def async_client():
+    """
+    Cliente asíncrono (`client.aio`) del event loop actual (None sin
+    GOOGLE_API_KEY).
+    """
+    loop = asyncio.get_running_loop()
+    if loop not in _async_clients:
+        new_client = _new_client()
+        if new_client is None:
+            return None
+        _async_clients[loop] = new_client
+    return _async_clients[loop].aio
+
+
+def prepare_image(image_bytes):
+    """
+    Imagen lista para enviar: orientada según el EXIF, reducida a
+    GEMINI_MAX_IMAGE_DIMENSION y en JPEG. Devuelve (bytes, mime type); un
+    JPEG que ya cumple se envía tal cual.
+    """
+    max_size = settings.GEMINI_MAX_IMAGE_DIMENSION
+    img = Image.open(BytesIO(image_bytes))
+    orientation = img.getexif().get(ExifTags.Base.Orientation, 1)
+    if img.format == "JPEG" and orientation == 1 and max(img.size) <= max_size:
+        return image_bytes, "image/jpeg"
+
+    # En JPEG decodifica directamente a escala reducida
+    img.draft("RGB", (max_size, max_size))
+    img = ImageOps.exif_transpose(img)
+    img.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
+    if img.mode in ("RGBA", "LA", "P"):
+        # JPEG no tiene alfa: las zonas transparentes quedan en blanco
+        img = img.convert("RGBA")
+        background = Image.new("RGB", img.size, (255, 255, 255))
+        background.paste(img, None, img)
+        img = background
+    elif img.mode != "RGB":
+        img = img.convert("RGB")
+
+    buffer = BytesIO()
+    img.save(buffer, "JPEG", quality=settings.GEMINI_JPEG_QUALITY)
+    return buffer.getvalue(), "image/jpeg"
+
+
+def _retryable(error):
+    from google.genai import errors
+
+    if isinstance(error, errors.APIError):
+        return error.code in RETRYABLE_STATUS_CODES
+    return isinstance(error, httpx.TransportError)
+
+
+def _before_sleep(retry_state):
+    error = retry_state.outcome.exception()
+    print(f"🔁 Reintentando Gemini ({retry_state.attempt_number}): {error}")
+    metrics.increment("gemini_retries_total")
+
+
+def _retry_options():
+    return {
+        "stop": tenacity.stop_after_attempt(settings.GEMINI_RETRY_ATTEMPTS),
+        "wait": tenacity.wait_exponential_jitter(
+            initial=settings.GEMINI_RETRY_INITIAL_DELAY,
+            max=settings.GEMINI_RETRY_MAX_DELAY,
+        ),
+        "retry": tenacity.retry_if_exception(_retryable),
+        "before_sleep": _before_sleep,
+        "reraise": True,
+    }
+
+
+def image_from_chunk(chunk):
+    """
+    Bytes de la imagen de un fragmento de la respuesta de Gemini, o None si
+    el fragmento no trae imagen (el texto se registra en la consola).
+    """
+    if not (chunk.candidates and
+            chunk.candidates[0].content and
+            chunk.candidates[0].content.parts):
+        return None
+
+    part = chunk.candidates[0].content.parts[0]
+    if part.inline_data and part.inline_data.data:
+        return part.inline_data.data
+
+    if chunk.text:
+        print(f"📝 Texto generado: {chunk.text}")
+    return None
+
+
+def _contents(types, prompt, image_part):
+    return [types.Content(role="user", parts=[types.Part.from_text(text=prompt), image_part])]
+
+
+def _config(types):
+    return types.GenerateContentConfig(response_modalities=["IMAGE", "TEXT"])
+
+
+def _inline(data):
+    inline = len(data) <= settings.GEMINI_INLINE_MAX_BYTES
+    metrics.increment("gemini_images_total", mode="inline" if inline else "upload")
+    return inline
+
+
+def generate_image(image_bytes, prompt, model):
+    """
+    Pide a `model` una imagen a partir de `image_bytes` y `prompt`. Devuelve
+    los bytes de la primera imagen de la respuesta, o None si no hay
+    GOOGLE_API_KEY o la respuesta no trae imagen. Los errores que persisten
+    tras los reintentos se propagan.
+    """
+    from google.genai import types
+
+    gemini = client()
+    if gemini is None:
+        print("❌ No se encontró GOOGLE_API_KEY")
+        return None
+
+    data, mime_type = prepare_image(image_bytes)
+    retrying = tenacity.Retrying(**_retry_options())
+    if _inline(data):
+        image_part = types.Part.from_bytes(data=data, mime_type=mime_type)
+    else:
+        uploaded_file = retrying(
+            lambda: gemini.files.upload(
+                file=BytesIO(data), config=types.UploadFileConfig(mime_type=mime_type)
+            )
+        )
+        image_part = types.Part.from_uri(file_uri=uploaded_file.uri, mime_type=mime_type)
+
+    def attempt():
+        stream = gemini.models.generate_content_stream(
+            model=model,
+            contents=_contents(types, prompt, image_part),
+            config=_config(types),
+        )
+        # Se lee la respuesta hasta el final: cortarla a medias cierra la
+        # conexión en lugar de devolverla al pool
+        image_data = None
+        for chunk in stream:
+            image_data = image_data or image_from_chunk(chunk)
+        return image_data
+
+    start = time.perf_counter()
+    try:
+        return retrying(attempt)
+    finally:
+        metrics.observe("gemini_request_seconds", time.perf_counter() - start, model=model)
+
+
+async def agenerate_image(image_bytes, prompt, model):
+    """
+    Versión asíncrona de `generate_image`. La preparación de la imagen es
+    trabajo de CPU y se hace en el pool de hilos de api.aio.
+    """
+    from google.genai import types
+
+    from .aio import run_stage
+
+    gemini = async_client()
+    if gemini is None:
+        print("❌ No se encontró GOOGLE_API_KEY")
+        return None
+
+    data, mime_type = await run_stage("decode", prepare_image, image_bytes)
+    retrying = tenacity.AsyncRetrying(**_retry_options())
+    if _inline(data):
+        image_part = types.Part.from_bytes(data=data, mime_type=mime_type)
+    else:
+        async def upload():
+            return await gemini.files.upload(
+                file=BytesIO(data), config=types.UploadFileConfig(mime_type=mime_type)
+            )
+
+        uploaded_file = await retrying(upload)
+        image_part = types.Part.from_uri(file_uri=uploaded_file.uri, mime_type=mime_type)
+
+    async def attempt():
+        stream = await gemini.models.generate_content_stream(
+            model=model,
+            contents=_contents(types, prompt, image_part),
+            config=_config(types),
+        )
+        image_data = None
+        async for chunk in stream:
+            image_data = image_data or image_from_chunk(chunk)
+        return image_data
+
+    start = time.perf_counter()
+    try:
+        return await retrying(attempt)
+    finally:
+        metrics.observe("gemini_request_seconds", time.perf_counter() - start, model=model)
@@ -0,0 +1,296 @@
+"""
+Caché persistente de las imágenes generadas con Gemini.
+
+Generar la imagen es el paso más lento y caro: si alguien vuelve a subir la
+misma foto, se reutiliza la imagen ya generada, y también lo que se calcula
+a partir de ella (la imagen con logos y el video de transición). Cada
+resultado se guarda en SQLite (GENERATED_CACHE_PATH, compartido por los
+workers de la máquina) con:
+
+- `key`: hash de la imagen subida, el modelo y la versión del prompt (ver
+  `generation_key`). Cambiar el prompt y su versión invalida lo anterior.
+- `kind`: qué se guarda (`image`, `logos`, `video`...).
+
+Las imágenes van en la tabla; los videos, que pueden ocupar decenas de MB,
+se copian a un fichero junto a la base de datos (`<ruta>.files/`) y la
+tabla sólo guarda su nombre (`set_file` / `get_file`), así no pasan por
+memoria ni engordan el fichero SQLite.
+
+El tamaño total está acotado (GENERATED_CACHE_MAX_BYTES): al pasarse se
+borran las entradas usadas hace más tiempo. `python manage.py
+purge_generated` vacía el caché o parte de él.
+"""
+import logging
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from .cache import make_key
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def generation_key(image_bytes, model, prompt_version):
+    """
+    Clave de lo generado por `model` a partir de `image_bytes` con la versión
+    `prompt_version` del prompt.
+    """
+    return make_key(image_bytes, model, prompt_version=prompt_version)
+
+
+class GeneratedCache:
+    """
+    Resultados en bytes en una tabla de SQLite (o en ficheros referenciados
+    desde ella), con expulsión de los menos usados recientemente. Cada operación abre su propia conexión, así que se
+    puede usar desde cualquier hilo y desde varios procesos. Sin ruta
+    configurada no guarda nada.
+    """
+
+    def __init__(self, path=None, max_bytes=None):
+        self._path = path
+        self._max_bytes = max_bytes
+        # Rutas en las que ya se creó la tabla
+        self._ready = set()
+        self._lock = threading.Lock()
+
+    @property
+    def path(self):
+        path = self._path or settings.GENERATED_CACHE_PATH
+        return str(path) if path else None
+
+    @property
+    def files_directory(self):
+        path = self.path
+        return path + ".files" if path else None
+
+    @property
+    def max_bytes(self):
+        return self._max_bytes if self._max_bytes is not None else settings.GENERATED_CACHE_MAX_BYTES
+
+    @contextmanager
+    def _connection(self):
+        path = self.path
+        conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+        try:
+            with self._lock:
+                if path not in self._ready:
+                    self._create(conn)
+                    self._ready.add(path)
+            yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _create(conn):
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS generated (
+                key TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                model TEXT,
+                prompt_version TEXT,
+                data BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL,
+                PRIMARY KEY (key, kind)
+            )
+            """
+        )
+        # Tablas creadas antes de guardar ficheros
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(generated)")}
+        if "file" not in columns:
+            conn.execute("ALTER TABLE generated ADD COLUMN file TEXT")
+        conn.execute("CREATE INDEX IF NOT EXISTS generated_lru ON generated (accessed_at)")
+
+    def _remove_files(self, names):
+        for name in names:
+            if name:
+                try:
+                    os.unlink(os.path.join(self.files_directory, name))
+                except FileNotFoundError:
+                    pass
+
+    def _lookup(self, key, kind, column):
+        if not self.path:
+            return None
+        try:
+            with self._connection() as conn:
+                row = conn.execute(
+                    f"SELECT {column} FROM generated WHERE key = ? AND kind = ?", (key, kind)
+                ).fetchone()
+                if row is not None and row[0] is not None:
+                    conn.execute(
+                        "UPDATE generated SET accessed_at = ? WHERE key = ? AND kind = ?",
+                        (time.time(), key, kind),
+                    )
+        except sqlite3.Error as e:
+            logger.warning("No se pudo leer del caché de imágenes generadas: %s", e)
+            return None
+
+        if row is None or row[0] is None:
+            metrics.increment("generated_cache_misses_total", kind=kind)
+            return None
+        metrics.increment("generated_cache_hits_total", kind=kind)
+        return row[0]
+
+    def get(self, key, kind="image"):
+        """
+        Bytes guardados para (`key`, `kind`), o None.
+        """
+        # Las entradas de `set_file` no tienen el contenido en la tabla
+        return self._lookup(key, kind, "CASE WHEN file IS NULL THEN data END")
+
+    def get_file(self, key, kind):
+        """
+        Ruta del fichero guardado con `set_file` para (`key`, `kind`), o
+        None. Otro proceso puede expulsarlo en cualquier momento: quien lo
+        lea debe tratar FileNotFoundError como un fallo de caché.
+        """
+        name = self._lookup(key, kind, "file")
+        return os.path.join(self.files_directory, name) if name else None
+
+    def set(self, key, kind, data, model=None, prompt_version=None):
+        """
+        Guarda `data` para (`key`, `kind`) y expulsa lo necesario para no
+        pasar de GENERATED_CACHE_MAX_BYTES.
+        """
+        if not self.path or len(data) > self.max_bytes:
+            return
+        self._insert(key, kind, model, prompt_version, data, None, len(data))
+
+    def set_file(self, key, kind, source, model=None, prompt_version=None):
+        """
+        Como `set`, pero copia el fichero `source` junto a la base de datos
+        en lugar de guardar su contenido en la tabla.
+        """
+        if not self.path:
+            return
+        size = os.path.getsize(source)
+        if size > self.max_bytes:
+            return
+        directory = self.files_directory
+        name = f"{key}.{kind}"
+        try:
+            os.makedirs(directory, exist_ok=True)
+            # Copia a un temporal y renombra: quien lea el fichero nunca lo
+            # ve a medias
+            fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+            os.close(fd)
+            try:
+                shutil.copyfile(source, tmp_path)
+                os.replace(tmp_path, os.path.join(directory, name))
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+        except OSError as e:
+            logger.warning("No se pudo escribir en el caché de imágenes generadas: %s", e)
+            return
+        self._insert(key, kind, model, prompt_version, None, name, size)
+
+    def _insert(self, key, kind, model, prompt_version, data, name, size):
+        now = time.time()
+        try:
+            with self._connection() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO generated "
+                    "(key, kind, model, prompt_version, data, size, created_at, accessed_at, file) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (key, kind, model, None if prompt_version is None else str(prompt_version),
+                     b"" if data is None else data, size, now, now, name),
+                )
+                self._evict(conn, self.max_bytes)
+        except sqlite3.Error as e:
+            logger.warning("No se pudo escribir en el caché de imágenes generadas: %s", e)
+
+    def get_or_set(self, key, kind, compute, **params):
+        """
+        Devuelve lo guardado para (`key`, `kind`) o lo calcula con
+        `compute()` y lo guarda (salvo que devuelva None).
+        """
+        value = self.get(key, kind)
+        if value is None:
+            value = compute()
+            if value is not None:
+                self.set(key, kind, value, **params)
+        return value
+
+    def _evict(self, conn, max_bytes):
+        """
+        Borra las entradas usadas hace más tiempo hasta que el total ocupa
+        como mucho `max_bytes`. Devuelve cuántas se borraron.
+        """
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM generated").fetchone()[0]
+        if total <= max_bytes:
+            return 0
+        removed = 0
+        rows = conn.execute(
+            "SELECT key, kind, size, file FROM generated ORDER BY accessed_at"
+        ).fetchall()
+        for key, kind, size, name in rows:
+            if total <= max_bytes:
+                break
+            conn.execute("DELETE FROM generated WHERE key = ? AND kind = ?", (key, kind))
+            self._remove_files([name])
+            total -= size
+            removed += 1
+        metrics.increment("generated_cache_evictions_total", removed)
+        return removed
+
+    def purge(self, model=None, keep_prompt_version=None, older_than=None, max_bytes=None):
+        """
+        Borra entradas y devuelve cuántas. Sin argumentos, todas; si no,
+        las de `model`, las de otra versión del prompt que
+        `keep_prompt_version`, las no usadas en `older_than` segundos, y
+        las menos usadas que sobren de `max_bytes`.
+        """
+        if not self.path:
+            return 0
+        conditions, params = [], []
+        if model is not None:
+            conditions.append("model = ?")
+            params.append(model)
+        if keep_prompt_version is not None:
+            conditions.append("(prompt_version IS NULL OR prompt_version != ?)")
+            params.append(str(keep_prompt_version))
+        if older_than is not None:
+            conditions.append("accessed_at < ?")
+            params.append(time.time() - older_than)
+
+        with self._connection() as conn:
+            removed = 0
+            if conditions or max_bytes is None:
+                where = " AND ".join(conditions) or "1"
+                names = [row[0] for row in conn.execute(
+                    f"SELECT file FROM generated WHERE file IS NOT NULL AND {where}", params
+                )]
+                removed += conn.execute(f"DELETE FROM generated WHERE {where}", params).rowcount
+                self._remove_files(names)
+            if max_bytes is not None:
+                removed += self._evict(conn, max_bytes)
+            conn.execute("VACUUM")
+        return removed
+
+    def stats(self):
+        """
+        Número de entradas y bytes por tipo: {kind: (entradas, bytes)}.
+        """
+        if not self.path:
+            return {}
+        with self._connection() as conn:
+            rows = conn.execute(
+                "SELECT kind, COUNT(*), COALESCE(SUM(size), 0) FROM generated GROUP BY kind"
+            ).fetchall()
+        return {kind: (count, size) for kind, count, size in rows}
+
+
+# Compartido por todas las vistas del proceso
+generated_cache = GeneratedCache()
@@ -0,0 +1,135 @@
+"""
+Entrada de las imágenes subidas con memoria acotada.
+
+Django ya guarda las subidas grandes en un fichero temporal en lugar de en
+memoria (FILE_UPLOAD_MAX_MEMORY_SIZE). Antes de leerlas se comprueba:
+
+- El tamaño de la petición, con la cabecera Content-Length y antes de que
+  Django procese el cuerpo (UPLOAD_MAX_BYTES).
+- Las dimensiones de la imagen, leyendo sólo la cabecera: las de más de
+  UPLOAD_MAX_PIXELS se rechazan, igual que las que tienen algún lado mayor
+  que UPLOAD_MAX_DIMENSION. Con UPLOAD_DOWNSCALE estas últimas se reducen
+  antes de decodificarlas enteras; en los JPEG la reducción usa `draft()`,
+  que decodifica directamente a 1/2, 1/4 u 1/8 del tamaño sin llegar a
+  crear la imagen completa.
+
+Así una foto de 50 MP de un móvil ya no se convierte en varias copias
+decodificadas de cientos de MB en cada vista.
+"""
+from io import BytesIO
+
+from django.conf import settings
+from PIL import Image, UnidentifiedImageError
+
+from .metrics import metrics
+from .tracing import span
+
+
+class UploadError(Exception):
+    """
+    La subida no se acepta; `status_code` es el código HTTP de la respuesta.
+    """
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def _megabytes(size):
+    return f"{size / (1024 * 1024):.0f} MB"
+
+
+def check_request_size(request, max_files=1):
+    """
+    Rechaza la petición por su Content-Length, sin leer el cuerpo.
+    `max_files` es el número de archivos que admite el endpoint.
+    """
+    try:
+        length = int(request.META.get("CONTENT_LENGTH") or 0)
+    except ValueError:
+        length = 0
+    limit = settings.UPLOAD_MAX_BYTES
+    # El cuerpo multipart añade cabeceras a cada archivo: se deja un margen
+    if limit and length > limit * max_files + 64 * 1024:
+        metrics.increment("uploads_rejected_total", reason="request_size")
+        raise UploadError(
+            f"La petición supera el tamaño máximo ({_megabytes(limit)} por archivo)", 413
+        )
+
+
+def _downscale(img, max_dimension):
+    """
+    Reduce `img` para que su lado mayor sea `max_dimension` y devuelve los
+    bytes codificados en el mismo formato (JPEG) o en PNG.
+    """
+    width, height = img.size
+    scale = max_dimension / max(width, height)
+    target = (max(1, round(width * scale)), max(1, round(height * scale)))
+    source_format = img.format
+    exif = img.info.get("exif")
+    icc_profile = img.info.get("icc_profile")
+
+    if source_format == "JPEG":
+        # Decodificación reducida en el propio decodificador JPEG
+        img.draft(None, target)
+    img.thumbnail((max_dimension, max_dimension), Image.Resampling.LANCZOS)
+
+    buffer = BytesIO()
+    params = {}
+    if exif:
+        # Se conserva la orientación EXIF, que se aplica más adelante
+        params["exif"] = exif
+    if icc_profile:
+        params["icc_profile"] = icc_profile
+    if source_format == "JPEG":
+        img.save(buffer, "JPEG", quality=95, **params)
+    else:
+        img.save(buffer, "PNG", **params)
+    metrics.increment("uploads_downscaled_total")
+    return buffer.getvalue()
+
+
+def read_upload(file_obj):
+    """
+    Valida la imagen subida y devuelve sus bytes, reducidos si son más
+    grandes de lo permitido. Lanza UploadError si no se acepta.
+    """
+    with span("read"):
+        return _read_upload(file_obj)
+
+
+def _read_upload(file_obj):
+    if settings.UPLOAD_MAX_BYTES and file_obj.size > settings.UPLOAD_MAX_BYTES:
+        metrics.increment("uploads_rejected_total", reason="file_size")
+        raise UploadError(
+            f"El archivo supera el tamaño máximo de {_megabytes(settings.UPLOAD_MAX_BYTES)}", 413
+        )
+
+    file_obj.seek(0)
+    try:
+        # Image.open sólo lee la cabecera: aún no se ha decodificado nada
+        with Image.open(file_obj) as img:
+            width, height = img.size
+            if settings.UPLOAD_MAX_PIXELS and width * height > settings.UPLOAD_MAX_PIXELS:
+                metrics.increment("uploads_rejected_total", reason="pixels")
+                raise UploadError(
+                    f"La imagen es demasiado grande ({width}x{height}); "
+                    f"el máximo es {settings.UPLOAD_MAX_PIXELS / 1e6:.0f} megapíxeles",
+                    413,
+                )
+            max_dimension = settings.UPLOAD_MAX_DIMENSION
+            if max_dimension and max(width, height) > max_dimension:
+                if settings.UPLOAD_DOWNSCALE:
+                    return _downscale(img, max_dimension)
+                metrics.increment("uploads_rejected_total", reason="dimension")
+                raise UploadError(
+                    f"La imagen es demasiado grande ({width}x{height}); "
+                    f"el lado máximo es {max_dimension} píxeles",
+                    413,
+                )
+    except (UnidentifiedImageError, Image.DecompressionBombError):
+        metrics.increment("uploads_rejected_total", reason="invalid")
+        raise UploadError("El archivo no es una imagen válida")
+
+    file_obj.seek(0)
+    return file_obj.read()
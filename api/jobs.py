@@ -0,0 +1,565 @@
+"""
+Cola de trabajos para los endpoints que generan video.
+
+Componer, llamar a Gemini y codificar un MP4 tarda decenas de segundos; hacerlo
+dentro de la petición HTTP mantiene ocupado un worker todo ese tiempo. Con la
+cola, el cliente envía el trabajo, recibe un id y consulta el estado (o recibe
+un callback) cuando termina. Los trabajos los ejecuta un pool de hilos propio
+con concurrencia acotada, así que no compiten con las peticiones rápidas.
+
+El broker guarda los trabajos y decide el orden (mayor prioridad primero y,
+a igual prioridad, el más antiguo). Se elige con JOBS_BROKER:
+
+- SQLiteBroker (por defecto): en un fichero SQLite compartido por todos los
+  workers de la máquina; cualquiera puede ejecutar o consultar cualquier
+  trabajo, así que cada worker arranca sus hilos al iniciarse (ApiConfig)
+  y sólo reclama los tipos de trabajo que tiene registrados. Mientras
+  se ejecuta, el worker renueva el plazo del trabajo (JOBS_LEASE_SECONDS);
+  si el worker muere, al vencer el plazo otro lo vuelve a encolar (hasta
+  JOBS_MAX_ATTEMPTS intentos).
+- InMemoryBroker: dentro del proceso. El estado sólo es visible desde el
+  worker que recibió el trabajo: con varios workers, la consulta del
+  estado puede llegar a otro y recibir un 404.
+
+`callback_url` sólo puede ser https, a un host de
+JOBS_CALLBACK_ALLOWED_HOSTS y que no resuelva a direcciones privadas o
+locales; se comprueba al enviar el trabajo y otra vez antes de llamarla.
+"""
+import heapq
+import ipaddress
+import itertools
+import json
+import logging
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from urllib.parse import urljoin, urlsplit
+
+from django.conf import settings
+from django.http.request import validate_host
+from django.utils.module_loading import import_string
+
+from .metrics import metrics
+from .procpool import waiting
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+
+class QueueFull(Exception):
+    """
+    Hay demasiados trabajos pendientes; el cliente debe reintentar más tarde.
+    """
+
+
+class InvalidCallback(ValueError):
+    """
+    La `callback_url` de un trabajo no está permitida.
+    """
+
+
+def validate_callback_url(url):
+    """
+    Comprueba que `url` es https, que su host está en
+    JOBS_CALLBACK_ALLOWED_HOSTS (mismo formato que ALLOWED_HOSTS) y que
+    todas sus direcciones son públicas. Lanza InvalidCallback si no.
+    """
+    try:
+        parts = urlsplit(url)
+        port = parts.port or 443
+    except ValueError:
+        raise InvalidCallback("callback_url no es una URL válida")
+    if parts.scheme != "https" or not parts.hostname:
+        raise InvalidCallback("callback_url debe ser una URL https")
+    if not validate_host(parts.hostname, settings.JOBS_CALLBACK_ALLOWED_HOSTS):
+        raise InvalidCallback(f"callback_url: el host {parts.hostname} no está permitido")
+    try:
+        addresses = {info[4][0] for info in socket.getaddrinfo(parts.hostname, port, proto=socket.IPPROTO_TCP)}
+    except (OSError, UnicodeError):
+        raise InvalidCallback(f"callback_url: no se pudo resolver {parts.hostname}")
+    for address in addresses:
+        if not ipaddress.ip_address(address.split("%", 1)[0]).is_global:
+            raise InvalidCallback(f"callback_url: {parts.hostname} resuelve a una dirección no pública")
+
+
+class Job:
+    """
+    Un trabajo y su estado. `payload` son los bytes de entrada y `result`
+    el diccionario que devuelve el handler. `base_url` es la URL del
+    servidor que recibió el trabajo, para dar URLs absolutas en el callback.
+    """
+
+    def __init__(self, kind, payload, priority=0, callback_url=None, job_id=None,
+                 status=QUEUED, created_at=None, started_at=None, finished_at=None,
+                 result=None, error=None, base_url=None, attempts=0, lease_expires_at=None):
+        self.id = job_id or uuid.uuid4().hex
+        self.kind = kind
+        self.payload = payload
+        self.priority = priority
+        self.callback_url = callback_url
+        self.status = status
+        self.created_at = created_at or time.time()
+        self.started_at = started_at
+        self.finished_at = finished_at
+        self.result = result
+        self.error = error
+        self.base_url = base_url
+        self.attempts = attempts
+        self.lease_expires_at = lease_expires_at
+
+    @property
+    def finished(self):
+        return self.status in (SUCCEEDED, FAILED)
+
+    def as_dict(self, include_result=True):
+        data = {
+            "job_id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "priority": self.priority,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+        if self.error:
+            data["error"] = self.error
+        if include_result and self.status == SUCCEEDED:
+            data["result"] = self.result
+        return data
+
+    def callback_payload(self):
+        """
+        Lo que se envía a `callback_url`: el estado y, si terminó bien, las
+        URLs absolutas de descarga (como en JobStatusView).
+        """
+        data = self.as_dict(include_result=False)
+        if self.status == SUCCEEDED and self.result is not None:
+            data["result"] = {
+                name: urljoin(self.base_url or "", ref["url"]) for name, ref in self.result.items()
+            }
+        return data
+
+
+class InMemoryBroker:
+    """
+    Broker en memoria del proceso, con cola de prioridad.
+    """
+
+    # Los trabajos sólo los ve el proceso que los recibió
+    shared = False
+
+    def __init__(self):
+        self._jobs = {}
+        self._heap = []
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+
+    def put(self, job):
+        with self._cond:
+            self._jobs[job.id] = job
+            heapq.heappush(self._heap, (-job.priority, next(self._counter), job.id))
+            self._cond.notify()
+
+    def claim(self, timeout, kinds=None):
+        """
+        Saca el siguiente trabajo pendiente (de uno de los tipos `kinds`, si
+        se indican) y lo marca como en ejecución, o devuelve None si no llega
+        ninguno en `timeout` segundos.
+        """
+        with self._cond:
+            if not self._heap:
+                self._cond.wait(timeout)
+            skipped = []
+            try:
+                while self._heap:
+                    entry = heapq.heappop(self._heap)
+                    job = self._jobs.get(entry[2])
+                    if job is None or job.status != QUEUED:
+                        continue
+                    if kinds is not None and job.kind not in kinds:
+                        skipped.append(entry)
+                        continue
+                    job.status = RUNNING
+                    job.started_at = time.time()
+                    job.attempts += 1
+                    return job
+                return None
+            finally:
+                for entry in skipped:
+                    heapq.heappush(self._heap, entry)
+
+    def save(self, job):
+        with self._cond:
+            self._jobs[job.id] = job
+
+    def get(self, job_id):
+        with self._cond:
+            return self._jobs.get(job_id)
+
+    def pending(self):
+        with self._cond:
+            return sum(1 for job in self._jobs.values() if job.status == QUEUED)
+
+    def purge(self, older_than):
+        with self._cond:
+            expired = [
+                job_id for job_id, job in self._jobs.items()
+                if job.finished and job.finished_at < older_than
+            ]
+            for job_id in expired:
+                del self._jobs[job_id]
+            return len(expired)
+
+
+class SQLiteBroker:
+    """
+    Broker persistente en SQLite. Cada operación abre su propia conexión, así
+    que se puede usar desde cualquier hilo y desde varios procesos.
+    """
+
+    shared = True
+
+    # Columnas añadidas después de crear la tabla, para bases ya existentes
+    _ADDED_COLUMNS = (
+        ("base_url", "TEXT"),
+        ("attempts", "INTEGER NOT NULL DEFAULT 0"),
+        ("lease_expires_at", "REAL"),
+    )
+
+    def __init__(self, path=None, poll_interval=0.5, lease_seconds=None, max_attempts=None):
+        self.path = str(path or settings.JOBS_SQLITE_PATH)
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds or settings.JOBS_LEASE_SECONDS
+        self.max_attempts = max_attempts or settings.JOBS_MAX_ATTEMPTS
+        self._cond = threading.Condition()
+        with self._connection() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    payload BLOB,
+                    priority INTEGER NOT NULL DEFAULT 0,
+                    callback_url TEXT,
+                    status TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL,
+                    result TEXT,
+                    error TEXT
+                )
+                """
+            )
+            existing = {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}
+            for name, definition in self._ADDED_COLUMNS:
+                if name not in existing:
+                    conn.execute(f"ALTER TABLE jobs ADD COLUMN {name} {definition}")
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS jobs_queue ON jobs (status, priority DESC, created_at)"
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    @contextmanager
+    def _connection(self):
+        conn = self._connect()
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _row_to_job(row, with_payload=True):
+        (job_id, kind, payload, priority, callback_url, status, created_at,
+         started_at, finished_at, result, error, base_url, attempts, lease_expires_at) = row
+        return Job(
+            kind, payload if with_payload else None, priority, callback_url, job_id,
+            status, created_at, started_at, finished_at,
+            json.loads(result) if result else None, error,
+            base_url, attempts, lease_expires_at,
+        )
+
+    def put(self, job):
+        with self._connection() as conn:
+            conn.execute(
+                "INSERT INTO jobs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job.id, job.kind, job.payload, job.priority, job.callback_url,
+                 job.status, job.created_at, job.started_at, job.finished_at,
+                 None, job.error, job.base_url, job.attempts, job.lease_expires_at),
+            )
+        with self._cond:
+            self._cond.notify()
+
+    def _claim_one(self, kinds=None):
+        conn = self._connect()
+        try:
+            # BEGIN IMMEDIATE toma el lock de escritura: dos workers no pueden
+            # reclamar el mismo trabajo.
+            conn.execute("BEGIN IMMEDIATE")
+            self._recover_expired(conn)
+            query, params = "SELECT * FROM jobs WHERE status = ?", [QUEUED]
+            if kinds is not None:
+                # Otro proceso puede tener activos otros endpoints
+                # (API_ENABLED_ENDPOINTS): sólo los tipos que sabemos ejecutar
+                query += f" AND kind IN ({', '.join('?' * len(kinds))})"
+                params.extend(kinds)
+            row = conn.execute(
+                query + " ORDER BY priority DESC, created_at LIMIT 1", params
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            job = self._row_to_job(row)
+            job.status = RUNNING
+            job.started_at = time.time()
+            job.attempts += 1
+            job.lease_expires_at = job.started_at + self.lease_seconds
+            # El payload se conserva hasta que termina: si el worker muere,
+            # el trabajo se vuelve a encolar con él
+            conn.execute(
+                "UPDATE jobs SET status = ?, started_at = ?, attempts = ?, lease_expires_at = ? WHERE id = ?",
+                (job.status, job.started_at, job.attempts, job.lease_expires_at, job.id),
+            )
+            conn.execute("COMMIT")
+            return job
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def _recover_expired(self, conn):
+        """
+        Trabajos en ejecución cuyo worker dejó de renovar el plazo: vuelven
+        a la cola o, si ya agotaron JOBS_MAX_ATTEMPTS, fallan.
+        """
+        now = time.time()
+        requeued = conn.execute(
+            "UPDATE jobs SET status = ?, started_at = NULL, lease_expires_at = NULL "
+            "WHERE status = ? AND lease_expires_at < ? AND attempts < ?",
+            (QUEUED, RUNNING, now, self.max_attempts),
+        ).rowcount
+        failed = conn.execute(
+            "UPDATE jobs SET status = ?, finished_at = ?, payload = NULL, lease_expires_at = NULL, error = ? "
+            "WHERE status = ? AND lease_expires_at < ?",
+            (FAILED, now, "El worker que ejecutaba el trabajo se detuvo", RUNNING, now),
+        ).rowcount
+        if requeued:
+            logger.warning("%d trabajos sin worker vuelven a la cola", requeued)
+            metrics.increment("jobs_requeued_total", requeued)
+        if failed:
+            logger.error("%d trabajos sin worker fallan tras %d intentos", failed, self.max_attempts)
+            metrics.increment("jobs_abandoned_total", failed)
+
+    def renew(self, job):
+        """
+        Amplía el plazo de un trabajo en ejecución (lo llama el worker
+        periódicamente mientras lo ejecuta).
+        """
+        job.lease_expires_at = time.time() + self.lease_seconds
+        with self._connection() as conn:
+            conn.execute(
+                "UPDATE jobs SET lease_expires_at = ? WHERE id = ? AND status = ?",
+                (job.lease_expires_at, job.id, RUNNING),
+            )
+
+    def claim(self, timeout, kinds=None):
+        job = self._claim_one(kinds)
+        if job is None:
+            # Otros procesos no pueden avisarnos, así que además consultamos
+            # periódicamente
+            with self._cond:
+                self._cond.wait(min(timeout, self.poll_interval))
+            job = self._claim_one(kinds)
+        return job
+
+    def save(self, job):
+        with self._connection() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, started_at = ?, finished_at = ?, result = ?, error = ?, "
+                "payload = ?, lease_expires_at = NULL WHERE id = ?",
+                (job.status, job.started_at, job.finished_at,
+                 json.dumps(job.result) if job.result is not None else None,
+                 job.error, job.payload, job.id),
+            )
+
+    def get(self, job_id):
+        with self._connection() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._row_to_job(row, with_payload=False) if row else None
+
+    def pending(self):
+        with self._connection() as conn:
+            return conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status = ?", (QUEUED,)
+            ).fetchone()[0]
+
+    def purge(self, older_than):
+        with self._connection() as conn:
+            return conn.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?) AND finished_at < ?",
+                (SUCCEEDED, FAILED, older_than),
+            ).rowcount
+
+
+class JobQueue:
+    """
+    Envía trabajos al broker y los ejecuta con un pool de hilos propio.
+    Los hilos se arrancan con el primer `submit` o, si el broker es
+    compartido, al iniciar la aplicación (ApiConfig), no al importar el
+    módulo.
+    """
+
+    def __init__(self, broker=None, max_workers=None):
+        self._broker = broker
+        self._max_workers = max_workers
+        self._handlers = {}
+        self._threads = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    @property
+    def broker(self):
+        with self._lock:
+            if self._broker is None:
+                self._broker = import_string(settings.JOBS_BROKER)()
+            return self._broker
+
+    def register(self, kind, handler):
+        """
+        Asocia un tipo de trabajo a una función `handler(payload) -> dict`.
+        """
+        self._handlers[kind] = handler
+
+    def kinds(self):
+        return list(self._handlers)
+
+    def submit(self, kind, payload, priority=0, callback_url=None, base_url=None):
+        """
+        Encola un trabajo. Lanza InvalidCallback si `callback_url` no está
+        permitida y QueueFull si hay demasiados pendientes.
+        """
+        if kind not in self._handlers:
+            raise ValueError(f"Tipo de trabajo desconocido: {kind}")
+        if callback_url:
+            validate_callback_url(callback_url)
+        broker = self.broker
+        if broker.pending() >= settings.JOBS_MAX_PENDING:
+            raise QueueFull("La cola de trabajos está llena, inténtalo más tarde")
+        job = Job(kind, payload, priority=priority, callback_url=callback_url, base_url=base_url)
+        broker.put(job)
+        metrics.increment("jobs_submitted_total", kind=kind)
+        self.start()
+        return job
+
+    def get(self, job_id):
+        return self.broker.get(job_id)
+
+    def start(self):
+        with self._lock:
+            if self._threads:
+                return
+            workers = self._max_workers or settings.JOBS_MAX_WORKERS
+            for index in range(workers):
+                thread = threading.Thread(
+                    target=self._worker, name=f"api-jobs-{index}", daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self):
+        self._stop.set()
+
+    def _worker(self):
+        broker = self.broker
+        last_purge = 0
+        while not self._stop.is_set():
+            now = time.time()
+            if now - last_purge > 60:
+                broker.purge(now - settings.JOBS_RESULT_TTL)
+                last_purge = now
+
+            job = broker.claim(timeout=1.0, kinds=self.kinds())
+            if job is None:
+                continue
+            self._run(broker, job)
+
+    @contextmanager
+    def _heartbeat(self, broker, job):
+        """
+        Renueva el plazo del trabajo en un hilo mientras dura el bloque (sólo
+        con brokers que usan plazos).
+        """
+        lease_seconds = getattr(broker, "lease_seconds", None)
+        if not lease_seconds:
+            yield
+            return
+        done = threading.Event()
+        interval = lease_seconds / 3
+
+        def beat():
+            while not done.wait(interval):
+                try:
+                    broker.renew(job)
+                except Exception:
+                    logger.exception("No se pudo renovar el plazo del trabajo %s", job.id)
+
+        thread = threading.Thread(target=beat, name=f"api-jobs-heartbeat-{job.id}", daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            done.set()
+            thread.join()
+
+    def _run(self, broker, job):
+        start = time.perf_counter()
+        try:
+            # Los trabajos esperan hueco en el pool de procesos en lugar de
+            # recibir PoolSaturated
+            with self._heartbeat(broker, job), waiting():
+                job.result = self._handlers[job.kind](job.payload)
+            job.status = SUCCEEDED
+        except Exception as e:
+            logger.exception("Error en el trabajo %s (%s)", job.id, job.kind)
+            job.status = FAILED
+            job.error = f"Error al procesar la imagen: {str(e)}"
+        job.payload = None
+        job.finished_at = time.time()
+        broker.save(job)
+        metrics.increment(f"jobs_{job.status}_total", kind=job.kind)
+        metrics.increment(
+            "jobs_run_seconds_total", time.perf_counter() - start, kind=job.kind
+        )
+        if job.callback_url:
+            self._callback(job)
+
+    def _callback(self, job):
+        import requests
+
+        try:
+            # Otra vez: el DNS del host puede haber cambiado desde el envío
+            validate_callback_url(job.callback_url)
+            requests.post(
+                job.callback_url,
+                json=job.callback_payload(),
+                timeout=settings.JOBS_CALLBACK_TIMEOUT,
+                allow_redirects=False,
+            )
+        except InvalidCallback as e:
+            logger.warning("Callback del trabajo %s rechazado: %s", job.id, e)
+        except requests.RequestException as e:
+            logger.warning("Falló el callback del trabajo %s: %s", job.id, e)
+
+
+# Cola compartida por todo el proceso
+job_queue = JobQueue()
@@ -0,0 +1,395 @@
+"""
+Prueba de carga reproducible de remove-background, remove-background2 y
+jurassic-explorer.
+
+    python manage.py bench_api --sizes 640x480 1280x960 --requests 20 --concurrency 4
+    python manage.py bench_api --http --output bench/v1.json
+    python manage.py bench_api --http --url http://127.0.0.1:8000 --compare bench/v1.json
+
+Cada petición lleva una imagen sintética del tamaño pedido, distinta de las
+demás (mismos píxeles con bytes de relleno al final) para no medir los
+cachés; con --cache se repite la misma imagen. Gemini se sustituye por el
+servidor de `gemini_stub`, con --gemini-latency segundos de latencia.
+
+El caché persistente de imágenes generadas (api.generated) sobrevive entre
+ejecuciones y haría que jurassic-explorer no llamase a Gemini. Por defecto
+(--generated-cache temp) se usa uno vacío en un directorio temporal que se
+borra al terminar; `off` lo desactiva y `shared` usa el configurado en
+GENERATED_CACHE_PATH. El informe dice si el caché estaba caliente (tenía
+entradas) al empezar.
+
+Modos:
+
+- En proceso (por defecto): las peticiones pasan por todo el stack de
+  Django (middleware incluido) con el cliente de pruebas.
+- --http: peticiones HTTP reales a un servidor WSGI local que se arranca en
+  un hilo, o a --url (entonces el servidor y su Gemini son cosa del
+  usuario, y no se miden su memoria ni su CPU).
+
+Por escenario (endpoint x tamaño) informa de p50/p95/p99, peticiones/s,
+errores, pico de RSS, CPU por petición (incluye los procesos hijos, como
+ffmpeg) y la media de cada etapa según Server-Timing. --output guarda el
+resultado en JSON y --compare lo compara con uno anterior.
+"""
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api import warmup
+from api.generated import generated_cache
+from api.middleware import _peak_rss, _reset_peak_rss
+from api.procpool import process_pool
+
+from .bench_batch import parse_size, synthetic_image
+
+ENDPOINTS = {
+    "remove-background": "/api/remove-background/",
+    "remove-background2": "/api/remove-background2/",
+    "jurassic-explorer": "/api/jurassic-explorer/",
+}
+# Ajustes que cambian el resultado y se guardan con él
+RECORDED_SETTINGS = (
+    "REMBG_DEFAULT_MODEL", "REMBG_SESSION_POOL_SIZE", "REMBG_FAST_MASK", "API_ASYNC_VIEWS",
+    "API_OUTPUT_FORMAT", "API_RESPONSE_MODE", "ONNX_INTRA_OP_THREADS", "ONNX_INTER_OP_THREADS",
+    "VIDEO_X264_PRESET", "UPLOAD_MAX_DIMENSION", "UPLOAD_DOWNSCALE",
+)
+
+
+def percentile(values, fraction):
+    """
+    Percentil por rango más cercano de `values` (no vacío).
+    """
+    values = sorted(values)
+    index = max(0, min(len(values) - 1, int(round(fraction * len(values) + 0.5)) - 1))
+    return values[index]
+
+
+def parse_server_timing(header):
+    """
+    {etapa: ms} de una cabecera Server-Timing.
+    """
+    stages = {}
+    for entry in filter(None, (item.strip() for item in (header or "").split(","))):
+        name, _, params = entry.partition(";")
+        for param in params.split(";"):
+            key, _, value = param.partition("=")
+            if key.strip() == "dur":
+                stages[name.strip()] = float(value)
+    return stages
+
+
+def cpu_seconds():
+    """
+    CPU usada por el proceso y sus hijos ya terminados.
+    """
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+            cwd=settings.BASE_DIR, timeout=5,
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+class InProcessTransport:
+    """
+    Peticiones con el cliente de pruebas de Django (uno por hilo).
+    """
+    measures_server = True
+
+    def __init__(self):
+        from django.test import Client
+
+        self._local = threading.local()
+        self._client_class = Client
+
+    def post(self, path, data):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+
+        client = getattr(self._local, "client", None)
+        if client is None:
+            client = self._local.client = self._client_class(HTTP_HOST="localhost")
+        response = client.post(path, {"file": SimpleUploadedFile("bench.jpg", data, "image/jpeg")})
+        # Consumir las respuestas en streaming como haría un cliente
+        body = b"".join(response.streaming_content) if response.streaming else response.content
+        return response.status_code, response.get("Server-Timing"), len(body)
+
+    def close(self):
+        pass
+
+
+class HttpTransport:
+    """
+    Peticiones HTTP a `base_url`, o a un servidor WSGI local en un hilo.
+    """
+
+    def __init__(self, base_url=None):
+        import httpx
+
+        self.server = None
+        self.measures_server = base_url is None
+        if base_url is None:
+            base_url = self._start_server()
+        self.base_url = base_url.rstrip("/")
+        self.client = httpx.Client(timeout=600, limits=httpx.Limits(max_connections=1000))
+
+    def _start_server(self):
+        from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler
+        from django.core.wsgi import get_wsgi_application
+
+        class QuietHandler(WSGIRequestHandler):
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadedWSGIServer(("127.0.0.1", 0), QuietHandler)
+        self.server.set_app(get_wsgi_application())
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def post(self, path, data):
+        response = self.client.post(
+            self.base_url + path, files={"file": ("bench.jpg", data, "image/jpeg")}
+        )
+        return response.status_code, response.headers.get("Server-Timing"), len(response.content)
+
+    def close(self):
+        self.client.close()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+
+class Command(BaseCommand):
+    help = "Mide latencia, throughput, memoria y CPU de los endpoints del API"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--endpoints", nargs="+", choices=list(ENDPOINTS), default=list(ENDPOINTS))
+        parser.add_argument("--sizes", type=parse_size, nargs="+", default=[(640, 480), (1280, 960), (2000, 1500)])
+        parser.add_argument("--requests", type=int, default=10, help="Peticiones por escenario")
+        parser.add_argument("--concurrency", type=int, default=1)
+        parser.add_argument("--warmup", type=int, default=1, help="Peticiones sin medir por escenario")
+        parser.add_argument("--cache", action="store_true", help="Repetir la misma imagen (mide los cachés)")
+        parser.add_argument("--http", action="store_true")
+        parser.add_argument("--url", default=None, help="Servidor ya arrancado (implica --http)")
+        parser.add_argument("--gemini-latency", type=float, default=1.0)
+        parser.add_argument(
+            "--generated-cache", choices=["temp", "off", "shared"], default="temp",
+            help="Caché de imágenes generadas: uno vacío y temporal (por defecto), "
+                 "ninguno o el de GENERATED_CACHE_PATH",
+        )
+        parser.add_argument("--output", default=None, help="Fichero JSON con los resultados")
+        parser.add_argument("--compare", default=None, help="JSON de una ejecución anterior")
+
+    def start_gemini_stub(self, latency):
+        """
+        Apunta el cliente de Gemini del proceso al servidor de pruebas.
+        """
+        from .gemini_stub import start_stub
+
+        stub = start_stub(latency=latency)
+        settings.GEMINI_BASE_URL = stub.url
+        os.environ["GOOGLE_API_KEY"] = os.environ.get("GOOGLE_API_KEY") or "stub"
+        return stub
+
+    def use_generated_cache(self, mode):
+        """
+        Apunta GENERATED_CACHE_PATH (también el de los procesos del pool,
+        que lo leen del entorno) según `mode`. Devuelve el directorio
+        temporal que hay que borrar al terminar, si se creó uno.
+        """
+        directory = None
+        if mode == "temp":
+            directory = tempfile.mkdtemp(prefix="bench-generated-")
+            path = os.path.join(directory, "generated.sqlite3")
+        elif mode == "off":
+            path = None
+        else:
+            return None
+        settings.GENERATED_CACHE_PATH = path
+        os.environ["GENERATED_CACHE_PATH"] = path or ""
+        # Si el warm-up ya arrancó el pool, sus procesos tienen la ruta
+        # anterior: se cierra y la primera tarea lo vuelve a crear
+        warmup.state.wait()
+        process_pool.shutdown()
+        return directory
+
+    def generated_cache_state(self, mode, remote):
+        """
+        Modo del caché de imágenes generadas y si tenía entradas al empezar
+        (None si no se puede saber: servidor externo).
+        """
+        if remote:
+            return {"mode": "remote", "path": None, "entries": None, "warm": None}
+        entries = sum(count for count, _ in generated_cache.stats().values())
+        return {"mode": mode, "path": generated_cache.path, "entries": entries, "warm": entries > 0}
+
+    def run_scenario(self, transport, endpoint, size, options):
+        path = ENDPOINTS[endpoint]
+        # Semilla estable entre ejecuciones (hash() de str cambia en cada proceso)
+        base = synthetic_image(size, zlib.crc32(f"{endpoint}{size}".encode()) % 100)
+        counter = iter(range(10 ** 9))
+        counter_lock = threading.Lock()
+
+        def payload():
+            if options["cache"]:
+                return base
+            # Los bytes tras el fin del JPEG se ignoran al decodificar
+            with counter_lock:
+                n = next(counter)
+            return base + f"bench-{time.time_ns()}-{n}".encode()
+
+        for _ in range(options["warmup"]):
+            transport.post(path, payload())
+
+        latencies, errors, stages, sizes = [], 0, {}, []
+
+        def one(_):
+            data = payload()
+            start = time.perf_counter()
+            status, timing, length = transport.post(path, data)
+            return time.perf_counter() - start, status, timing, length
+
+        _reset_peak_rss()
+        rss_before = _peak_rss()
+        cpu_before = cpu_seconds()
+        wall_start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options["concurrency"]) as pool:
+            for latency, status, timing, length in pool.map(one, range(options["requests"])):
+                if status != 200:
+                    errors += 1
+                    continue
+                latencies.append(latency)
+                sizes.append(length)
+                for name, ms in parse_server_timing(timing).items():
+                    stages.setdefault(name, []).append(ms)
+        wall = time.perf_counter() - wall_start
+        cpu = cpu_seconds() - cpu_before
+
+        result = {
+            "endpoint": endpoint,
+            "size": f"{size[0]}x{size[1]}",
+            "requests": options["requests"],
+            "errors": errors,
+            "requests_per_second": round(options["requests"] / wall, 3),
+            "response_bytes_mean": round(sum(sizes) / len(sizes)) if sizes else None,
+            "stages_ms_mean": {name: round(sum(v) / len(v), 1) for name, v in stages.items()},
+        }
+        if latencies:
+            result.update({
+                f"p{q}_ms": round(percentile(latencies, q / 100) * 1000, 1) for q in (50, 95, 99)
+            })
+        if transport.measures_server:
+            result["peak_rss_mb"] = round(_peak_rss() / 1024 / 1024, 1)
+            result["peak_rss_growth_mb"] = round((_peak_rss() - rss_before) / 1024 / 1024, 1)
+            result["cpu_ms_per_request"] = round(cpu / options["requests"] * 1000, 1)
+        return result
+
+    def handle(self, *args, **options):
+        stub = self.start_gemini_stub(options["gemini_latency"])
+        http = options["http"] or options["url"]
+        cache_directory = self.use_generated_cache(options["generated_cache"])
+        generated = self.generated_cache_state(options["generated_cache"], bool(options["url"]))
+        if generated["warm"]:
+            self.stderr.write(
+                f"Aviso: el caché de imágenes generadas ({generated['path']}) ya tiene "
+                f"{generated['entries']} entradas; jurassic-explorer no llamará a Gemini"
+            )
+        elif generated["warm"] is None:
+            self.stderr.write("Aviso: no se sabe si el caché de imágenes generadas de --url está caliente")
+        transport = HttpTransport(options["url"]) if http else InProcessTransport()
+
+        scenarios = []
+        try:
+            for endpoint in options["endpoints"]:
+                for size in options["sizes"]:
+                    result = self.run_scenario(transport, endpoint, size, options)
+                    scenarios.append(result)
+                    self.write_result(result)
+        finally:
+            transport.close()
+            stub.shutdown()
+            if cache_directory is not None:
+                shutil.rmtree(cache_directory, ignore_errors=True)
+
+        report = {
+            "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "git_revision": git_revision(),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "mode": ("http " + (options["url"] or "local")) if http else "in-process",
+            "options": {
+                key: options[key] for key in
+                ("requests", "concurrency", "warmup", "cache", "gemini_latency")
+            },
+            "generated_cache": generated,
+            "settings": {name: getattr(settings, name, None) for name in RECORDED_SETTINGS},
+            "scenarios": scenarios,
+        }
+        if options["output"]:
+            directory = os.path.dirname(options["output"])
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(options["output"], "w") as f:
+                json.dump(report, f, indent=2, sort_keys=True)
+            self.stdout.write(f"Resultados en {options['output']}")
+        if options["compare"]:
+            self.compare(options["compare"], scenarios)
+
+    def write_result(self, result):
+        line = (
+            f"{result['endpoint']:>18} {result['size']:>9}: "
+            f"{result['requests_per_second']:7.2f} req/s  "
+            f"p50 {result.get('p50_ms', float('nan')):8.1f}  "
+            f"p95 {result.get('p95_ms', float('nan')):8.1f}  "
+            f"p99 {result.get('p99_ms', float('nan')):8.1f} ms  "
+            f"errores {result['errors']}"
+        )
+        if "cpu_ms_per_request" in result:
+            line += (
+                f"  CPU {result['cpu_ms_per_request']:7.1f} ms/pet"
+                f"  pico RSS {result['peak_rss_mb']:7.1f} MB"
+            )
+        self.stdout.write(line)
+        if result["stages_ms_mean"]:
+            self.stdout.write(" " * 20 + "  ".join(
+                f"{name} {ms:.1f}" for name, ms in result["stages_ms_mean"].items()
+            ))
+
+    def compare(self, path, scenarios):
+        """
+        Diferencia con una ejecución anterior, escenario a escenario.
+        """
+        try:
+            with open(path) as f:
+                previous = json.load(f)
+        except (OSError, ValueError) as e:
+            raise CommandError(f"No se pudo leer {path}: {e}")
+        before = {(s["endpoint"], s["size"]): s for s in previous["scenarios"]}
+        self.stdout.write(f"Comparación con {path} ({previous.get('git_revision')}):")
+        for result in scenarios:
+            old = before.get((result["endpoint"], result["size"]))
+            if old is None:
+                continue
+            changes = []
+            for key in ("requests_per_second", "p50_ms", "p95_ms", "p99_ms", "cpu_ms_per_request", "peak_rss_mb"):
+                if old.get(key) and result.get(key) is not None:
+                    changes.append(f"{key} {(result[key] - old[key]) / old[key] * 100:+.1f}%")
+            self.stdout.write(f"{result['endpoint']:>18} {result['size']:>9}: " + "  ".join(changes))
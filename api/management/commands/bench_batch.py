@@ -0,0 +1,72 @@
+"""
+Compara el rendimiento del endpoint por lotes con el camino de una imagen.
+
+    python manage.py bench_batch --images 32 --size 1024x768
+"""
+import time
+from io import BytesIO
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from PIL import Image
+from rembg import remove
+
+from api.batch import remove_background_batch
+from api.sessions import session_registry
+
+
+def synthetic_image(size, seed):
+    """
+    Imagen JPEG sintética y determinista (fractal de Mandelbrot desplazado).
+    """
+    width, height = size
+    offset = seed * 0.05
+    image = Image.effect_mandelbrot(
+        (width, height), (-2 + offset, -1.2, 1 + offset, 1.2), 64
+    ).convert("RGB")
+    buffer = BytesIO()
+    image.save(buffer, format="JPEG", quality=90)
+    return buffer.getvalue()
+
+
+def parse_size(value):
+    width, height = value.lower().split("x")
+    return int(width), int(height)
+
+
+class Command(BaseCommand):
+    help = "Mide imágenes/s del camino por lotes frente al de una imagen"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--images", type=int, default=16)
+        parser.add_argument("--size", type=parse_size, default=(800, 600))
+        parser.add_argument("--model", default=None)
+        parser.add_argument("--repeat", type=int, default=3)
+
+    def handle(self, *args, **options):
+        model_name = options["model"] or settings.REMBG_DEFAULT_MODEL
+        corpus = [synthetic_image(options["size"], i) for i in range(options["images"])]
+
+        def single():
+            for data in corpus:
+                with session_registry.session(model_name) as session:
+                    remove(data, session=session)
+
+        def batch():
+            remove_background_batch(corpus, model_name)
+
+        # Calentamos ambos caminos para no medir la carga del modelo
+        single()
+        batch()
+
+        for label, func in (("single", single), ("batch", batch)):
+            timings = []
+            for _ in range(options["repeat"]):
+                start = time.perf_counter()
+                func()
+                timings.append(time.perf_counter() - start)
+            best = min(timings)
+            self.stdout.write(
+                f"{label:>6}: {len(corpus) / best:8.2f} img/s "
+                f"(mejor de {options['repeat']}: {best:.3f}s para {len(corpus)} imágenes)"
+            )
@@ -0,0 +1,128 @@
+"""
+Tiempo de arranque y memoria del worker según los endpoints activos
+(API_ENABLED_ENDPOINTS, ver api.endpoints).
+
+    python manage.py bench_imports
+    python manage.py bench_imports --sets all remove-background remove-background,jobs
+    python manage.py bench_imports --warmup --repeat 5 --output bench/imports.json
+
+Cada medida es un proceso nuevo de Python que configura Django y carga las
+URLs (lo que hace un worker antes de aceptar peticiones); con --warmup
+ejecuta además el warm-up completo (API_WARMUP_BLOCKING: modelos, imports
+del video y recursos). Por conjunto de endpoints informa de la mediana del
+tiempo, el pico de RSS, el número de módulos importados y cuáles de las
+dependencias pesadas llegaron a cargarse.
+"""
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.endpoints import ENDPOINTS
+
+from .bench_api import git_revision
+
+# Dependencias cuyo import cuesta tiempo o memoria
+HEAVY_MODULES = (
+    "numpy", "onnxruntime", "rembg", "scipy", "pymatting", "moviepy",
+    "google.genai", "httpx", "tenacity", "requests",
+)
+
+# Lo que se ejecuta en cada proceso medido
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import django
+django.setup()
+from django.urls import get_resolver
+get_resolver().url_patterns
+from api import warmup
+warmup.state.wait()
+seconds = time.perf_counter() - start
+from api.middleware import _peak_rss
+rss = _peak_rss()
+print(json.dumps({
+    "seconds": seconds,
+    "peak_rss": rss,
+    "modules": len(sys.modules),
+    "loaded": [name for name in %r if name in sys.modules],
+    "warmup": warmup.state.as_dict(),
+}))
+""" % (HEAVY_MODULES,)
+
+
+class Command(BaseCommand):
+    help = "Mide el arranque (tiempo, RSS, imports) con distintos endpoints activos"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sets", nargs="+", default=None,
+            help="Conjuntos de endpoints separados por comas ('all' = todos). "
+                 "Por defecto, todos y cada endpoint por separado",
+        )
+        parser.add_argument("--repeat", type=int, default=3, help="Procesos por conjunto")
+        parser.add_argument("--warmup", action="store_true", help="Incluir el warm-up completo")
+        parser.add_argument("--output", default=None, help="Fichero JSON con los resultados")
+
+    def probe(self, endpoints, warmup):
+        env = dict(os.environ)
+        env["API_ENABLED_ENDPOINTS"] = "" if endpoints == "all" else endpoints
+        env["API_WARMUP"] = "1" if warmup else "0"
+        env["API_WARMUP_BLOCKING"] = "1"
+        env["PROCESS_POOL_SIZE"] = "0"
+        result = subprocess.run(
+            [sys.executable, "-c", PROBE], capture_output=True, text=True,
+            cwd=settings.BASE_DIR, env=env,
+        )
+        if result.returncode != 0:
+            raise CommandError(f"Falló la medida de {endpoints}:\n{result.stderr}")
+        return json.loads(result.stdout.strip().splitlines()[-1])
+
+    def handle(self, *args, **options):
+        sets = options["sets"] or ["all", *ENDPOINTS]
+        for endpoints in sets:
+            unknown = set(endpoints.split(",")) - {"all", *ENDPOINTS}
+            if unknown:
+                raise CommandError(f"Endpoints desconocidos: {', '.join(sorted(unknown))}")
+
+        scenarios = []
+        for endpoints in sets:
+            runs = [self.probe(endpoints, options["warmup"]) for _ in range(options["repeat"])]
+            result = {
+                "endpoints": endpoints,
+                "seconds_median": round(statistics.median(r["seconds"] for r in runs), 3),
+                "peak_rss_mb_median": round(statistics.median(r["peak_rss"] for r in runs) / 1024 / 1024, 1),
+                "modules": runs[-1]["modules"],
+                "loaded": runs[-1]["loaded"],
+                "warmup_error": runs[-1]["warmup"]["error"],
+            }
+            scenarios.append(result)
+            self.stdout.write(
+                f"{endpoints:>40}: {result['seconds_median']:6.3f} s  "
+                f"pico RSS {result['peak_rss_mb_median']:7.1f} MB  "
+                f"{result['modules']:5d} módulos  [{', '.join(result['loaded'])}]"
+            )
+            if result["warmup_error"]:
+                self.stderr.write(f"{'':>40}  error en el warm-up: {result['warmup_error']}")
+
+        if options["output"]:
+            report = {
+                "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                "git_revision": git_revision(),
+                "python": sys.version.split()[0],
+                "platform": platform.platform(),
+                "options": {key: options[key] for key in ("repeat", "warmup")},
+                "scenarios": scenarios,
+            }
+            directory = os.path.dirname(options["output"])
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(options["output"], "w") as f:
+                json.dump(report, f, indent=2, sort_keys=True)
+            self.stdout.write(f"Resultados en {options['output']}")
@@ -0,0 +1,94 @@
+"""
+Compara el modo rápido de máscara (REMBG_FAST_MASK) con `remove`: tiempo,
+memoria y diferencia del alfa respecto al de resolución completa.
+
+    python manage.py bench_mask --sizes 1024x768 4000x3000 --repeat 3
+"""
+import ctypes
+import time
+from io import BytesIO
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+from PIL import Image
+from rembg import remove
+
+from api.batch import cutout_images
+from api.middleware import _current_rss, _peak_rss, _reset_peak_rss
+from api.sessions import session_registry
+
+from .bench_batch import parse_size, synthetic_image
+
+MODES = {
+    "full": None,
+    "fast": {"REMBG_FAST_MASK": True, "REMBG_MASK_REFINE": False},
+    "refine": {"REMBG_FAST_MASK": True, "REMBG_MASK_REFINE": True},
+}
+
+
+def _release_memory():
+    """
+    Devuelve al sistema la memoria libre del heap (glibc), para que el pico de
+    cada modo no dependa de lo que dejó reservado el anterior.
+    """
+    try:
+        ctypes.CDLL(None).malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+
+def _alpha(png):
+    return np.asarray(Image.open(BytesIO(png)).getchannel("A"), dtype=np.int16)
+
+
+class Command(BaseCommand):
+    help = "Mide velocidad, memoria y calidad del modo rápido de máscara"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", type=parse_size, nargs="+", default=[(1024, 768), (4000, 3000)])
+        parser.add_argument("--model", default=None)
+        parser.add_argument("--repeat", type=int, default=3)
+
+    def run(self, mode, data, model_name):
+        if MODES[mode] is None:
+            with session_registry.session(model_name) as session:
+                return remove(data, session=session)
+        with override_settings(**MODES[mode]):
+            return cutout_images([data], model_name)[0]
+
+    def handle(self, *args, **options):
+        model_name = options["model"] or settings.REMBG_DEFAULT_MODEL
+        # Calentamos la sesión para no medir la carga del modelo
+        self.run("full", synthetic_image((64, 64), 0), model_name)
+
+        for size in options["sizes"]:
+            data = synthetic_image(size, 1)
+            reference = None
+            self.stdout.write(f"{size[0]}x{size[1]}:")
+            for mode in MODES:
+                timings = []
+                for _ in range(options["repeat"]):
+                    start = time.perf_counter()
+                    output = self.run(mode, data, model_name)
+                    timings.append(time.perf_counter() - start)
+
+                # Pico de memoria de una ejecución más, ya con todo en caché
+                _release_memory()
+                _reset_peak_rss()
+                start_rss = _current_rss()
+                self.run(mode, data, model_name)
+                peak = max(0, _peak_rss() - start_rss)
+
+                alpha = _alpha(output)
+                if reference is None:
+                    reference = alpha
+                diff = np.abs(alpha - reference)
+                union = np.logical_or(alpha >= 128, reference >= 128).sum()
+                iou = np.logical_and(alpha >= 128, reference >= 128).sum() / union if union else 1.0
+                self.stdout.write(
+                    f"  {mode:>6}: {min(timings) * 1000:8.1f} ms  "
+                    f"pico {peak / (1024 * 1024):7.1f} MB  "
+                    f"alfa |dif| media {diff.mean():5.2f} máx {diff.max():3d}  IoU {iou:.4f}"
+                )
@@ -0,0 +1,113 @@
+"""
+Prueba de carga de las opciones de ONNX Runtime (ver api.runtime).
+
+Arranca varios procesos, como los workers de gunicorn, cada uno con su
+sesión creada con `create_session`, y los pone a hacer inferencias a la vez
+durante unos segundos. Repite la prueba con cada combinación de hilos por
+sesión y espera activa, y mide también la carga del modelo con y sin el
+modelo optimizado guardado.
+
+    python manage.py bench_onnx --workers 4 --threads 0 1 2 --seconds 10
+"""
+import multiprocessing
+import os
+import statistics
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+from PIL import Image
+
+
+def _percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def _worker(model_name, overrides, seconds, barrier, results):
+    import django
+
+    django.setup()
+    from api.runtime import create_session
+
+    with override_settings(**overrides):
+        session = create_session(model_name)
+    img = Image.effect_mandelbrot((640, 480), (-2, -1.2, 1, 1.2), 64).convert("RGB")
+    session.predict(img)
+
+    latencies = []
+    barrier.wait()
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        session.predict(img)
+        latencies.append(time.perf_counter() - start)
+    results.put(latencies)
+
+
+class Command(BaseCommand):
+    help = "Mide el rendimiento de varias configuraciones de ONNX Runtime con varios workers"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--model", default=None)
+        parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+        parser.add_argument("--threads", type=int, nargs="+", default=[0, 1, 2])
+        parser.add_argument("--spinning", type=int, nargs="+", choices=[0, 1], default=[1, 0])
+        parser.add_argument("--seconds", type=float, default=10)
+        parser.add_argument("--affinity", action="store_true")
+
+    def load_times(self, model_name):
+        """
+        Tiempo de carga sin caché, guardando el modelo optimizado y leyéndolo.
+        """
+        from api.runtime import create_session
+
+        with tempfile.TemporaryDirectory() as directory:
+            for label, overrides in (
+                ("sin caché", {"ONNX_OPTIMIZED_MODEL_DIR": None}),
+                ("guardando", {"ONNX_OPTIMIZED_MODEL_DIR": directory}),
+                ("optimizado", {"ONNX_OPTIMIZED_MODEL_DIR": directory}),
+            ):
+                with override_settings(**overrides):
+                    start = time.perf_counter()
+                    create_session(model_name)
+                    self.stdout.write(f"carga {label:>10}: {(time.perf_counter() - start) * 1000:8.1f} ms")
+
+    def handle(self, *args, **options):
+        model_name = options["model"] or settings.REMBG_DEFAULT_MODEL
+        workers = options["workers"]
+        self.load_times(model_name)
+
+        ctx = multiprocessing.get_context("spawn")
+        for threads in options["threads"]:
+            for spinning in options["spinning"]:
+                overrides = {
+                    "ONNX_INTRA_OP_THREADS": threads,
+                    "ONNX_ALLOW_SPINNING": bool(spinning),
+                    "ONNX_CPU_AFFINITY": options["affinity"],
+                }
+                barrier = ctx.Barrier(workers)
+                results = ctx.Queue()
+                procs = [
+                    ctx.Process(
+                        target=_worker,
+                        args=(model_name, overrides, options["seconds"], barrier, results),
+                    )
+                    for _ in range(workers)
+                ]
+                for proc in procs:
+                    proc.start()
+                latencies = []
+                for _ in procs:
+                    latencies.extend(results.get())
+                for proc in procs:
+                    proc.join()
+
+                self.stdout.write(
+                    f"workers={workers} hilos={threads} spinning={spinning}: "
+                    f"{len(latencies) / options['seconds']:8.2f} img/s  "
+                    f"p50 {statistics.median(latencies) * 1000:7.1f} ms  "
+                    f"p95 {_percentile(latencies, 0.95) * 1000:7.1f} ms"
+                )
@@ -0,0 +1,45 @@
+"""
+Compara tiempo de codificación y tamaño de los formatos de salida
+(parámetro `output`, ver api.outputs) sobre el mismo recorte.
+
+    python manage.py bench_output --size 2000x1500
+"""
+import time
+from io import BytesIO
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from PIL import Image
+from rembg.bg import fix_image_orientation
+
+from api.batch import predict_masks
+from api.outputs import OUTPUT_FORMATS, encode_output
+from api.sessions import session_registry
+
+from .bench_batch import parse_size, synthetic_image
+
+
+class Command(BaseCommand):
+    help = "Mide tiempo de codificación y tamaño de cada formato de salida"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--size", type=parse_size, default=(2000, 1500))
+        parser.add_argument("--model", default=None)
+        parser.add_argument("--repeat", type=int, default=3)
+
+    def handle(self, *args, **options):
+        model_name = options["model"] or settings.REMBG_DEFAULT_MODEL
+        img = fix_image_orientation(Image.open(BytesIO(synthetic_image(options["size"], 1))))
+        img.load()
+        with session_registry.session(model_name) as session:
+            mask = predict_masks(session, model_name, [img])[0]
+
+        for output in OUTPUT_FORMATS:
+            timings = []
+            for _ in range(options["repeat"]):
+                start = time.perf_counter()
+                data = encode_output(img, mask, output)
+                timings.append(time.perf_counter() - start)
+            self.stdout.write(
+                f"{output:>10}: {min(timings) * 1000:8.1f} ms  {len(data) / 1024:9.1f} KB"
+            )
@@ -0,0 +1,78 @@
+"""
+Compara el renderizado de la transición con NumPy frente a moviepy.
+
+    python manage.py bench_transition --size 1280x720
+
+Además de medir frames por segundo, comprueba que ambos caminos producen
+exactamente los mismos frames.
+"""
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from moviepy.video.compositing.CompositeVideoClip import CompositeVideoClip
+from moviepy.video.VideoClip import ImageClip
+
+from api.transitions import FPS, TOTAL_DURATION, WIPE_DURATION, VerticalWipe
+
+from .bench_batch import parse_size
+
+
+def moviepy_transition(original_np, final_np):
+    """
+    La composición que usaban las vistas antes del renderizador de NumPy.
+    """
+    duration = WIPE_DURATION
+    original_clip = ImageClip(original_np).with_duration(duration)
+    final_clip = ImageClip(final_np).with_duration(TOTAL_DURATION)
+    video_size = original_clip.size
+
+    def vertical_wipe(t):
+        if t < duration:
+            y = -video_size[1] + (video_size[1] * t / duration)
+        else:
+            y = 0
+        return (0, y)
+
+    final_clip = final_clip.with_position(vertical_wipe)
+    return CompositeVideoClip([original_clip, final_clip])
+
+
+class Command(BaseCommand):
+    help = "Mide frames/s de la transición con NumPy frente a CompositeVideoClip"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--size", type=parse_size, default=(1280, 720))
+        parser.add_argument(
+            "--final-size", type=parse_size, default=None,
+            help="Tamaño de la imagen final si es distinto (como en el explorador del Jurásico)",
+        )
+
+    def handle(self, *args, **options):
+        width, height = options["size"]
+        final_width, final_height = options["final_size"] or options["size"]
+        rng = np.random.default_rng(0)
+        original = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+        final = rng.integers(0, 256, (final_height, final_width, 3), dtype=np.uint8)
+
+        clip = moviepy_transition(original, final)
+        start = time.perf_counter()
+        reference = [frame.copy() for frame in clip.iter_frames(fps=FPS, dtype="uint8")]
+        moviepy_seconds = time.perf_counter() - start
+
+        wipe = VerticalWipe(original, final)
+        start = time.perf_counter()
+        for _ in wipe:
+            pass
+        numpy_seconds = time.perf_counter() - start
+
+        for index, frame in enumerate(wipe):
+            if not np.array_equal(frame, reference[index]):
+                raise CommandError(f"El frame {index} no coincide con el de moviepy")
+        if len(wipe) != len(reference):
+            raise CommandError("El número de frames no coincide con el de moviepy")
+
+        frames = len(reference)
+        self.stdout.write(f"{frames} frames de {width}x{height}, idénticos en ambos caminos")
+        self.stdout.write(f"moviepy: {frames / moviepy_seconds:9.1f} frames/s")
+        self.stdout.write(f"  numpy: {frames / numpy_seconds:9.1f} frames/s")
@@ -0,0 +1,191 @@
+"""
+Servidor local que imita la API de Gemini, para probar y medir
+api.gemini sin llamar al servicio real ni gastar cuota.
+
+    python manage.py gemini_stub --port 8765 --latency 2 --fail-rate 0.2
+    GEMINI_BASE_URL=http://127.0.0.1:8765 GOOGLE_API_KEY=stub python manage.py runserver
+
+Implementa `models/{modelo}:generateContent` y `:streamGenerateContent`
+(SSE) y la subida resumible de ficheros. Responde con la imagen recibida
+coloreada en tonos sepia, tras `--latency` segundos; `--fail-rate` es la
+fracción de peticiones que responden 503 para ejercitar los reintentos.
+"""
+import base64
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+
+from django.core.management.base import BaseCommand
+from PIL import Image, ImageOps
+
+MODEL_PATH = re.compile(r"^/v1[a-z0-9]*/models/(?P<model>[^/:]+):(?P<method>\w+)")
+
+
+def fake_image(image_bytes=None):
+    """
+    PNG de la "imagen generada": la de entrada en sepia, o un degradado si
+    no hay imagen.
+    """
+    if image_bytes:
+        img = ImageOps.grayscale(Image.open(BytesIO(image_bytes)))
+    else:
+        img = Image.linear_gradient("L").resize((1024, 1024))
+    img = ImageOps.colorize(img, "#2b1d0e", "#f0d9a8")
+    buffer = BytesIO()
+    img.save(buffer, "PNG", compress_level=1)
+    return buffer.getvalue()
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 para que los clientes puedan reutilizar la conexión
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        self.server.count("connections")
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        self.server.count("requests")
+        if self.path.startswith("/upload/"):
+            return self.upload(body)
+
+        match = MODEL_PATH.match(self.path)
+        if not match:
+            return self.send_json(404, {"error": {"code": 404, "message": "Not found", "status": "NOT_FOUND"}})
+
+        time.sleep(self.server.latency)
+        if random.random() < self.server.fail_rate:
+            self.server.count("failures")
+            return self.send_json(503, {"error": {"code": 503, "message": "Stub overloaded", "status": "UNAVAILABLE"}})
+
+        image = fake_image(self.input_image(json.loads(body)))
+        text = {"candidates": [{"content": {"role": "model", "parts": [{"text": "Imagen generada"}]}}]}
+        result = {"candidates": [{"content": {"role": "model", "parts": [{
+            "inlineData": {"mimeType": "image/png", "data": base64.b64encode(image).decode()},
+        }]}, "finishReason": "STOP"}]}
+
+        if match["method"] != "streamGenerateContent":
+            return self.send_json(200, result)
+        stream = "".join(f"data: {json.dumps(chunk)}\r\n\r\n" for chunk in (text, result)).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Content-Length", str(len(stream)))
+        self.end_headers()
+        self.wfile.write(stream)
+
+    def input_image(self, request):
+        """
+        Bytes de la imagen de la petición (en línea o subida antes).
+        """
+        for content in request.get("contents", []):
+            for part in content.get("parts", []):
+                if "inlineData" in part:
+                    self.server.count("inline")
+                    # google-genai codifica en base64 para URL
+                    data = part["inlineData"]["data"].replace("+", "-").replace("/", "_")
+                    return base64.urlsafe_b64decode(data)
+                if "fileData" in part:
+                    file_data = part["fileData"]
+                    return self.server.files.get(file_data.get("fileUri") or file_data.get("file_uri"))
+        return None
+
+    def upload(self, body):
+        """
+        Subida resumible: `start` devuelve la URL de la sesión y
+        `upload, finalize` recibe los bytes y devuelve el fichero.
+        """
+        command = self.headers.get("X-Goog-Upload-Command", "")
+        if "start" in command:
+            session = f"http://{self.headers['Host']}/upload/session/{uuid.uuid4().hex}"
+            return self.send_json(200, {}, {"X-Goog-Upload-URL": session, "X-Goog-Upload-Status": "active"})
+
+        name = f"files/{uuid.uuid4().hex[:12]}"
+        uri = f"http://{self.headers['Host']}/v1beta/{name}"
+        self.server.files[uri] = body
+        self.server.count("uploads")
+        file = {
+            "name": name,
+            "uri": uri,
+            "mimeType": self.headers.get("X-Goog-Upload-Header-Content-Type", "image/jpeg"),
+            "sizeBytes": str(len(body)),
+            "state": "ACTIVE",
+        }
+        return self.send_json(200, {"file": file}, {"X-Goog-Upload-Status": "final"})
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency=0.0, fail_rate=0.0, verbose=False):
+        super().__init__(address, StubHandler)
+        self.latency = latency
+        self.fail_rate = fail_rate
+        self.verbose = verbose
+        self.files = {}
+        self.stats = {"connections": 0, "requests": 0, "failures": 0, "inline": 0, "uploads": 0}
+        self._lock = threading.Lock()
+
+    def count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+def start_stub(host="127.0.0.1", port=0, **options):
+    """
+    Arranca el servidor en un hilo y lo devuelve (`server.url`,
+    `server.stats`, `server.shutdown()`). Con port=0 elige un puerto libre.
+    """
+    server = StubServer((host, port), **options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class Command(BaseCommand):
+    help = "Servidor local que imita la API de Gemini"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=8765)
+        parser.add_argument("--latency", type=float, default=0.0)
+        parser.add_argument("--fail-rate", type=float, default=0.0)
+
+    def handle(self, *args, **options):
+        server = StubServer(
+            (options["host"], options["port"]),
+            latency=options["latency"],
+            fail_rate=options["fail_rate"],
+            verbose=options["verbosity"] > 1,
+        )
+        self.stdout.write(f"Gemini de pruebas en {server.url} (GEMINI_BASE_URL)")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            self.stdout.write(f"Estadísticas: {server.stats}")
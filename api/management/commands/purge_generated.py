@@ -0,0 +1,49 @@
+"""
+Vacía el caché de imágenes generadas (ver api.generated), entero o en parte.
+
+    python manage.py purge_generated                 # todo
+    python manage.py purge_generated --stale         # otras versiones del prompt
+    python manage.py purge_generated --older-than 7  # sin usar en 7 días
+    python manage.py purge_generated --max-mb 200    # hasta dejar 200 MB
+    python manage.py purge_generated --stats         # sólo muestra el tamaño
+"""
+from django.core.management.base import BaseCommand, CommandError
+
+from api.generated import generated_cache
+from api.views import JURASSIC_PROMPT_VERSION
+
+
+class Command(BaseCommand):
+    help = "Borra entradas del caché de imágenes generadas"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--model", default=None, help="Sólo las de este modelo")
+        parser.add_argument(
+            "--stale", action="store_true",
+            help="Sólo las generadas con otra versión del prompt",
+        )
+        parser.add_argument("--older-than", type=float, default=None, help="Días sin usarse")
+        parser.add_argument("--max-mb", type=float, default=None, help="Tamaño máximo a conservar")
+        parser.add_argument("--stats", action="store_true", help="No borra nada")
+
+    def show_stats(self):
+        stats = generated_cache.stats()
+        for kind, (count, size) in sorted(stats.items()):
+            self.stdout.write(f"{kind:>8}: {count:6d} entradas  {size / 1024 / 1024:9.1f} MB")
+        if not stats:
+            self.stdout.write("Caché vacío")
+
+    def handle(self, *args, **options):
+        if not generated_cache.path:
+            raise CommandError("El caché de imágenes generadas está desactivado (GENERATED_CACHE_PATH)")
+        if options["stats"]:
+            return self.show_stats()
+
+        removed = generated_cache.purge(
+            model=options["model"],
+            keep_prompt_version=JURASSIC_PROMPT_VERSION if options["stale"] else None,
+            older_than=options["older_than"] * 24 * 60 * 60 if options["older_than"] is not None else None,
+            max_bytes=int(options["max_mb"] * 1024 * 1024) if options["max_mb"] is not None else None,
+        )
+        self.stdout.write(f"Entradas borradas: {removed}")
+        self.show_stats()
@@ -0,0 +1,131 @@
+"""
+Métricas internas del API.
+
+Registro en memoria, por proceso y seguro para hilos. Cada métrica se
+identifica por su nombre y sus etiquetas (por ejemplo, el modelo de rembg).
+`render_prometheus` las publica en el formato de texto de Prometheus (ver
+la vista /metrics); con varios workers cada uno publica las suyas.
+"""
+import math
+import threading
+from collections import defaultdict
+
+# Límites en segundos de los histogramas de latencia
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+class MetricsRegistry:
+    """
+    Contadores simples con etiquetas, máximos e histogramas.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = defaultdict(float)
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def increment(self, name, value=1, **labels):
+        """
+        Suma `value` al contador `name` con las etiquetas dadas.
+        """
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] += value
+
+    def maximum(self, name, value, **labels):
+        """
+        Guarda en `name` el mayor de su valor actual y `value` (para picos).
+        """
+        key = self._key(name, labels)
+        with self._lock:
+            if value > self._counters.get(key, 0):
+                self._counters[key] = value
+
+    def observe(self, name, value, buckets=DEFAULT_BUCKETS, **labels):
+        """
+        Registra `value` en el histograma `name`, como en Prometheus: un
+        contador acumulado `name_bucket` por límite (etiqueta `le`), más
+        `name_sum` y `name_count`.
+        """
+        with self._lock:
+            for bound in buckets:
+                if value <= bound:
+                    self._counters[self._key(f"{name}_bucket", {**labels, "le": str(bound)})] += 1
+            self._counters[self._key(f"{name}_bucket", {**labels, "le": "+Inf"})] += 1
+            self._counters[self._key(f"{name}_sum", labels)] += value
+            self._counters[self._key(f"{name}_count", labels)] += 1
+
+    def get(self, name, **labels):
+        """
+        Devuelve el valor actual de un contador (0 si no existe).
+        """
+        with self._lock:
+            return self._counters.get(self._key(name, labels), 0)
+
+    def snapshot(self):
+        """
+        Copia de todos los contadores: {(nombre, etiquetas): valor}.
+        """
+        with self._lock:
+            return dict(self._counters)
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+
+
+# Registro compartido por todo el proceso
+metrics = MetricsRegistry()
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value):
+    if value == int(value):
+        return str(int(value))
+    return repr(float(value))
+
+
+def _sample_order(sample):
+    name, labels, _ = sample
+    le = dict(labels).get("le")
+    others = tuple(item for item in labels if item[0] != "le")
+    suffix = 0 if name.endswith("_bucket") else 1 if name.endswith("_sum") else 2
+    return others, suffix, math.inf if le == "+Inf" else float(le or 0)
+
+
+def render_prometheus(registry=None):
+    """
+    Métricas de `registry` (por defecto el del proceso) en el formato de
+    texto de Prometheus. Los nombres `*_total` son contadores, los
+    `*_bucket/_sum/_count` de `observe` histogramas y el resto gauges.
+    """
+    snapshot = (registry or metrics).snapshot()
+    histograms = {
+        name[:-len("_bucket")]
+        for name, labels in snapshot
+        if name.endswith("_bucket") and any(key == "le" for key, _ in labels)
+    }
+
+    families = {}
+    for (name, labels), value in snapshot.items():
+        family, kind = name, "counter" if name.endswith("_total") else "gauge"
+        for suffix in ("_bucket", "_sum", "_count"):
+            if name.endswith(suffix) and name[:-len(suffix)] in histograms:
+                family, kind = name[:-len(suffix)], "histogram"
+                break
+        families.setdefault((family, kind), []).append((name, labels, value))
+
+    lines = []
+    for (family, kind), samples in sorted(families.items()):
+        lines.append(f"# TYPE {family} {kind}")
+        for name, labels, value in sorted(samples, key=_sample_order):
+            label_text = ",".join(f'{key}="{_escape(val)}"' for key, val in labels)
+            name = f"{name}{{{label_text}}}" if label_text else name
+            lines.append(f"{name} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,157 @@
+"""
+Middleware del API.
+"""
+import os
+import sys
+import threading
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+from .metrics import metrics
+from .tracing import end_trace, start_trace
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def _current_rss():
+    """
+    Memoria residente actual del proceso en bytes (0 si no se puede leer).
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def _peak_rss():
+    """
+    Pico de memoria residente del proceso en bytes.
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    if resource is None:
+        return 0
+    # ru_maxrss está en KB en Linux y en bytes en macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _reset_peak_rss():
+    """
+    Pone el pico de memoria del proceso al valor actual (Linux >= 4.0).
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+class PeakMemoryMiddleware:
+    """
+    Mide cuánto crece la memoria residente del proceso durante cada petición
+    y lo registra por vista: `request_peak_memory_bytes_max` (el mayor visto),
+    `request_peak_memory_bytes_total` y `request_peak_memory_requests_total`
+    (para la media).
+
+    El pico se reinicia al empezar una petición sólo si no hay otra en
+    curso; con peticiones simultáneas en el mismo proceso el valor incluye
+    la memoria de las demás y es una cota superior.
+    """
+
+    # Admite peticiones síncronas y asíncronas: un middleware sólo síncrono
+    # obligaría a Django a ejecutar las vistas asíncronas en un único hilo
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        start = self._start()
+        try:
+            return self.get_response(request)
+        finally:
+            self._finish(request, start)
+
+    async def __acall__(self, request):
+        start = self._start()
+        try:
+            return await self.get_response(request)
+        finally:
+            self._finish(request, start)
+
+    def _start(self):
+        with self._lock:
+            self._in_flight += 1
+            if self._in_flight == 1:
+                _reset_peak_rss()
+            return _current_rss()
+
+    def _finish(self, request, start):
+        peak = max(0, _peak_rss() - start)
+        with self._lock:
+            self._in_flight -= 1
+        match = getattr(request, "resolver_match", None)
+        view = match.url_name if match and match.url_name else "other"
+        metrics.maximum("request_peak_memory_bytes_max", peak, view=view)
+        metrics.increment("request_peak_memory_bytes_total", peak, view=view)
+        metrics.increment("request_peak_memory_requests_total", view=view)
+
+
+class TracingMiddleware:
+    """
+    Abre una traza por petición (ver api.tracing) y al terminar añade la
+    cabecera Server-Timing, escribe la línea de log y registra las
+    duraciones. Con API_TRACING desactivado Django lo descarta al arrancar.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.API_TRACING:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        trace, token = start_trace()
+        response = None
+        try:
+            response = self.get_response(request)
+            return response
+        finally:
+            end_trace(trace, token, request, response)
+
+    async def __acall__(self, request):
+        trace, token = start_trace()
+        response = None
+        try:
+            response = await self.get_response(request)
+            return response
+        finally:
+            end_trace(trace, token, request, response)
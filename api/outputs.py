@@ -0,0 +1,100 @@
+"""
+Formatos de salida de la imagen sin fondo.
+
+El parámetro `output` (en la query o en el formulario) elige el formato; por
+defecto API_OUTPUT_FORMAT:
+
+- `png`: PNG RGBA, el formato de siempre.
+- `mask`: sólo la máscara, PNG en escala de grises. Para los clientes que
+  componen por su cuenta: ocupa una fracción del RGBA y se codifica mucho
+  más rápido.
+- `webp`: WebP sin pérdida con alfa.
+- `webp-lossy`: WebP con pérdida (OUTPUT_WEBP_QUALITY) y alfa sin pérdida.
+- `png8`: PNG con paleta de OUTPUT_PNG_COLORS colores (cuantizado).
+
+La compresión se ajusta con OUTPUT_PNG_COMPRESS_LEVEL (0-9) y
+OUTPUT_WEBP_METHOD (0-6, más lento = más pequeño).
+"""
+from io import BytesIO
+
+from django.conf import settings
+from PIL import Image
+
+from .masks import cutout
+
+# formato -> (content type, extensión)
+OUTPUT_FORMATS = {
+    "png": ("image/png", ".png"),
+    "mask": ("image/png", ".png"),
+    "webp": ("image/webp", ".webp"),
+    "webp-lossy": ("image/webp", ".webp"),
+    "png8": ("image/png", ".png"),
+}
+
+
+def output_format(request):
+    """
+    Formato pedido en el parámetro `output`; lanza ValueError si no es válido.
+    """
+    output = (
+        request.GET.get("output")
+        or request.POST.get("output")
+        or settings.API_OUTPUT_FORMAT
+    )
+    if output not in OUTPUT_FORMATS:
+        raise ValueError(
+            f"Formato de salida no válido. Opciones: {', '.join(OUTPUT_FORMATS)}"
+        )
+    return output
+
+
+def output_params(output):
+    """
+    Parámetros del formato para las claves de caché. Vacío para `png`, que
+    da los mismos píxeles con cualquier nivel de compresión.
+    """
+    if output == "png":
+        return {}
+    params = {"output": output}
+    if output == "webp-lossy":
+        params["quality"] = settings.OUTPUT_WEBP_QUALITY
+    elif output == "png8":
+        params["colors"] = settings.OUTPUT_PNG_COLORS
+    return params
+
+
+def content_type(output):
+    return OUTPUT_FORMATS[output][0]
+
+
+def extension(output):
+    return OUTPUT_FORMATS[output][1]
+
+
+def encode_output(img, mask, output="png"):
+    """
+    Codifica el recorte de `img` con `mask` (o sólo la máscara) en el
+    formato `output` y devuelve los bytes.
+    """
+    buffer = BytesIO()
+    if output == "mask":
+        mask.save(buffer, "PNG", compress_level=settings.OUTPUT_PNG_COMPRESS_LEVEL)
+        return buffer.getvalue()
+
+    result = cutout(img, mask)
+    if output == "png":
+        result.save(buffer, "PNG", compress_level=settings.OUTPUT_PNG_COMPRESS_LEVEL)
+    elif output == "png8":
+        # FASTOCTREE es el único método de Pillow que conserva el alfa
+        result = result.quantize(settings.OUTPUT_PNG_COLORS, Image.Quantize.FASTOCTREE)
+        result.save(buffer, "PNG", compress_level=settings.OUTPUT_PNG_COMPRESS_LEVEL)
+    elif output == "webp":
+        result.save(buffer, "WEBP", lossless=True, method=settings.OUTPUT_WEBP_METHOD)
+    elif output == "webp-lossy":
+        result.save(
+            buffer, "WEBP", quality=settings.OUTPUT_WEBP_QUALITY,
+            alpha_quality=100, method=settings.OUTPUT_WEBP_METHOD,
+        )
+    else:
+        raise ValueError(f"Formato de salida no válido: {output}")
+    return buffer.getvalue()
@@ -0,0 +1,89 @@
+"""
+Imágenes compartidas entre las etapas de una petición.
+
+remove-background2 y jurassic-explorer pasaban bytes de una etapa a otra:
+rembg devolvía un PNG que la composición volvía a decodificar, la imagen
+compuesta se codificaba a PNG y se convertía otra vez a NumPy para el
+video, y la subida se decodificaba una vez para rembg y otra para componer.
+Ahora cada etapa recibe y devuelve un `PipelineImage`, que guarda lo que ya
+se ha calculado de la imagen:
+
+    original = PipelineImage(input_image_bytes)
+    original.image       # se decodifica aquí, una vez (EXIF aplicado)
+    original.rgb()       # array RGB para el video, una vez
+    result.png()         # se codifica sólo al guardar la respuesta
+
+Un `PipelineImage` creado a partir de bytes PNG los reutiliza tal cual en
+`png()`, sin volver a codificar.
+"""
+from io import BytesIO
+
+from django.conf import settings
+from PIL import Image, ImageOps
+
+from .tracing import span
+
+_PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+class PipelineImage:
+    """
+    Una imagen en cualquiera de sus formas: bytes codificados, imagen PIL
+    decodificada y array RGB. Se crea con los bytes (`data`) o con la imagen
+    (`image`); el resto se obtiene bajo demanda y se conserva.
+    """
+
+    __slots__ = ("_data", "_image", "_rgb", "_png")
+
+    def __init__(self, data=None, image=None):
+        if data is None and image is None:
+            raise ValueError("Hace falta `data` o `image`")
+        self._data = data
+        self._image = image
+        self._rgb = None
+        self._png = data if data is not None and data.startswith(_PNG_SIGNATURE) else None
+
+    @property
+    def data(self):
+        """
+        Los bytes con los que se creó (None si se creó con una imagen).
+        """
+        return self._data
+
+    @property
+    def image(self):
+        """
+        Imagen PIL, decodificada la primera vez y con la orientación EXIF
+        aplicada (como hace rembg antes de la inferencia).
+        """
+        if self._image is None:
+            with span("decode"):
+                image = Image.open(BytesIO(self._data))
+                self._image = ImageOps.exif_transpose(image)
+        return self._image
+
+    @property
+    def size(self):
+        return self.image.size
+
+    def rgb(self):
+        """
+        Array de NumPy (alto x ancho x 3) de la imagen en RGB.
+        """
+        if self._rgb is None:
+            import numpy as np
+
+            self._rgb = np.asarray(self.image.convert("RGB"))
+        return self._rgb
+
+    def png(self):
+        """
+        La imagen en PNG: los bytes originales si ya lo eran o, si no, la
+        imagen codificada con OUTPUT_PNG_COMPRESS_LEVEL (una sola vez).
+        """
+        if self._png is None:
+            with span("encode"):
+                buffer = BytesIO()
+                self.image.save(buffer, "PNG", compress_level=settings.OUTPUT_PNG_COMPRESS_LEVEL)
+                self._png = buffer.getvalue()
+        return self._png
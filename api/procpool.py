@@ -0,0 +1,317 @@
+"""
+Pool de procesos para las etapas de CPU (rembg, composición y video).
+
+En un worker con hilos, rembg, PIL y la preparación del video compiten por
+el GIL y por las sesiones de ONNX Runtime del proceso. Con
+PROCESS_POOL_SIZE > 0 esas etapas se ejecutan en procesos hijos, cada uno
+con su propia sesión de cada modelo ya cargada y calentada al arrancar:
+
+    no_bg = process_pool.run(cutout_task, image_bytes, model_name="u2net", output="png")
+
+- Las imágenes van y vuelven por memoria compartida
+  (multiprocessing.shared_memory): al hijo sólo se le envía el nombre y el
+  tamaño de cada bloque, no los bytes serializados con pickle. El proceso
+  que lee un bloque es el que lo libera.
+- Cada tarea ocupa un hueco de una cola acotada (PROCESS_POOL_SIZE en
+  ejecución más PROCESS_POOL_QUEUE esperando). Si no hay hueco en
+  PROCESS_POOL_QUEUE_TIMEOUT segundos se lanza PoolSaturated y la vista
+  responde 429 con Retry-After. Los trabajos de la cola (api.jobs) no tienen
+  prisa: esperan su turno (ver `waiting`).
+- Las etapas medidas con api.tracing dentro del hijo se suman a la traza
+  de la petición, así que Server-Timing sigue mostrando rembg, video...
+
+Sin pool (por defecto) todo se ejecuta en el hilo de la petición, como antes.
+"""
+import contextvars
+import logging
+import multiprocessing
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from multiprocessing import resource_tracker, shared_memory
+
+from django.conf import settings
+
+from .metrics import metrics
+from .tracing import current_trace, start_trace
+
+logger = logging.getLogger(__name__)
+
+# True en los procesos del pool: allí las etapas se ejecutan directamente
+_in_worker = False
+# Con True, `run` espera un hueco sin límite en lugar de lanzar PoolSaturated
+_wait_for_slot = contextvars.ContextVar("process_pool_wait", default=False)
+
+# Bloque de memoria compartida con `size` bytes útiles (el bloque puede ser mayor)
+SharedBuffer = namedtuple("SharedBuffer", ["name", "size"])
+
+
+class PoolSaturated(Exception):
+    """
+    El pool de procesos y su cola están llenos; el cliente debe reintentar.
+    """
+
+
+def in_worker():
+    return _in_worker
+
+
+@contextmanager
+def waiting():
+    """
+    Dentro del bloque, `run` espera a que haya hueco en lugar de rechazar
+    la tarea (para la cola de trabajos).
+    """
+    token = _wait_for_slot.set(True)
+    try:
+        yield
+    finally:
+        _wait_for_slot.reset(token)
+
+
+def _share(data):
+    """
+    Copia `data` a un bloque nuevo de memoria compartida. Quien lo lea con
+    `_take` lo libera.
+    """
+    shm = shared_memory.SharedMemory(create=True, size=max(len(data), 1))
+    try:
+        shm.buf[:len(data)] = data
+        return SharedBuffer(shm.name, len(data))
+    finally:
+        shm.close()
+
+
+def _read(buffer):
+    shm = shared_memory.SharedMemory(name=buffer.name)
+    try:
+        return bytes(shm.buf[:buffer.size])
+    finally:
+        shm.close()
+
+
+def _unlink(buffer):
+    try:
+        shm = shared_memory.SharedMemory(name=buffer.name)
+    except FileNotFoundError:
+        return
+    shm.close()
+    shm.unlink()
+
+
+def _take(buffer):
+    """
+    Lee un bloque creado por otro proceso y lo libera.
+    """
+    try:
+        return _read(buffer)
+    finally:
+        _unlink(buffer)
+
+
+def _init_worker():
+    """
+    Arranque de cada proceso del pool: configura Django y carga una sesión
+    de cada modelo de API_WARMUP_MODELS con una inferencia de prueba.
+    """
+    global _in_worker
+    _in_worker = True
+
+    import django
+
+    django.setup()
+
+    from .warmup import _warm_model
+
+    for model_name in settings.API_WARMUP_MODELS:
+        start = time.perf_counter()
+        _warm_model(model_name)
+        logger.info("Proceso del pool: %s cargado en %.3fs", model_name, time.perf_counter() - start)
+
+
+def _ready():
+    return True
+
+
+def _traced(task, args, kwargs):
+    trace, _ = start_trace()
+    result = task(*args, **kwargs)
+    return result, trace.stages()
+
+
+def _execute(task, buffers, kwargs, traced):
+    """
+    Ejecuta `task` en el proceso del pool con los bytes de `buffers`. Si
+    devuelve bytes, vuelven en un bloque de memoria compartida.
+    """
+    args = [_read(buffer) for buffer in buffers]
+    if traced:
+        # En un contexto propio para no dejar la traza puesta en el proceso
+        result, stages = contextvars.Context().run(_traced, task, args, kwargs)
+    else:
+        result, stages = task(*args, **kwargs), {}
+    if isinstance(result, (bytes, bytearray)):
+        result = _share(result)
+    return result, stages
+
+
+class ProcessPool:
+    """
+    Pool de procesos con admisión acotada. Los procesos se arrancan con la
+    primera tarea (o con `start`), no al importar el módulo.
+    """
+
+    def __init__(self, size=None, queue_size=None):
+        self._size = size
+        self._queue_size = queue_size
+        self._executor = None
+        self._slots = None
+        self._in_flight = 0
+        self._lock = threading.Lock()
+
+    @property
+    def size(self):
+        return self._size if self._size is not None else settings.PROCESS_POOL_SIZE
+
+    @property
+    def queue_size(self):
+        return self._queue_size if self._queue_size is not None else settings.PROCESS_POOL_QUEUE
+
+    @property
+    def enabled(self):
+        return self.size > 0 and not _in_worker
+
+    def executor(self):
+        with self._lock:
+            if self._executor is None:
+                # Antes de crear los hijos: así comparten el resource tracker
+                # del padre y un bloque creado en un proceso se puede liberar
+                # en el otro
+                resource_tracker.ensure_running()
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.size,
+                    mp_context=multiprocessing.get_context(settings.PROCESS_POOL_START_METHOD),
+                    initializer=_init_worker,
+                )
+            if self._slots is None:
+                self._slots = threading.BoundedSemaphore(self.size + self.queue_size)
+            return self._executor
+
+    def start(self):
+        """
+        Arranca y calienta todos los procesos del pool (desde el warm-up).
+        """
+        executor = self.executor()
+        for future in [executor.submit(_ready) for _ in range(self.size)]:
+            future.result()
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def _acquire(self):
+        timeout = None if _wait_for_slot.get() else settings.PROCESS_POOL_QUEUE_TIMEOUT
+        start = time.perf_counter()
+        if timeout is None:
+            acquired = self._slots.acquire()
+        elif timeout > 0:
+            acquired = self._slots.acquire(timeout=timeout)
+        else:
+            acquired = self._slots.acquire(blocking=False)
+        if not acquired:
+            metrics.increment("process_pool_rejected_total")
+            raise PoolSaturated("Hay demasiadas imágenes en proceso, inténtalo más tarde")
+        metrics.observe("process_pool_wait_seconds", time.perf_counter() - start)
+        with self._lock:
+            self._in_flight += 1
+            metrics.maximum("process_pool_in_flight_max", self._in_flight)
+
+    def _release(self):
+        with self._lock:
+            self._in_flight -= 1
+        self._slots.release()
+
+    def _broken(self, executor):
+        """
+        Un proceso del pool murió: se descarta el pool y la siguiente tarea
+        arranca uno nuevo.
+        """
+        logger.error("El pool de procesos se rompió; se creará uno nuevo")
+        metrics.increment("process_pool_broken_total")
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def run(self, task, *data, **kwargs):
+        """
+        Ejecuta `task(*data, **kwargs)` en un proceso del pool y devuelve su
+        resultado. `data` son los bytes de las imágenes (van por memoria
+        compartida); `task` debe ser una función de módulo y `kwargs`
+        valores pequeños. Lanza PoolSaturated si la cola está llena.
+        """
+        executor = self.executor()
+        self._acquire()
+        name = task.__name__
+        buffers = []
+        start = time.perf_counter()
+        try:
+            buffers = [_share(item) for item in data]
+            trace = current_trace()
+            try:
+                result, stages = executor.submit(
+                    _execute, task, buffers, kwargs, trace is not None
+                ).result()
+            except BrokenProcessPool:
+                self._broken(executor)
+                raise
+        finally:
+            for buffer in buffers:
+                _unlink(buffer)
+            self._release()
+
+        if isinstance(result, SharedBuffer):
+            result = _take(result)
+        if trace is not None:
+            for stage_name, seconds in stages.items():
+                trace.add(stage_name, seconds)
+        metrics.increment("process_pool_tasks_total", task=name)
+        metrics.observe("process_pool_task_seconds", time.perf_counter() - start, task=name)
+        return result
+
+
+def cutout_task(image_bytes, model_name, output):
+    """
+    Quita el fondo de una imagen (ver api.batch.cutout_images).
+    """
+    from .batch import cutout_images
+
+    return cutout_images([image_bytes], model_name, output)[0]
+
+
+def remove_background2_task(input_image_bytes, ttl=None, model_name=None):
+    """
+    remove-background2 completo (rembg, fondo fijo y video); devuelve las
+    referencias.
+    """
+    from .views import RemoveBackgroundView2
+
+    return RemoveBackgroundView2().compute_result(input_image_bytes, ttl, model_name)
+
+
+def compose_jurassic_task(input_image_bytes, jurassic_image_bytes, ttl=None, key=None):
+    """
+    Logos y video de jurassic-explorer; devuelve las referencias.
+    """
+    from .views import JurassicExplorerView
+
+    return JurassicExplorerView().compose_result(input_image_bytes, jurassic_image_bytes, ttl, key)
+
+
+# Compartido por todas las vistas del proceso
+process_pool = ProcessPool()
@@ -0,0 +1,197 @@
+"""
+Formatos de respuesta de las vistas que generan imágenes y video.
+
+El parámetro `response` de la query string elige el formato (por defecto
+API_RESPONSE_MODE, que es `dataurl`):
+
+- `dataurl`: el formato de siempre, JSON con los ficheros en base64 como
+  data URLs.
+- `urls`: JSON con la URL de descarga de cada fichero. Los ficheros se
+  sirven desde disco con soporte de Range (el video se puede reproducir y
+  buscar sin descargarlo entero), o los envía nginx/Apache con
+  ARTIFACT_SENDFILE. Las URLs no están firmadas: cualquiera que tenga una
+  puede descargar el fichero hasta que caduca (ARTIFACT_TTL).
+- `multipart`: un cuerpo multipart/mixed con los ficheros en binario, una
+  parte por fichero, enviado por trozos.
+"""
+import base64
+import os
+import re
+import secrets
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from rest_framework import status
+from rest_framework.response import Response
+
+from .artifacts import artifact_store
+from .tracing import span
+
+RESPONSE_MODES = ("urls", "multipart", "dataurl")
+
+CHUNK_SIZE = 64 * 1024
+
+_RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def response_mode(request):
+    """
+    Formato pedido en `?response=`; lanza ValueError si no es válido.
+    """
+    mode = request.GET.get("response") or settings.API_RESPONSE_MODE
+    if mode not in RESPONSE_MODES:
+        raise ValueError(
+            f"Formato de respuesta no válido. Opciones: {', '.join(RESPONSE_MODES)}"
+        )
+    return mode
+
+
+def artifact_urls(request, refs):
+    return {
+        name: request.build_absolute_uri(ref["url"]) for name, ref in refs.items()
+    }
+
+
+def artifact_data_urls(refs):
+    data = {}
+    for name, ref in refs.items():
+        with span("readback"):
+            raw = artifact_store.read(ref["id"])
+        with span("base64"):
+            encoded = base64.b64encode(raw).decode("utf-8")
+        data[name] = f"data:{ref['content_type']};base64,{encoded}"
+    return data
+
+
+def _iter_file(path, start=0, length=None):
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = length
+        while remaining is None or remaining > 0:
+            size = CHUNK_SIZE if remaining is None else min(CHUNK_SIZE, remaining)
+            chunk = f.read(size)
+            if not chunk:
+                break
+            if remaining is not None:
+                remaining -= len(chunk)
+            yield chunk
+
+
+def _iter_multipart(parts, boundary):
+    for name, ref, path in parts:
+        filename = os.path.basename(path)
+        yield (
+            f"--{boundary}\r\n"
+            f"Content-Type: {ref['content_type']}\r\n"
+            f"Content-Disposition: attachment; name=\"{name}\"; filename=\"{name}{os.path.splitext(filename)[1]}\"\r\n"
+            f"Content-Length: {ref['size']}\r\n"
+            "\r\n"
+        ).encode()
+        yield from _iter_file(path)
+        yield b"\r\n"
+    yield f"--{boundary}--\r\n".encode()
+
+
+def multipart_response(refs):
+    """
+    Respuesta multipart/mixed con una parte por fichero, en el orden de `refs`.
+    """
+    # Las rutas se resuelven antes de empezar a enviar: si algo ha caducado
+    # se devuelve un error en lugar de un cuerpo cortado
+    parts = [(name, ref, artifact_store.path(ref["id"])) for name, ref in refs.items()]
+    boundary = secrets.token_hex(16)
+    return StreamingHttpResponse(
+        _iter_multipart(parts, boundary),
+        content_type=f'multipart/mixed; boundary="{boundary}"',
+    )
+
+
+def render_artifacts(request, refs, mode):
+    """
+    Respuesta con los ficheros de `refs` ({nombre: referencia}) en el formato
+    `mode`. En JSON las claves son las mismas en `urls` y en `dataurl`, y
+    ambos valores sirven directamente como `src` de <img> o <video>.
+    """
+    if mode == "multipart":
+        return multipart_response(refs)
+    if mode == "dataurl":
+        return Response(artifact_data_urls(refs), status=status.HTTP_200_OK)
+    return Response(artifact_urls(request, refs), status=status.HTTP_200_OK)
+
+
+def parse_range(header, size):
+    """
+    (inicio, fin) inclusivos de una cabecera Range de un solo rango, None si
+    no hay rango utilizable (se sirve el fichero entero) o ValueError si el
+    rango no se puede satisfacer.
+    """
+    match = _RANGE_RE.match(header.strip()) if header else None
+    if match is None:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # bytes=-N: los últimos N bytes
+        length = int(last)
+        if length == 0:
+            raise ValueError(header)
+        return max(0, size - length), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise ValueError(header)
+    return start, end
+
+
+def ranged_file_response(request, path, content_type):
+    """
+    Sirve el fichero `path` entero o el rango pedido en la cabecera Range.
+    """
+    size = os.path.getsize(path)
+    try:
+        byte_range = parse_range(request.headers.get("Range"), size)
+    except ValueError:
+        response = HttpResponse(status=416)
+        response["Content-Range"] = f"bytes */{size}"
+        return response
+
+    if byte_range is None:
+        response = FileResponse(open(path, "rb"), content_type=content_type)
+    else:
+        start, end = byte_range
+        length = end - start + 1
+        response = StreamingHttpResponse(
+            _iter_file(path, start, length), status=206, content_type=content_type
+        )
+        response["Content-Length"] = str(length)
+        response["Content-Range"] = f"bytes {start}-{end}/{size}"
+    response["Accept-Ranges"] = "bytes"
+    return response
+
+
+def file_response(request, path, content_type):
+    """
+    Respuesta para un fichero en disco. Con ARTIFACT_SENDFILE el envío (y los
+    rangos) los hace el servidor web delante de Django y el worker queda libre
+    al momento:
+
+    - 'x-accel-redirect' (nginx): ruta interna ARTIFACT_ACCEL_PREFIX + nombre,
+      que nginx debe mapear al directorio de ficheros con `internal`.
+    - 'x-sendfile' (Apache mod_xsendfile, lighttpd): ruta absoluta.
+
+    Sin él, Django sirve el fichero por trozos (ver `ranged_file_response`).
+    """
+    sendfile = settings.ARTIFACT_SENDFILE
+    if not sendfile:
+        return ranged_file_response(request, path, content_type)
+
+    response = HttpResponse(content_type=content_type)
+    if sendfile == "x-accel-redirect":
+        prefix = settings.ARTIFACT_ACCEL_PREFIX.rstrip("/")
+        response["X-Accel-Redirect"] = f"{prefix}/{os.path.basename(path)}"
+    elif sendfile == "x-sendfile":
+        response["X-Sendfile"] = os.path.abspath(path)
+    else:
+        raise ValueError(f"ARTIFACT_SENDFILE no válido: {sendfile}")
+    return response
@@ -0,0 +1,180 @@
+"""
+Opciones de ONNX Runtime para las sesiones de rembg.
+
+rembg crea las sesiones con `SessionOptions` por defecto: cada sesión usa un
+pool de hilos con tantos hilos como núcleos. Con varios workers de gunicorn
+(y varias sesiones por worker) los hilos superan con creces a los núcleos y
+el rendimiento se desploma bajo carga. Aquí se construyen las opciones desde
+settings y se aplican a todas las sesiones que crea el API:
+
+- ONNX_INTRA_OP_THREADS / ONNX_INTER_OP_THREADS: hilos por sesión (0 = lo
+  que decida ONNX Runtime).
+- ONNX_ALLOW_SPINNING: los hilos ociosos esperan activamente (consume CPU
+  que otros workers podrían usar).
+- ONNX_GRAPH_OPTIMIZATION: nivel de optimización del grafo.
+- ONNX_OPTIMIZED_MODEL_DIR: guarda el modelo ya optimizado y lo reutiliza en
+  las siguientes cargas, que así se saltan la optimización.
+- ONNX_CPU_MEM_ARENA / ONNX_MEM_PATTERN: arena de memoria de la CPU y
+  preasignación según el patrón de la primera ejecución.
+- ONNX_CPU_AFFINITY: fija cada worker a su propio grupo de núcleos.
+"""
+import logging
+import os
+import tempfile
+import threading
+
+import onnxruntime as ort
+from django.conf import settings
+from rembg import new_session
+from rembg.sessions import sessions_class
+
+from .metrics import metrics
+
+try:
+    import fcntl
+except ImportError:  # Windows: sin afinidad por worker
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+GRAPH_OPTIMIZATION_LEVELS = {
+    "disable": ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+    "basic": ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+    "extended": ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+    "all": ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+}
+
+_affinity_lock = threading.Lock()
+_affinity_applied = False
+# Fichero del grupo de núcleos reservado: se mantiene abierto (y bloqueado)
+# mientras viva el proceso
+_affinity_file = None
+
+
+def session_options():
+    """
+    SessionOptions construidas desde settings.
+    """
+    level = settings.ONNX_GRAPH_OPTIMIZATION
+    if level not in GRAPH_OPTIMIZATION_LEVELS:
+        raise ValueError(
+            f"ONNX_GRAPH_OPTIMIZATION no válido: {level}. "
+            f"Opciones: {', '.join(GRAPH_OPTIMIZATION_LEVELS)}"
+        )
+    opts = ort.SessionOptions()
+    opts.intra_op_num_threads = settings.ONNX_INTRA_OP_THREADS
+    opts.inter_op_num_threads = settings.ONNX_INTER_OP_THREADS
+    opts.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+    opts.graph_optimization_level = GRAPH_OPTIMIZATION_LEVELS[level]
+    opts.enable_cpu_mem_arena = settings.ONNX_CPU_MEM_ARENA
+    opts.enable_mem_pattern = settings.ONNX_MEM_PATTERN
+    opts.add_session_config_entry(
+        "session.intra_op.allow_spinning", "1" if settings.ONNX_ALLOW_SPINNING else "0"
+    )
+    opts.add_session_config_entry(
+        "session.inter_op.allow_spinning", "1" if settings.ONNX_ALLOW_SPINNING else "0"
+    )
+    return opts
+
+
+def _cores_per_worker():
+    return max(1, settings.ONNX_INTRA_OP_THREADS)
+
+
+def pin_worker():
+    """
+    Fija el proceso a un grupo libre de núcleos (ONNX_INTRA_OP_THREADS
+    núcleos por worker). Los grupos se reservan con un flock por grupo en el
+    directorio temporal, así cada worker de la máquina se queda con uno
+    distinto sin necesidad de saber su número. Sólo en Linux; si no quedan
+    grupos libres el proceso no se fija. Devuelve los núcleos asignados o None.
+    """
+    global _affinity_applied, _affinity_file
+    with _affinity_lock:
+        if _affinity_applied:
+            return None
+        _affinity_applied = True
+        if fcntl is None or not hasattr(os, "sched_setaffinity"):
+            return None
+
+        cores = sorted(os.sched_getaffinity(0))
+        size = _cores_per_worker()
+        groups = [cores[i:i + size] for i in range(0, len(cores) - size + 1, size)]
+        for index, group in enumerate(groups):
+            path = os.path.join(tempfile.gettempdir(), f"bg-remover-cpu-{index}.lock")
+            f = open(path, "a")
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                f.close()
+                continue
+            _affinity_file = f
+            os.sched_setaffinity(0, group)
+            metrics.increment("onnx_worker_pinned_total")
+            logger.info("Worker %s fijado a los núcleos %s", os.getpid(), group)
+            return group
+        logger.warning("No quedan grupos de núcleos libres; el worker %s no se fija", os.getpid())
+        return None
+
+
+def _optimized_path(model_name):
+    directory = str(settings.ONNX_OPTIMIZED_MODEL_DIR)
+    # El modelo optimizado depende de la versión de ONNX Runtime y del nivel
+    level = settings.ONNX_GRAPH_OPTIMIZATION
+    return os.path.join(directory, f"{model_name}-ort{ort.__version__}-{level}.onnx")
+
+
+def _session_class(model_name):
+    for cls in sessions_class:
+        if cls.name() == model_name:
+            return cls
+    raise ValueError(f"No session class found for model '{model_name}'")
+
+
+def _new_cached_session(model_name, opts):
+    """
+    Crea la sesión a partir del modelo optimizado guardado, o la crea desde
+    el original y guarda el optimizado para las siguientes cargas.
+    """
+    cls = _session_class(model_name)
+    original = cls.download_models()
+    optimized = _optimized_path(model_name)
+
+    if os.path.exists(optimized) and os.path.getmtime(optimized) >= os.path.getmtime(original):
+        # Misma clase de rembg (pre y postprocesado), pero leyendo el modelo
+        # optimizado en lugar del original; ya no hay nada que optimizar
+        cached_cls = type(cls.__name__, (cls,), {
+            "download_models": classmethod(lambda c, *args, **kwargs: optimized),
+        })
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_DISABLE_ALL
+        metrics.increment("onnx_optimized_model_loads_total", model=model_name)
+        return cached_cls(model_name, opts)
+
+    os.makedirs(os.path.dirname(optimized), exist_ok=True)
+    # Cada worker escribe en su propio temporal; el rename es atómico
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(optimized), suffix=".tmp")
+    os.close(fd)
+    opts.optimized_model_filepath = tmp_path
+    try:
+        session = new_session(model_name, sess_opts=opts)
+        os.replace(tmp_path, optimized)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+    metrics.increment("onnx_optimized_models_saved_total", model=model_name)
+    return session
+
+
+def create_session(model_name):
+    """
+    Crea una sesión de rembg con las opciones de settings. Es la fábrica que
+    usa el registro de sesiones.
+    """
+    if settings.ONNX_CPU_AFFINITY:
+        # Antes de crear la sesión: sus hilos heredan la afinidad del proceso
+        pin_worker()
+    opts = session_options()
+    if settings.ONNX_OPTIMIZED_MODEL_DIR:
+        return _new_cached_session(model_name, opts)
+    return new_session(model_name, sess_opts=opts)
@@ -0,0 +1,173 @@
+"""
+Registro de sesiones de rembg compartido por todo el proceso.
+
+Crear una sesión carga el modelo ONNX en memoria, lo que tarda bastante más
+que la propia inferencia. Cada worker crea las sesiones una sola vez, bajo
+demanda, y las reutiliza entre peticiones y entre vistas. Las sesiones se
+agrupan por nombre de modelo en pools de tamaño acotado: si todas las de un
+modelo están en uso, la petición espera a que se libere una.
+
+Cada petición puede elegir el modelo entre los permitidos
+(REMBG_ALLOWED_MODELS); si no indica ninguno se usa el del endpoint
+(REMBG_ENDPOINT_MODELS) o REMBG_DEFAULT_MODEL.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from .metrics import metrics
+
+
+def create_session(model_name):
+    """
+    Fábrica de sesiones por defecto (api.runtime.create_session). El
+    modelo ONNX se carga al crear la primera sesión (o en el warm-up).
+    """
+    from .runtime import create_session as factory
+
+    return factory(model_name)
+
+
+class SessionPoolTimeout(Exception):
+    """
+    No se liberó ninguna sesión del modelo dentro del tiempo de espera.
+    """
+
+
+class UnknownModel(ValueError):
+    """
+    El modelo pedido no está entre los permitidos.
+    """
+
+
+def resolve_model(requested=None, endpoint=None):
+    """
+    Modelo para una petición: `requested` si está permitido o, si no se pidió
+    ninguno, el configurado para `endpoint` (o el modelo por defecto).
+    """
+    if not requested:
+        return settings.REMBG_ENDPOINT_MODELS.get(endpoint) or settings.REMBG_DEFAULT_MODEL
+    if requested not in settings.REMBG_ALLOWED_MODELS:
+        raise UnknownModel(
+            f"Modelo no válido. Opciones: {', '.join(settings.REMBG_ALLOWED_MODELS)}"
+        )
+    return requested
+
+
+class SessionPool:
+    """
+    Pool acotado de sesiones para un único modelo.
+    """
+
+    def __init__(self, model_name, max_size, factory=create_session):
+        if max_size < 1:
+            raise ValueError("El tamaño del pool debe ser al menos 1")
+        self.model_name = model_name
+        self.max_size = max_size
+        self._factory = factory
+        self._idle = []
+        self._created = 0
+        self._cond = threading.Condition()
+
+    @property
+    def created(self):
+        return self._created
+
+    def _checkout(self, timeout):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while True:
+                if self._idle:
+                    metrics.increment("rembg_sessions_reused_total", model=self.model_name)
+                    return self._idle.pop()
+                if self._created < self.max_size:
+                    # Reservamos el hueco antes de soltar el lock: la carga
+                    # del modelo es lenta y no debe bloquear al resto del pool.
+                    self._created += 1
+                    break
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise SessionPoolTimeout(
+                        f"No hay sesiones libres para el modelo '{self.model_name}'"
+                    )
+                self._cond.wait(remaining)
+
+        start = time.perf_counter()
+        try:
+            session = self._factory(self.model_name)
+        except Exception:
+            with self._cond:
+                self._created -= 1
+                self._cond.notify()
+            raise
+        metrics.increment("rembg_sessions_created_total", model=self.model_name)
+        metrics.increment(
+            "rembg_session_load_seconds_total",
+            time.perf_counter() - start,
+            model=self.model_name,
+        )
+        return session
+
+    def _checkin(self, session):
+        with self._cond:
+            self._idle.append(session)
+            self._cond.notify()
+
+    @contextmanager
+    def acquire(self, timeout=None):
+        """
+        Presta una sesión durante el bloque `with` y la devuelve al pool.
+        """
+        start = time.perf_counter()
+        session = self._checkout(timeout)
+        acquired = time.perf_counter()
+        metrics.observe("rembg_session_wait_seconds", acquired - start, model=self.model_name)
+        try:
+            yield session
+        finally:
+            self._checkin(session)
+            # Latencia de la inferencia con su pre y postprocesado, por modelo
+            metrics.observe(
+                "rembg_inference_seconds", time.perf_counter() - acquired, model=self.model_name
+            )
+
+
+class SessionRegistry:
+    """
+    Un pool de sesiones por nombre de modelo.
+    """
+
+    def __init__(self, pool_size=None, factory=create_session):
+        self._pool_size = pool_size
+        self._factory = factory
+        self._pools = {}
+        self._lock = threading.Lock()
+
+    def pool(self, model_name=None):
+        model_name = model_name or settings.REMBG_DEFAULT_MODEL
+        with self._lock:
+            pool = self._pools.get(model_name)
+            if pool is None:
+                size = self._pool_size or settings.REMBG_SESSION_POOL_SIZE
+                pool = SessionPool(model_name, size, self._factory)
+                self._pools[model_name] = pool
+            return pool
+
+    def session(self, model_name=None, timeout=None):
+        """
+        Context manager que presta una sesión del modelo indicado
+        (o del modelo por defecto de settings).
+        """
+        if timeout is None:
+            timeout = settings.REMBG_SESSION_TIMEOUT
+        return self.pool(model_name).acquire(timeout)
+
+    def models(self):
+        with self._lock:
+            return list(self._pools)
+
+
+# Registro compartido por todas las vistas del proceso
+session_registry = SessionRegistry()
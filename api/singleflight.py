@@ -0,0 +1,213 @@
+"""
+Deduplicación de peticiones idénticas en curso ("single-flight").
+
+Cuando un cliente reintenta o el frontend envía dos veces el mismo formulario,
+llegan a la vez varias peticiones con la misma imagen. Sin deduplicar, cada
+una vuelve a segmentar, a llamar a Gemini y a codificar el video. Con
+`single_flight.do(key, func)` la primera petición con una clave ejecuta
+`func` y las que llegan mientras tanto esperan y reciben su resultado.
+
+Dentro de un worker basta con hilos. Entre workers de la misma máquina se
+puede activar SINGLEFLIGHT_LOCK_DIR: el primer proceso toma un lock de
+fichero (flock) para la clave y guarda el resultado en JSON junto al lock;
+los demás esperan al lock y reutilizan ese resultado si tiene menos de
+SINGLEFLIGHT_RESULT_TTL segundos. En ese modo `func` debe devolver algo
+serializable a JSON.
+"""
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+
+from .metrics import metrics
+
+try:
+    import fcntl
+except ImportError:  # Windows: sólo deduplicación dentro del proceso
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+class _Call:
+    """
+    Ejecución en curso de una clave y su resultado.
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class FileLock:
+    """
+    Lock exclusivo entre procesos sobre `path` con flock.
+
+    Si otro proceso borra el fichero mientras esperamos (ver
+    SingleFlight.purge), el lock obtenido ya no corresponde a la ruta y se
+    vuelve a intentar con el fichero nuevo.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._fd = None
+
+    def __enter__(self):
+        while True:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                if os.fstat(fd).st_ino == os.stat(self.path).st_ino:
+                    self._fd = fd
+                    return self
+            except FileNotFoundError:
+                pass
+            os.close(fd)
+
+    def __exit__(self, *exc):
+        fcntl.flock(self._fd, fcntl.LOCK_UN)
+        os.close(self._fd)
+        self._fd = None
+
+
+class SingleFlight:
+    """
+    Agrupa las ejecuciones simultáneas de la misma clave.
+    """
+
+    def __init__(self, lock_dir=None, result_ttl=None):
+        self._lock_dir = lock_dir
+        self._result_ttl = result_ttl
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._last_purge = 0
+
+    @property
+    def lock_dir(self):
+        lock_dir = self._lock_dir or settings.SINGLEFLIGHT_LOCK_DIR
+        if lock_dir and fcntl is not None:
+            return str(lock_dir)
+        return None
+
+    @property
+    def result_ttl(self):
+        if self._result_ttl is not None:
+            return self._result_ttl
+        return settings.SINGLEFLIGHT_RESULT_TTL
+
+    def do(self, key, func):
+        """
+        Ejecuta `func()` o, si ya hay una ejecución en curso para `key`,
+        espera a que termine y devuelve su resultado (o relanza su error).
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+
+        if not leader:
+            metrics.increment("singleflight_shared_total", scope="thread")
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = self._run(key, func)
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def _run(self, key, func):
+        lock_dir = self.lock_dir
+        if lock_dir is None:
+            return func()
+
+        os.makedirs(lock_dir, exist_ok=True)
+        result_path = os.path.join(lock_dir, f"{key}.json")
+        with FileLock(os.path.join(lock_dir, f"{key}.lock")):
+            # Si otro worker acaba de calcularlo mientras esperábamos el lock,
+            # su resultado sigue en disco
+            result = self._read_result(result_path)
+            if result is not None:
+                metrics.increment("singleflight_shared_total", scope="process")
+                return result
+            result = func()
+            self._write_result(result_path, result)
+        self._maybe_purge(lock_dir)
+        return result
+
+    def _read_result(self, path):
+        try:
+            if time.time() - os.path.getmtime(path) > self.result_ttl:
+                return None
+            with open(path, encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning("No se pudo leer el resultado compartido %s: %s", path, e)
+            return None
+
+    def _write_result(self, path, result):
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(result, f)
+            os.replace(tmp_path, path)
+        except (OSError, TypeError, ValueError) as e:
+            logger.warning("No se pudo guardar el resultado compartido %s: %s", path, e)
+
+    def _maybe_purge(self, lock_dir, interval=60):
+        now = time.time()
+        if now - self._last_purge > interval:
+            self._last_purge = now
+            self.purge(lock_dir, now)
+
+    def purge(self, lock_dir, now=None):
+        """
+        Borra los resultados caducados y los locks que nadie está usando.
+        """
+        now = now or time.time()
+        for name in os.listdir(lock_dir):
+            path = os.path.join(lock_dir, name)
+            try:
+                if now - os.path.getmtime(path) <= self.result_ttl:
+                    continue
+                if name.endswith(".lock"):
+                    self._remove_idle_lock(path)
+                else:
+                    os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+    @staticmethod
+    def _remove_idle_lock(path):
+        fd = os.open(path, os.O_RDWR)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            # Alguien lo tiene tomado: se deja para la próxima vez
+            os.close(fd)
+            return
+        try:
+            os.unlink(path)
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+
+# Compartido por todas las vistas del proceso
+single_flight = SingleFlight()
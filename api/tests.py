@@ -1,3 +1,1703 @@
-from django.test import TestCase
+import os
+import re
+import shutil
+import sqlite3
+import subprocess
+import tempfile
+import threading
+import time
+from contextlib import redirect_stdout
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase, override_settings
+from PIL import Image
+
+
+def image_bytes(size=(64, 48), fmt="JPEG", color=(200, 80, 40)):
+    buffer = BytesIO()
+    Image.new("RGB", size, color).save(buffer, fmt)
+    return buffer.getvalue()
+
+
+def upload(name, data, content_type="image/jpeg"):
+    return SimpleUploadedFile(name, data, content_type=content_type)
+
+
+def subject_bytes(size=(96, 64), fmt="PNG", color=(200, 40, 40)):
+    """
+    Imagen con un objeto (una elipse) sobre un fondo liso, para que el modelo
+    devuelva una máscara no trivial.
+    """
+    from PIL import ImageDraw
+
+    img = Image.new("RGB", size, (235, 235, 225))
+    width, height = size
+    ImageDraw.Draw(img).ellipse((width // 4, height // 5, 3 * width // 4, 4 * height // 5), fill=color)
+    buffer = BytesIO()
+    img.save(buffer, fmt)
+    return buffer.getvalue()
+
+
+def alpha(data):
+    with Image.open(BytesIO(data)) as img:
+        return np.asarray(img.getchannel("A"), dtype=np.int16)
+
+
+@override_settings(PROCESS_POOL_SIZE=0, REMBG_FAST_MASK=False)
+class BatchUploadTests(SimpleTestCase):
+    def setUp(self):
+        from . import batch, views
+        from .cache import ResultCache
+
+        # Sin caché: cada llamada ejecuta el modelo
+        for module in (batch, views):
+            patcher = mock.patch.object(module, "result_cache", ResultCache(max_bytes=0))
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.images = [
+            subject_bytes((96, 64)),
+            subject_bytes((64, 80), "JPEG", (30, 90, 200)),
+            subject_bytes((120, 60), color=(20, 160, 60)),
+        ]
+
+    def test_batch_matches_the_single_image_view(self):
+        from .batch import remove_background_batch
+        from .views import RemoveBackgroundView
+
+        outputs = remove_background_batch(self.images, "u2netp", "png")
+        view = RemoveBackgroundView()
+        for index, (data, output) in enumerate(zip(self.images, outputs)):
+            with self.subTest(image=index):
+                single = view.process_image(data, "u2netp", "png")
+                # Misma máscara salvo redondeo de la inferencia por lotes
+                self.assertLessEqual(np.abs(alpha(output) - alpha(single)).max(), 1)
+                with Image.open(BytesIO(output)) as img, Image.open(BytesIO(data)) as original:
+                    self.assertEqual((img.mode, img.size), ("RGBA", original.size))
+
+    def test_iter_zip_streams_every_file_in_order(self):
+        import zipfile
+
+        from .batch import iter_zip
+
+        files = [("a.png", b"uno"), ("b.png", b"dos" * 1000), ("c.png", b"")]
+        chunks = list(iter_zip(files))
+        self.assertGreater(len(chunks), len(files))
+        with zipfile.ZipFile(BytesIO(b"".join(chunks))) as archive:
+            self.assertEqual(archive.namelist(), ["a.png", "b.png", "c.png"])
+            self.assertEqual([archive.read(name) for name, _ in files], [data for _, data in files])
+            self.assertTrue(all(info.compress_type == zipfile.ZIP_STORED for info in archive.infolist()))
+
+    def test_view_returns_a_zip_with_one_result_per_file(self):
+        import zipfile
+
+        from .batch import remove_background_batch
+
+        response = self.client.post(
+            "/api/remove-background/batch/?model=u2netp",
+            {"files": [upload(f"foto{i}.png", data) for i, data in enumerate(self.images)]},
+            HTTP_HOST="localhost",
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "application/zip")
+        with zipfile.ZipFile(BytesIO(b"".join(response.streaming_content))) as archive:
+            names = archive.namelist()
+            self.assertEqual(names, ["000-foto0-no-bg.png", "001-foto1-no-bg.png", "002-foto2-no-bg.png"])
+            expected = remove_background_batch(self.images, "u2netp", "png")
+            for name, data in zip(names, expected):
+                self.assertLessEqual(np.abs(alpha(archive.read(name)) - alpha(data)).max(), 1)
+
+    def test_batch_with_one_invalid_file_is_rejected_with_its_name(self):
+        response = self.client.post(
+            "/api/remove-background/batch/",
+            {"files": [upload("ok.jpg", image_bytes()), upload("roto.jpg", b"no es una imagen")]},
+            HTTP_HOST="localhost",
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertTrue(response.json()["error"].startswith("roto.jpg: "))
+
+    @override_settings(UPLOAD_MAX_BYTES=50_000)
+    def test_batch_with_one_file_too_large_answers_413_with_its_name(self):
+        from .batch import remove_background_batch
+
+        with mock.patch("api.batch.remove_background_batch", wraps=remove_background_batch) as batch:
+            response = self.client.post(
+                "/api/remove-background/batch/",
+                {"files": [upload("ok.jpg", image_bytes()),
+                           upload("grande.jpg", image_bytes((300, 200)) + b"\0" * 50_000)]},
+                HTTP_HOST="localhost",
+            )
+        self.assertEqual(response.status_code, 413)
+        self.assertTrue(response.json()["error"].startswith("grande.jpg: "))
+        batch.assert_not_called()
+
+
+class BrokerTests(SimpleTestCase):
+    def setUp(self):
+        from .jobs import InMemoryBroker, SQLiteBroker
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, "jobs.sqlite3")
+        self.brokers = [InMemoryBroker(), SQLiteBroker(self.path, poll_interval=0.01)]
+
+    def test_claims_by_priority_then_age(self):
+        from .jobs import Job, RUNNING
+
+        for broker in self.brokers:
+            with self.subTest(broker=type(broker).__name__):
+                for created_at, (name, priority) in enumerate([("a", 0), ("b", 5), ("c", 0), ("d", 5)], 1):
+                    broker.put(Job("kind", name.encode(), priority=priority, created_at=created_at))
+                claimed = [broker.claim(timeout=0.01) for _ in range(4)]
+                self.assertEqual([job.payload for job in claimed], [b"b", b"d", b"a", b"c"])
+                self.assertTrue(all(job.status == RUNNING and job.attempts == 1 for job in claimed))
+                self.assertIsNone(broker.claim(timeout=0.01))
+                self.assertEqual(broker.pending(), 0)
+
+    def test_claims_only_the_given_kinds(self):
+        from .jobs import Job
+
+        for broker in self.brokers:
+            with self.subTest(broker=type(broker).__name__):
+                broker.put(Job("other", b"other", priority=5, created_at=1))
+                broker.put(Job("kind", b"mine", created_at=2))
+                self.assertEqual(broker.claim(timeout=0.01, kinds=["kind"]).payload, b"mine")
+                self.assertIsNone(broker.claim(timeout=0.01, kinds=["kind"]))
+                # El trabajo de otro tipo sigue en la cola para quien lo sepa ejecutar
+                self.assertEqual(broker.pending(), 1)
+                self.assertEqual(broker.claim(timeout=0.01).payload, b"other")
+
+    def test_only_shared_brokers_start_the_workers_on_startup(self):
+        from django.apps import apps
+
+        from .jobs import InMemoryBroker, SQLiteBroker, job_queue
+
+        config = apps.get_app_config("api")
+        for broker, started in [(InMemoryBroker(), False), (SQLiteBroker(self.path), True)]:
+            with self.subTest(broker=type(broker).__name__), \
+                    override_settings(JOBS_AUTOSTART=True), \
+                    mock.patch.object(job_queue, "_broker", broker), \
+                    mock.patch.object(job_queue, "start") as start:
+                config.start_jobs()
+                self.assertEqual(start.called, started)
+
+    def test_sqlite_requeues_jobs_whose_worker_died(self):
+        from .jobs import FAILED, Job, SQLiteBroker
+
+        broker = SQLiteBroker(self.path, poll_interval=0.01, lease_seconds=0.05, max_attempts=2)
+        job = Job("kind", b"payload")
+        broker.put(job)
+        self.assertEqual(broker.claim(timeout=0.01).id, job.id)
+        # El worker muere sin guardar el resultado ni renovar el plazo
+        time.sleep(0.1)
+        retried = broker.claim(timeout=0.01)
+        self.assertEqual((retried.id, retried.payload, retried.attempts), (job.id, b"payload", 2))
+
+        time.sleep(0.1)
+        self.assertIsNone(broker.claim(timeout=0.01))
+        failed = broker.get(job.id)
+        self.assertEqual(failed.status, FAILED)
+        self.assertIn("worker", failed.error)
+
+    def test_sqlite_keeps_running_jobs_while_the_lease_is_renewed(self):
+        from .jobs import Job, SQLiteBroker
+
+        broker = SQLiteBroker(self.path, poll_interval=0.01, lease_seconds=0.2)
+        broker.put(Job("kind", b"payload"))
+        job = broker.claim(timeout=0.01)
+        for _ in range(3):
+            time.sleep(0.1)
+            broker.renew(job)
+        self.assertIsNone(broker.claim(timeout=0.01))
+
+    def test_sqlite_adds_new_columns_to_an_existing_table(self):
+        from .jobs import Job, SQLiteBroker
+
+        path = self.path + ".old"
+        conn = sqlite3.connect(path)
+        conn.execute(
+            "CREATE TABLE jobs (id TEXT PRIMARY KEY, kind TEXT NOT NULL, payload BLOB, "
+            "priority INTEGER NOT NULL DEFAULT 0, callback_url TEXT, status TEXT NOT NULL, "
+            "created_at REAL NOT NULL, started_at REAL, finished_at REAL, result TEXT, error TEXT)"
+        )
+        conn.close()
+        broker = SQLiteBroker(path, poll_interval=0.01)
+        broker.put(Job("kind", b"payload", base_url="http://testserver/"))
+        self.assertEqual(broker.claim(timeout=0.01).base_url, "http://testserver/")
+
+
+def addresses(*ips):
+    return lambda *args, **kwargs: [(None, None, None, "", (ip, 443)) for ip in ips]
+
+
+@override_settings(JOBS_CALLBACK_ALLOWED_HOSTS=[".example.com"])
+class CallbackUrlTests(SimpleTestCase):
+    def test_accepts_https_to_allowed_public_hosts(self):
+        from .jobs import validate_callback_url
+
+        with mock.patch("socket.getaddrinfo", addresses("93.184.216.34")):
+            validate_callback_url("https://hooks.example.com/jobs?token=1")
+
+    def test_rejects_disallowed_urls(self):
+        from .jobs import InvalidCallback, validate_callback_url
+
+        cases = [
+            ("http://hooks.example.com/", "93.184.216.34"),
+            ("https://evil.test/", "93.184.216.34"),
+            ("https://hooks.example.com/", "127.0.0.1"),
+            ("https://hooks.example.com/", "10.0.0.5"),
+            ("https://hooks.example.com/", "169.254.169.254"),
+            ("https://hooks.example.com/", "::1"),
+            ("ftp://hooks.example.com/", "93.184.216.34"),
+        ]
+        for url, ip in cases:
+            with self.subTest(url=url, ip=ip), mock.patch("socket.getaddrinfo", addresses(ip)):
+                with self.assertRaises(InvalidCallback):
+                    validate_callback_url(url)
+
+    @override_settings(JOBS_CALLBACK_ALLOWED_HOSTS=[])
+    def test_rejects_everything_without_allowed_hosts(self):
+        from .jobs import InvalidCallback, validate_callback_url
+
+        with mock.patch("socket.getaddrinfo", addresses("93.184.216.34")):
+            with self.assertRaises(InvalidCallback):
+                validate_callback_url("https://hooks.example.com/")
+
+    def test_submit_rejects_the_callback_before_queueing(self):
+        from .jobs import InMemoryBroker, InvalidCallback, JobQueue
+
+        queue = JobQueue(broker=InMemoryBroker())
+        queue.register("kind", lambda payload: {})
+        with self.assertRaises(InvalidCallback):
+            queue.submit("kind", b"payload", callback_url="https://127.0.0.1/")
+        self.assertEqual(queue.broker.pending(), 0)
+
+    def test_callback_payload_has_absolute_urls(self):
+        from .jobs import SUCCEEDED, Job
+
+        job = Job("kind", None, status=SUCCEEDED, base_url="https://api.example.com/",
+                  result={"video": {"id": "abc", "url": "/api/artifacts/abc/"}})
+        payload = job.callback_payload()
+        self.assertEqual(payload["result"], {"video": "https://api.example.com/api/artifacts/abc/"})
+        self.assertEqual(payload["status"], SUCCEEDED)
+
+    @override_settings(JOBS_MAX_PRIORITY=5)
+    def test_job_submit_view_clamps_the_priority(self):
+        from .jobs import Job, job_queue
+
+        for requested, expected in [("1000", 5), ("-1000", -5), ("3", 3)]:
+            with self.subTest(priority=requested), \
+                    mock.patch.object(job_queue, "submit", return_value=Job("jurassic-explorer", None)) as submit:
+                response = self.client.post(
+                    "/api/jobs/",
+                    {"file": upload("foto.jpg", image_bytes()), "kind": "jurassic-explorer",
+                     "priority": requested},
+                    HTTP_HOST="localhost",
+                )
+                self.assertEqual(response.status_code, 202)
+                self.assertEqual(submit.call_args.kwargs["priority"], expected)
+
+    def test_job_submit_view_answers_400_for_a_disallowed_callback(self):
+        response = self.client.post(
+            "/api/jobs/",
+            {"file": upload("foto.jpg", image_bytes()), "kind": "jurassic-explorer",
+             "callback_url": "http://localhost:8000/hook"},
+            HTTP_HOST="localhost",
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("https", response.json()["error"])
+
+
+def probe_video(path):
+    """
+    (start_time, frames decodificados a 24 fps constantes) de un MP4, con el
+    ffmpeg de moviepy (imageio-ffmpeg no trae ffprobe; `start` es el mismo
+    start_time que da ffprobe).
+    """
+    from moviepy.config import FFMPEG_BINARY
+
+    info = subprocess.run([FFMPEG_BINARY, "-hide_banner", "-i", path], capture_output=True, text=True).stderr
+    start_time = float(re.search(r"Duration: [^,]+, start: (-?[\d.]+)", info).group(1))
+    decoded = subprocess.run(
+        [FFMPEG_BINARY, "-v", "error", "-i", path, "-vf", "fps=24", "-f", "framemd5", "-"],
+        capture_output=True, text=True, check=True,
+    ).stdout
+    return start_time, sum(1 for line in decoded.splitlines() if line and not line.startswith("#"))
+
+
+class StaticTailEncodingTests(SimpleTestCase):
+    size = (64, 48)
+    nframes = 192
+    static_tail = 96
+
+    def frames(self, count):
+        for index in range(count):
+            index = min(index, self.nframes - self.static_tail - 1)
+            frame = np.full((self.size[1], self.size[0], 3), index * 2 % 256, dtype=np.uint8)
+            frame[10:20, index % 50:index % 50 + 10] = 255
+            yield frame
+
+    def encode(self, directory, name, static_tail, fragmented):
+        from .video import encode_mp4
+
+        path = os.path.join(directory, f"{name}.mp4")
+        frames = self.frames(self.nframes - static_tail)
+        if fragmented:
+            with open(path, "wb") as f:
+                f.write(encode_mp4(frames, self.size, self.nframes, static_tail=static_tail))
+        else:
+            encode_mp4(frames, self.size, self.nframes, static_tail=static_tail, path=path)
+        return probe_video(path)
+
+    @override_settings(VIDEO_ENCODE_MODE="pipe")
+    def test_skipping_the_tail_keeps_start_time_and_frame_count(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        for fragmented in (False, True):
+            with self.subTest(fragmented=fragmented):
+                full = self.encode(directory, f"full-{fragmented}", 0, fragmented)
+                skipped = self.encode(directory, f"tail-{fragmented}", self.static_tail, fragmented)
+                self.assertEqual(full[1], self.nframes)
+                self.assertEqual(skipped, full)
+
+
+def video_duration(path):
+    from moviepy.config import FFMPEG_BINARY
+
+    info = subprocess.run([FFMPEG_BINARY, "-hide_banner", "-i", path], capture_output=True, text=True).stderr
+    hours, minutes, seconds = re.search(r"Duration: (\d+):(\d+):([\d.]+)", info).groups()
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+
+@override_settings(VIDEO_ENCODE_MODE="pipe")
+class PipeEncoderTests(SimpleTestCase):
+    size = (32, 24)
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def frames(self, count):
+        for index in range(count):
+            yield np.full((self.size[1], self.size[0], 3), index * 20, dtype=np.uint8)
+
+    def write(self, data, name="video.mp4"):
+        path = os.path.join(self.directory, name)
+        with open(path, "wb") as f:
+            f.write(data)
+        return path
+
+    def test_encodes_every_frame_with_the_right_duration(self):
+        from .video import encode_mp4
+
+        for nframes, fps in ((12, 24), (5, 10)):
+            with self.subTest(nframes=nframes, fps=fps):
+                data = encode_mp4(self.frames(nframes), self.size, nframes, fps=fps)
+                path = self.write(data)
+                self.assertAlmostEqual(video_duration(path), nframes / fps, delta=0.01)
+                # probe_video decodifica a 24 fps: con fps=24 es un frame por frame
+                if fps == 24:
+                    self.assertEqual(probe_video(path)[1], nframes)
+
+    def test_streams_a_fragmented_mp4_in_chunks(self):
+        from .video import iter_mp4
+
+        chunks = list(iter_mp4(self.frames(12), self.size, fps=24))
+        data = b"".join(chunks)
+        self.assertEqual(data[4:8], b"ftyp")
+        self.assertIn(b"moof", data)
+        self.assertEqual(probe_video(self.write(data))[1], 12)
+
+    def test_matches_the_disk_encoder(self):
+        from .video import encode_mp4
+
+        piped = self.write(encode_mp4(self.frames(12), self.size, 12), "pipe.mp4")
+        with override_settings(VIDEO_ENCODE_MODE="disk"):
+            on_disk = self.write(encode_mp4(self.frames(12), self.size, 12), "disk.mp4")
+        self.assertEqual(probe_video(piped), probe_video(on_disk))
+
+    def test_errors_from_the_frame_source_are_raised(self):
+        from .video import encode_mp4
+
+        def broken():
+            yield from self.frames(3)
+            raise RuntimeError("frame corrupto")
+
+        with self.assertRaisesMessage(RuntimeError, "frame corrupto"):
+            encode_mp4(broken(), self.size, 12)
+
+
+class PrometheusTests(SimpleTestCase):
+    def test_renders_counters_gauges_and_histograms(self):
+        from .metrics import MetricsRegistry, render_prometheus
+
+        registry = MetricsRegistry()
+        registry.increment("requests_total", 2, view='a"b')
+        registry.maximum("in_flight_max", 3)
+        registry.observe("stage_seconds", 0.2, buckets=(0.1, 0.5), stage="rembg")
+        registry.observe("stage_seconds", 0.05, buckets=(0.1, 0.5), stage="rembg")
+        self.assertEqual(render_prometheus(registry), "\n".join([
+            "# TYPE in_flight_max gauge",
+            "in_flight_max 3",
+            "# TYPE requests_total counter",
+            'requests_total{view="a\\"b"} 2',
+            "# TYPE stage_seconds histogram",
+            'stage_seconds_bucket{le="0.1",stage="rembg"} 1',
+            'stage_seconds_bucket{le="0.5",stage="rembg"} 2',
+            'stage_seconds_bucket{le="+Inf",stage="rembg"} 2',
+            'stage_seconds_sum{stage="rembg"} 0.25',
+            'stage_seconds_count{stage="rembg"} 2',
+        ]) + "\n")
+
+
+class MetricsViewTests(SimpleTestCase):
+    def get(self, remote_addr, **headers):
+        from rest_framework.test import APIRequestFactory
+
+        from .views import MetricsView
+
+        request = APIRequestFactory().get("/metrics", REMOTE_ADDR=remote_addr, **headers)
+        return MetricsView.as_view()(request)
+
+    @override_settings(METRICS_TOKEN=None)
+    def test_without_token_nobody_is_allowed(self):
+        # Ni siquiera direcciones internas: detrás de un proxy lo son todas
+        self.assertEqual(self.get("127.0.0.1").status_code, 403)
+        self.assertEqual(self.get("10.1.2.3").status_code, 403)
+        self.assertEqual(self.get("10.1.2.3", HTTP_AUTHORIZATION="Bearer ").status_code, 403)
+
+    @override_settings(METRICS_TOKEN="secreto")
+    def test_with_token_requires_it_from_any_address(self):
+        self.assertEqual(self.get("127.0.0.1").status_code, 403)
+        self.assertEqual(self.get("8.8.8.8", HTTP_AUTHORIZATION="Bearer otro").status_code, 403)
+        self.assertEqual(self.get("8.8.8.8", HTTP_AUTHORIZATION="Bearer secreto").status_code, 200)
+
+
+class SessionPoolTests(SimpleTestCase):
+    def pool(self, max_size):
+        from .sessions import SessionPool
+
+        created = []
+
+        def factory(model_name):
+            created.append(model_name)
+            return object()
+
+        return SessionPool("u2net", max_size, factory=factory), created
+
+    def test_reuses_sessions_and_never_creates_more_than_max_size(self):
+        pool, created = self.pool(2)
+        with pool.acquire() as first, pool.acquire() as second:
+            self.assertIsNot(first, second)
+        with pool.acquire() as again:
+            self.assertIn(again, (first, second))
+        self.assertEqual((pool.created, len(created)), (2, 2))
+
+    def test_waits_for_a_session_until_the_timeout(self):
+        from .sessions import SessionPoolTimeout
+
+        pool, _ = self.pool(1)
+        with pool.acquire():
+            start = time.monotonic()
+            with self.assertRaises(SessionPoolTimeout):
+                with pool.acquire(timeout=0.05):
+                    pass
+            self.assertGreaterEqual(time.monotonic() - start, 0.05)
+
+    def test_a_released_session_wakes_up_a_waiting_request(self):
+        pool, _ = self.pool(1)
+        got = []
+
+        def wait():
+            with pool.acquire(timeout=5) as session:
+                got.append(session)
+
+        with pool.acquire() as session:
+            waiter = threading.Thread(target=wait)
+            waiter.start()
+            time.sleep(0.05)
+            self.assertEqual(got, [])
+        waiter.join()
+        self.assertEqual(got, [session])
+
+    def test_a_failed_load_frees_its_slot(self):
+        from .sessions import SessionPool
+
+        calls = []
+
+        def factory(model_name):
+            calls.append(model_name)
+            if len(calls) == 1:
+                raise RuntimeError("modelo roto")
+            return object()
+
+        pool = SessionPool("u2net", 1, factory=factory)
+        with self.assertRaises(RuntimeError):
+            with pool.acquire(timeout=0.05):
+                pass
+        with pool.acquire(timeout=0.05) as session:
+            self.assertIsNotNone(session)
+        self.assertEqual(pool.created, 1)
+
+    def test_rejects_empty_pools(self):
+        from .sessions import SessionPool
+
+        with self.assertRaises(ValueError):
+            SessionPool("u2net", 0)
+
+
+@override_settings(
+    REMBG_DEFAULT_MODEL="u2net",
+    REMBG_ALLOWED_MODELS=["u2net", "u2netp", "isnet-general-use"],
+    REMBG_ENDPOINT_MODELS={"remove-background2": "u2netp"},
+)
+class ResolveModelTests(SimpleTestCase):
+    def test_uses_the_endpoint_model_or_the_default(self):
+        from .sessions import resolve_model
+
+        self.assertEqual(resolve_model(None, "remove-background2"), "u2netp")
+        self.assertEqual(resolve_model("", "remove-background"), "u2net")
+        self.assertEqual(resolve_model(), "u2net")
+
+    def test_accepts_allowed_models_and_rejects_the_rest(self):
+        from .sessions import UnknownModel, resolve_model
+
+        self.assertEqual(resolve_model("isnet-general-use", "remove-background2"), "isnet-general-use")
+        with self.assertRaises(UnknownModel):
+            resolve_model("../../etc/passwd", "remove-background")
+
+    def test_the_view_answers_400_for_unknown_models(self):
+        response = self.client.post(
+            "/api/remove-background/?model=sam",
+            {"file": upload("foto.jpg", image_bytes())},
+            HTTP_HOST="localhost",
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("u2netp", response.json()["error"])
+
+
+class ResultCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def test_key_depends_on_bytes_model_and_params(self):
+        from .cache import make_key
+
+        key = make_key(b"foto", "u2net", output="png")
+        self.assertEqual(key, make_key(b"foto", "u2net", output="png"))
+        self.assertNotEqual(key, make_key(b"foto2", "u2net", output="png"))
+        self.assertNotEqual(key, make_key(b"foto", "u2netp", output="png"))
+        self.assertNotEqual(key, make_key(b"foto", "u2net", output="webp"))
+
+    def test_memory_is_bounded_by_bytes_and_evicts_the_least_recently_used(self):
+        from .cache import ResultCache
+
+        cache = ResultCache(max_bytes=10, ttl=60)
+        cache.set("a", b"aaaa")
+        cache.set("b", b"bbbb")
+        self.assertEqual(cache.get("a"), b"aaaa")
+        cache.set("c", b"cccc")
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual((cache.get("a"), cache.get("c")), (b"aaaa", b"cccc"))
+        self.assertLessEqual(cache.memory_bytes, 10)
+
+        cache.set("big", b"x" * 11)
+        self.assertIsNone(cache.get("big"))
+        self.assertEqual(cache.memory_bytes, 8)
+
+    def test_disk_entries_expire_after_the_ttl(self):
+        from .cache import ResultCache
+
+        cache = ResultCache(max_bytes=0, directory=self.directory, ttl=60)
+        cache.set("0123", b"resultado")
+        self.assertEqual(cache.get("0123"), b"resultado")
+
+        path = os.path.join(self.directory, "01", "0123")
+        old = time.time() - 61
+        os.utime(path, (old, old))
+        self.assertIsNone(cache.get("0123"))
+        self.assertFalse(os.path.exists(path))
+
+    def test_disk_hits_are_copied_to_memory(self):
+        from .cache import ResultCache
+
+        ResultCache(max_bytes=0, directory=self.directory, ttl=60).set("abcd", b"resultado")
+        cache = ResultCache(max_bytes=100, directory=self.directory, ttl=60)
+        self.assertEqual(cache.memory_bytes, 0)
+        self.assertEqual(cache.get("abcd"), b"resultado")
+        self.assertEqual(cache.memory_bytes, len(b"resultado"))
+
+    def test_purge_removes_only_expired_files(self):
+        from .cache import DiskCache
+
+        disk = DiskCache(self.directory, ttl=60)
+        disk.set("aa11", b"nuevo")
+        disk.set("bb22", b"viejo")
+        old = time.time() - 61
+        os.utime(os.path.join(self.directory, "bb", "bb22"), (old, old))
+        self.assertEqual(disk.purge(), 1)
+        self.assertEqual((disk.get("aa11"), disk.get("bb22")), (b"nuevo", None))
+
+
+class SingleFlightTests(SimpleTestCase):
+    def run_concurrently(self, flight, func, callers=4):
+        """
+        Llama a `flight.do` desde `callers` hilos mientras `func` está en
+        curso; devuelve lo que obtuvo cada uno (resultado o excepción).
+        """
+        outcomes = []
+        started = threading.Barrier(callers)
+
+        def call():
+            started.wait()
+            try:
+                outcomes.append(flight.do("clave", func))
+            except Exception as e:
+                outcomes.append(e)
+
+        threads = [threading.Thread(target=call) for _ in range(callers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return outcomes
+
+    def slow(self, calls, result=None, error=None):
+        def func():
+            calls.append(1)
+            time.sleep(0.2)
+            if error is not None:
+                raise error
+            return result if result is not None else object()
+
+        return func
+
+    def test_concurrent_callers_share_one_result(self):
+        from .singleflight import SingleFlight
+
+        calls = []
+        outcomes = self.run_concurrently(SingleFlight(), self.slow(calls))
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len(outcomes), 4)
+        self.assertTrue(all(outcome is outcomes[0] for outcome in outcomes))
+
+    def test_concurrent_callers_share_one_exception(self):
+        from .singleflight import SingleFlight
+
+        calls = []
+        error = RuntimeError("Gemini no responde")
+        outcomes = self.run_concurrently(SingleFlight(), self.slow(calls, error=error))
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(outcomes, [error] * 4)
+
+    def test_later_calls_run_again(self):
+        from .singleflight import SingleFlight
+
+        flight, calls = SingleFlight(), []
+        flight.do("clave", self.slow(calls, result="a"))
+        flight.do("clave", self.slow(calls, result="b"))
+        self.assertEqual(len(calls), 2)
+
+    def test_processes_share_results_through_the_lock_dir(self):
+        from .singleflight import SingleFlight
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        calls = []
+        first = SingleFlight(lock_dir=directory, result_ttl=60)
+        second = SingleFlight(lock_dir=directory, result_ttl=60)
+        self.assertEqual(first.do("clave", self.slow(calls, result={"url": "/a"})), {"url": "/a"})
+        self.assertEqual(second.do("clave", self.slow(calls, result={"url": "/b"})), {"url": "/a"})
+        self.assertEqual(len(calls), 1)
+
+
+class AssetCacheTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, "fondo.png")
+
+    def write(self, color, mtime):
+        Image.new("RGB", (40, 20), color).save(self.path)
+        os.utime(self.path, (mtime, mtime))
+
+    def test_reuses_decoded_images_and_variants(self):
+        from .assets import AssetCache
+
+        self.write((255, 0, 0), 1_000_000)
+        cache = AssetCache(max_bytes=1024 * 1024)
+        self.assertIs(cache.original(self.path)[0], cache.original(self.path)[0])
+        resized = cache.resized(self.path, (20, 10))
+        self.assertEqual(resized.size, (20, 10))
+        self.assertIs(cache.resized(self.path, (20, 10)), resized)
+        self.assertEqual(cache.thumbnail(self.path, 10).size, (10, 5))
+
+    def test_reloads_the_file_when_its_mtime_changes(self):
+        from .assets import AssetCache
+
+        self.write((255, 0, 0), 1_000_000)
+        cache = AssetCache(max_bytes=1024 * 1024)
+        self.assertEqual(cache.resized(self.path, (20, 10)).getpixel((0, 0)), (255, 0, 0, 255))
+
+        self.write((0, 0, 255), 1_000_100)
+        self.assertEqual(cache.original(self.path)[0].getpixel((0, 0)), (0, 0, 255, 255))
+        self.assertEqual(cache.resized(self.path, (20, 10)).getpixel((0, 0)), (0, 0, 255, 255))
+
+
+class ParseRangeTests(SimpleTestCase):
+    def test_single_ranges(self):
+        from .responses import parse_range
+
+        self.assertEqual(parse_range("bytes=0-99", 1000), (0, 99))
+        self.assertEqual(parse_range("bytes=500-", 1000), (500, 999))
+        self.assertEqual(parse_range("bytes=900-5000", 1000), (900, 999))
+        self.assertEqual(parse_range("bytes=-100", 1000), (900, 999))
+        self.assertEqual(parse_range("bytes=-5000", 1000), (0, 999))
+
+    def test_unusable_headers_serve_the_whole_file(self):
+        from .responses import parse_range
+
+        for header in (None, "", "bytes=-", "items=0-10", "bytes=0-1,5-9"):
+            with self.subTest(header=header):
+                self.assertIsNone(parse_range(header, 1000))
+
+    def test_unsatisfiable_ranges(self):
+        from .responses import parse_range
+
+        for header in ("bytes=1000-", "bytes=1000-2000", "bytes=10-5", "bytes=-0"):
+            with self.subTest(header=header), self.assertRaises(ValueError):
+                parse_range(header, 1000)
+
+
+class ResponseModeTests(SimpleTestCase):
+    def test_defaults_to_data_urls_and_clients_opt_in(self):
+        from rest_framework.test import APIRequestFactory
+
+        from .responses import response_mode
+
+        factory = APIRequestFactory()
+        self.assertEqual(response_mode(factory.get("/")), "dataurl")
+        self.assertEqual(response_mode(factory.get("/?response=urls")), "urls")
+        with self.assertRaises(ValueError):
+            response_mode(factory.get("/?response=xml"))
+
+
+class ArtifactViewTestCase(SimpleTestCase):
+    """
+    Un fichero de 1 KB en un ArtifactStore temporal.
+    """
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        settings_override = override_settings(ARTIFACT_DIR=directory, ARTIFACT_SENDFILE=None)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        from .artifacts import artifact_store
+
+        self.data = bytes(range(256)) * 4
+        self.url = artifact_store.put(self.data, "video/mp4")["url"]
+
+    def get(self, **headers):
+        return self.client.get(self.url, HTTP_HOST="localhost", **headers)
+
+
+class ArtifactRangeTests(ArtifactViewTestCase):
+    def test_serves_the_whole_file_or_the_requested_range(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b"".join(response.streaming_content), self.data)
+        self.assertEqual(response["Accept-Ranges"], "bytes")
+
+        response = self.get(HTTP_RANGE="bytes=100-199")
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b"".join(response.streaming_content), self.data[100:200])
+        self.assertEqual(response["Content-Range"], "bytes 100-199/1024")
+        self.assertEqual(response["Content-Length"], "100")
+
+    def test_unsatisfiable_ranges_answer_416(self):
+        response = self.get(HTTP_RANGE="bytes=5000-")
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response["Content-Range"], "bytes */1024")
+
+
+class ArtifactSendfileTests(ArtifactViewTestCase):
+    def test_nginx_serves_the_file(self):
+        with override_settings(ARTIFACT_SENDFILE="x-accel-redirect", ARTIFACT_ACCEL_PREFIX="/_artifacts/"):
+            response = self.get(HTTP_RANGE="bytes=5000-")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, b"")
+        self.assertEqual(response["X-Accel-Redirect"], "/_artifacts/" + self.url.rstrip("/").rsplit("/", 1)[1])
+
+    def test_apache_gets_the_absolute_path(self):
+        from .artifacts import artifact_store
+
+        with override_settings(ARTIFACT_SENDFILE="x-sendfile"):
+            response = self.get()
+        artifact_id = self.url.rstrip("/").rsplit("/", 1)[1]
+        self.assertEqual(response["X-Sendfile"], os.path.abspath(artifact_store.path(artifact_id)))
+
+
+def moviepy_wipe(original, final):
+    """
+    La transición como se montaba antes con moviepy (CompositeVideoClip).
+    """
+    from moviepy.video.compositing.CompositeVideoClip import CompositeVideoClip
+    from moviepy.video.VideoClip import ImageClip
+
+    duration = 5
+    original_clip = ImageClip(original).with_duration(duration)
+    final_clip = ImageClip(final).with_duration(8)
+    video_size = original_clip.size
+
+    def vertical_wipe(t):
+        if t < duration:
+            y = -video_size[1] + (video_size[1] * t / duration)
+        else:
+            y = 0
+        return (0, y)
+
+    return CompositeVideoClip([original_clip, final_clip.with_position(vertical_wipe)])
+
+
+class VerticalWipeTests(SimpleTestCase):
+    def images(self, original_size, final_size):
+        rng = np.random.default_rng(7)
+        original = rng.integers(0, 256, (original_size[1], original_size[0], 3), dtype=np.uint8)
+        final = rng.integers(0, 256, (final_size[1], final_size[0], 3), dtype=np.uint8)
+        return original, final
+
+    def test_frames_match_the_moviepy_composition(self):
+        from .transitions import VerticalWipe
+
+        for final_size in ((40, 30), (56, 20), (24, 44)):
+            with self.subTest(final_size=final_size):
+                original, final = self.images((40, 30), final_size)
+                wipe = VerticalWipe(original, final)
+                video = moviepy_wipe(original, final)
+                self.assertEqual(len(wipe), round(video.duration * wipe.fps))
+                for index, frame in enumerate(wipe):
+                    expected = video.get_frame(index / wipe.fps)
+                    np.testing.assert_array_equal(frame, expected, err_msg=f"frame {index}")
+
+    def test_static_tail_counts_the_frames_equal_to_the_last(self):
+        from .transitions import VerticalWipe
+
+        original, final = self.images((40, 30), (40, 30))
+        wipe = VerticalWipe(original, final)
+        frames = [frame.copy() for frame in wipe]
+        first_static = len(frames) - wipe.static_tail - 1
+        self.assertEqual(first_static, 5 * 24)
+        for frame in frames[first_static:]:
+            np.testing.assert_array_equal(frame, frames[-1])
+
+    @override_settings(VIDEO_SKIP_STATIC_TAIL=True, VIDEO_ENCODE_MODE="pipe")
+    def test_skipping_the_static_tail_keeps_the_video_duration(self):
+        from .transitions import render_transition
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        original, final = self.images((64, 48), (64, 48))
+        path = os.path.join(directory, "wipe.mp4")
+        render_transition(original, final, path=path)
+        self.assertEqual(probe_video(path), (0.0, 8 * 24))
+        with open(os.path.join(directory, "wipe-pipe.mp4"), "wb") as f:
+            f.write(render_transition(original, final))
+        self.assertEqual(probe_video(f.name)[1], 8 * 24)
+
+
+@override_settings(UPLOAD_MAX_BYTES=50_000, UPLOAD_MAX_PIXELS=1_000_000, UPLOAD_MAX_DIMENSION=500)
+class UploadLimitTests(SimpleTestCase):
+    def read(self, data, name="foto.jpg"):
+        from .ingest import read_upload
+
+        return read_upload(upload(name, data))
+
+    def assertRejected(self, data, status_code):
+        from .ingest import UploadError
+
+        with self.assertRaises(UploadError) as raised:
+            self.read(data)
+        self.assertEqual(raised.exception.status_code, status_code)
+
+    def test_small_images_pass_through_unchanged(self):
+        data = image_bytes((300, 200))
+        self.assertEqual(self.read(data), data)
+
+    def test_rejects_files_over_the_size_limit(self):
+        self.assertRejected(image_bytes((300, 200)) + b"\0" * 50_000, 413)
+
+    def test_rejects_images_over_the_pixel_limit_without_decoding_them(self):
+        # 2000x1000 en PNG de un color: pocos bytes y demasiados píxeles
+        self.assertRejected(image_bytes((2000, 1000), "PNG"), 413)
+
+    def test_rejects_images_over_the_maximum_dimension(self):
+        self.assertRejected(image_bytes((900, 600)), 413)
+
+    @override_settings(UPLOAD_DOWNSCALE=True)
+    def test_downscales_images_over_the_maximum_dimension_when_enabled(self):
+        for fmt, expected in (("JPEG", "JPEG"), ("PNG", "PNG"), ("GIF", "PNG")):
+            with self.subTest(fmt=fmt):
+                data = self.read(image_bytes((900, 600), fmt))
+                with Image.open(BytesIO(data)) as img:
+                    self.assertEqual((img.size, img.format), ((500, 333), expected))
+
+    def test_rejects_files_that_are_not_images(self):
+        self.assertRejected(b"no es una imagen", 400)
+
+    def test_request_size_is_checked_before_reading_the_body(self):
+        from django.test import RequestFactory
+
+        from .ingest import UploadError, check_request_size
+
+        request = RequestFactory().post("/")
+        request.META["CONTENT_LENGTH"] = "50000"
+        check_request_size(request)
+        request.META["CONTENT_LENGTH"] = str(50_000 + 64 * 1024 + 1)
+        with self.assertRaises(UploadError) as raised:
+            check_request_size(request)
+        self.assertEqual(raised.exception.status_code, 413)
+        check_request_size(request, max_files=2)
+
+    def test_the_view_answers_413_for_large_uploads(self):
+        response = self.client.post(
+            "/api/remove-background/",
+            {"file": upload("foto.jpg", image_bytes((300, 200)) + b"\0" * 50_000)},
+            HTTP_HOST="localhost",
+        )
+        self.assertEqual(response.status_code, 413)
+
+
+class EncodeOutputTests(SimpleTestCase):
+    def setUp(self):
+        self.img = Image.new("RGB", (32, 16), (200, 80, 40))
+        self.mask = Image.new("L", (32, 16), 0)
+        self.mask.paste(255, (0, 0, 16, 16))
+
+    def decode(self, data):
+        img = Image.open(BytesIO(data))
+        img.load()
+        return img
+
+    def test_each_format(self):
+        from .outputs import OUTPUT_FORMATS, content_type, encode_output, extension
+
+        expected_formats = {"png": "PNG", "mask": "PNG", "webp": "WEBP", "webp-lossy": "WEBP", "png8": "PNG"}
+        self.assertEqual(set(expected_formats), set(OUTPUT_FORMATS))
+        for output, fmt in expected_formats.items():
+            with self.subTest(output=output):
+                img = self.decode(encode_output(self.img, self.mask, output))
+                self.assertEqual((img.format, img.size), (fmt, (32, 16)))
+                self.assertEqual(content_type(output), f"image/{fmt.lower()}")
+                self.assertEqual(extension(output), f".{fmt.lower()}")
+                if output == "mask":
+                    self.assertEqual(img.mode, "L")
+                    self.assertEqual((img.getpixel((0, 0)), img.getpixel((31, 0))), (255, 0))
+                    continue
+                rgba = img.convert("RGBA")
+                self.assertEqual(rgba.getpixel((31, 0))[3], 0)
+                self.assertEqual(rgba.getpixel((0, 0))[3], 255)
+                if output != "webp-lossy":
+                    self.assertEqual(rgba.getpixel((0, 0)), (200, 80, 40, 255))
+
+    def test_png8_uses_a_palette(self):
+        from .outputs import encode_output
+
+        self.assertEqual(self.decode(encode_output(self.img, self.mask, "png8")).mode, "P")
+
+    def test_output_params_change_the_cache_key_only_when_needed(self):
+        from .outputs import output_params
+
+        self.assertEqual(output_params("png"), {})
+        self.assertEqual(output_params("mask"), {"output": "mask"})
+        with override_settings(OUTPUT_WEBP_QUALITY=60):
+            self.assertEqual(output_params("webp-lossy"), {"output": "webp-lossy", "quality": 60})
+
+    def test_the_view_rejects_unknown_formats(self):
+        response = self.client.post(
+            "/api/remove-background/?output=gif",
+            {"file": upload("foto.jpg", image_bytes())},
+            HTTP_HOST="localhost",
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+class EnabledEndpointsTests(SimpleTestCase):
+    @override_settings(API_ENABLED_ENDPOINTS=[])
+    def test_all_endpoints_by_default(self):
+        from .endpoints import ENDPOINTS, enabled_endpoints, rembg_enabled, video_enabled
+
+        self.assertEqual(enabled_endpoints(), list(ENDPOINTS))
+        self.assertTrue(rembg_enabled() and video_enabled())
+
+    @override_settings(API_ENABLED_ENDPOINTS=["jobs", "jurassic-explorer"])
+    def test_only_the_configured_endpoints(self):
+        from .endpoints import enabled_endpoints, is_enabled, rembg_enabled, video_enabled
+
+        self.assertEqual(enabled_endpoints(), ["jurassic-explorer", "jobs"])
+        self.assertFalse(is_enabled("remove-background"))
+        self.assertFalse(rembg_enabled())
+        self.assertTrue(video_enabled())
+
+    @override_settings(API_ENABLED_ENDPOINTS=["remove-background", "remove-backgrund2"])
+    def test_rejects_unknown_names(self):
+        from django.core.exceptions import ImproperlyConfigured
+
+        from .endpoints import enabled_endpoints
+
+        with self.assertRaisesMessage(ImproperlyConfigured, "remove-backgrund2"):
+            enabled_endpoints()
+
+
+class PipelineImageTests(SimpleTestCase):
+    def test_png_bytes_are_reused_without_encoding(self):
+        from .pipeline import PipelineImage
+
+        data = image_bytes(fmt="PNG")
+        image = PipelineImage(data)
+        self.assertIs(image.png(), data)
+        self.assertEqual(image.size, (64, 48))
+
+    def test_decodes_once_and_applies_the_exif_orientation(self):
+        from .pipeline import PipelineImage
+
+        buffer = BytesIO()
+        exif = Image.Exif()
+        exif[0x0112] = 6  # girada 90°
+        Image.new("RGB", (64, 48), (10, 20, 30)).save(buffer, "JPEG", exif=exif)
+        image = PipelineImage(buffer.getvalue())
+        self.assertIs(image.image, image.image)
+        self.assertEqual(image.size, (48, 64))
+        self.assertEqual(image.rgb().shape, (64, 48, 3))
+        self.assertEqual(Image.open(BytesIO(image.png())).size, (48, 64))
+
+    def test_needs_bytes_or_an_image(self):
+        from .pipeline import PipelineImage
+
+        with self.assertRaises(ValueError):
+            PipelineImage()
+
+
+class WarmupTests(SimpleTestCase):
+    def setUp(self):
+        from . import warmup
+
+        patcher = mock.patch.object(warmup, "state", warmup.WarmupState())
+        self.state = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_marks_ready_only_when_every_step_succeeds(self):
+        from .warmup import _run
+
+        steps = []
+        _run([lambda: steps.append("a"), lambda: steps.append("b")], time.perf_counter())
+        self.assertEqual(steps, ["a", "b"])
+        self.assertTrue(self.state.wait(0))
+        self.assertEqual(self.state.as_dict()["status"], "ready")
+
+    def test_a_failed_step_finishes_without_marking_ready(self):
+        from .warmup import _run
+
+        def fail():
+            raise RuntimeError("modelo corrupto")
+
+        with self.assertLogs("api.warmup", "ERROR"):
+            _run([fail], time.perf_counter())
+        # wait() no se queda colgado, pero el proceso no está listo
+        self.assertFalse(self.state.wait(0))
+        self.assertEqual(self.state.as_dict()["status"], "failed")
+        self.assertEqual(self.state.error, "modelo corrupto")
+
+    def test_failed_imports_skip_the_model_thread(self):
+        from . import warmup
+
+        with override_settings(API_WARMUP=True, API_WARMUP_BLOCKING=False), \
+                mock.patch.object(warmup, "_warm_imports", side_effect=ImportError("moviepy")), \
+                mock.patch.object(warmup, "_warm_models") as warm_models, \
+                self.assertLogs("api.warmup", "ERROR"):
+            warmup.start_warmup()
+            self.assertFalse(self.state.wait(1))
+        warm_models.assert_not_called()
+        self.assertEqual(self.state.error, "moviepy")
+
+    def test_health_answers_503_until_ready_and_after_a_failure(self):
+        self.assertEqual(self.client.get("/api/health/", HTTP_HOST="localhost").status_code, 503)
+
+        self.state.mark_ready()
+        response = self.client.get("/api/health/", HTTP_HOST="localhost")
+        self.assertEqual((response.status_code, response.json()["status"]), (200, "ready"))
+
+        self.state.error = "modelo corrupto"
+        response = self.client.get("/api/health/", HTTP_HOST="localhost")
+        self.assertEqual((response.status_code, response.json()["status"]), (503, "failed"))
+
+
+class GeneratedCacheTests(SimpleTestCase):
+    def setUp(self):
+        from .generated import GeneratedCache
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.directory = directory
+        self.cache = GeneratedCache(os.path.join(directory, "generated.sqlite3"), max_bytes=1000)
+
+    def source(self, data):
+        path = os.path.join(self.directory, "video.mp4")
+        with open(path, "wb") as f:
+            f.write(data)
+        return path
+
+    def test_files_are_copied_out_of_the_table(self):
+        self.cache.set_file("k", "video", self.source(b"x" * 600), model="m")
+        path = self.cache.get_file("k", "video")
+        with open(path, "rb") as f:
+            self.assertEqual(f.read(), b"x" * 600)
+        self.assertEqual(os.path.dirname(path), self.cache.files_directory)
+        self.assertEqual(self.cache.stats(), {"video": (1, 600)})
+        # El contenido no está en la tabla ni se confunde con un `get`
+        self.assertIsNone(self.cache.get("k", "video"))
+        self.assertIsNone(self.cache.get_file("otra", "video"))
+
+    def test_eviction_and_purge_delete_the_files(self):
+        self.cache.set_file("old", "video", self.source(b"x" * 600))
+        old = self.cache.get_file("old", "video")
+        self.cache.set_file("new", "video", self.source(b"y" * 600))
+        self.assertIsNone(self.cache.get_file("old", "video"))
+        self.assertFalse(os.path.exists(old))
+
+        new = self.cache.get_file("new", "video")
+        self.assertEqual(self.cache.purge(), 1)
+        self.assertFalse(os.path.exists(new))
+
+    def test_skips_files_over_the_limit(self):
+        self.cache.set_file("k", "video", self.source(b"x" * 1001))
+        self.assertIsNone(self.cache.get_file("k", "video"))
+        self.assertFalse(os.path.exists(self.cache.files_directory))
+
+    def test_adds_the_file_column_to_an_existing_table(self):
+        from .generated import GeneratedCache
+
+        path = os.path.join(self.directory, "old.sqlite3")
+        conn = sqlite3.connect(path)
+        conn.execute(
+            "CREATE TABLE generated (key TEXT NOT NULL, kind TEXT NOT NULL, model TEXT, "
+            "prompt_version TEXT, data BLOB NOT NULL, size INTEGER NOT NULL, created_at REAL NOT NULL, "
+            "accessed_at REAL NOT NULL, PRIMARY KEY (key, kind))"
+        )
+        conn.execute("INSERT INTO generated VALUES ('k', 'video', NULL, NULL, x'00', 1, 0, 0)")
+        conn.commit()
+        conn.close()
+
+        cache = GeneratedCache(path)
+        # Un video guardado en la tabla por una versión anterior cuenta como fallo
+        self.assertIsNone(cache.get_file("k", "video"))
+        cache.set_file("k", "video", self.source(b"video"))
+        self.assertIsNotNone(cache.get_file("k", "video"))
+
+
+class FastMaskTests(SimpleTestCase):
+    def setUp(self):
+        from PIL import ImageDraw
+
+        # Elipse oscura sobre fondo claro y su máscara exacta a tamaño completo
+        box = (300, 200, 900, 700)
+        self.full = Image.new("RGB", (1200, 900), (230, 230, 220))
+        ImageDraw.Draw(self.full).ellipse(box, fill=(40, 60, 150))
+        self.truth = Image.new("L", self.full.size, 0)
+        ImageDraw.Draw(self.truth).ellipse(box, fill=255)
+
+    def error(self, mask):
+        return np.abs(np.asarray(mask, dtype=np.float32) - np.asarray(self.truth, dtype=np.float32))
+
+    def test_working_image_reduces_by_whole_factors(self):
+        from .masks import working_image
+
+        small = working_image(self.full, 256)
+        self.assertEqual(small.size, (300, 225))
+        self.assertGreaterEqual(max(small.size), 256)
+        # Ya es pequeña: se devuelve la misma imagen, sin copiarla
+        self.assertIs(working_image(small, 256), small)
+        self.assertEqual(working_image(self.full.convert("P"), 256).mode, "RGB")
+
+    def test_upsampled_alpha_is_full_resolution_and_close_to_the_full_mask(self):
+        from .masks import upsample_mask, working_image
+
+        small = working_image(self.full, 256)
+        mask = self.truth.reduce(4)
+        self.assertIs(upsample_mask(self.truth, self.full, self.full), self.truth)
+        for refine, max_mean_error in ((False, 2), (True, 1)):
+            with self.subTest(refine=refine), override_settings(REMBG_MASK_REFINE=refine):
+                alpha = upsample_mask(mask, small, self.full)
+                self.assertEqual((alpha.mode, alpha.size), ("L", self.full.size))
+                error = self.error(alpha)
+                self.assertLess(error.mean(), max_mean_error)
+                self.assertLess((error > 32).mean(), 0.01)
+
+    def test_refine_follows_the_image_edges(self):
+        from .masks import refine_upsample, working_image
+
+        small = working_image(self.full, 256)
+        mask = self.truth.reduce(4)
+        refined = self.error(refine_upsample(mask, small, self.full, radius=4, eps=1e-3))
+        bilinear = self.error(mask.resize(self.full.size, Image.Resampling.BILINEAR))
+        self.assertLess(refined.max(), 32)
+        self.assertLess(refined.mean(), bilinear.mean())
+
+    @override_settings(REMBG_FAST_MASK_SIZE=320, REMBG_MASK_REFINE=False)
+    def test_fast_mask_matches_the_full_resolution_model_mask(self):
+        from .batch import image_masks
+
+        with override_settings(REMBG_FAST_MASK=False):
+            full_mask = image_masks([self.full], "u2netp")[0]
+        with override_settings(REMBG_FAST_MASK=True):
+            fast_mask = image_masks([self.full], "u2netp")[0]
+        self.assertEqual(fast_mask.size, self.full.size)
+        error = np.abs(np.asarray(fast_mask, dtype=np.float32) - np.asarray(full_mask, dtype=np.float32))
+        self.assertLess(error.mean(), 8)
+        self.assertLess((error > 32).mean(), 0.01)
+
+
+class RuntimeTests(SimpleTestCase):
+    @override_settings(
+        ONNX_INTRA_OP_THREADS=3, ONNX_INTER_OP_THREADS=2, ONNX_GRAPH_OPTIMIZATION="basic",
+        ONNX_CPU_MEM_ARENA=False, ONNX_MEM_PATTERN=False, ONNX_ALLOW_SPINNING=False,
+    )
+    def test_session_options_come_from_settings(self):
+        import onnxruntime as ort
+
+        from .runtime import session_options
+
+        opts = session_options()
+        self.assertEqual((opts.intra_op_num_threads, opts.inter_op_num_threads), (3, 2))
+        self.assertEqual(opts.graph_optimization_level, ort.GraphOptimizationLevel.ORT_ENABLE_BASIC)
+        self.assertFalse(opts.enable_cpu_mem_arena)
+        self.assertFalse(opts.enable_mem_pattern)
+        self.assertEqual(opts.get_session_config_entry("session.intra_op.allow_spinning"), "0")
+        self.assertEqual(opts.get_session_config_entry("session.inter_op.allow_spinning"), "0")
+
+        with override_settings(ONNX_GRAPH_OPTIMIZATION="max"), self.assertRaises(ValueError):
+            session_options()
+
+    @override_settings(ONNX_INTRA_OP_THREADS=2)
+    def test_pin_worker_takes_the_first_free_group_once(self):
+        import fcntl
+
+        from . import runtime
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.addCleanup(setattr, runtime, "_affinity_applied", runtime._affinity_applied)
+        self.addCleanup(setattr, runtime, "_affinity_file", runtime._affinity_file)
+        runtime._affinity_applied = False
+
+        # Otro worker tiene reservado el primer grupo
+        held = open(os.path.join(directory, "bg-remover-cpu-0.lock"), "a")
+        self.addCleanup(held.close)
+        fcntl.flock(held, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+        with mock.patch("tempfile.gettempdir", return_value=directory), \
+                mock.patch("os.sched_getaffinity", return_value={0, 1, 2, 3, 4}), \
+                mock.patch("os.sched_setaffinity") as setaffinity:
+            self.assertEqual(runtime.pin_worker(), [2, 3])
+            self.addCleanup(runtime._affinity_file.close)
+            # Ya está fijado: no vuelve a reservar otro grupo
+            self.assertIsNone(runtime.pin_worker())
+        setaffinity.assert_called_once_with(0, [2, 3])
+
+    def test_optimized_model_is_saved_once_and_reused(self):
+        from .metrics import metrics
+        from .runtime import _new_cached_session, _optimized_path, session_options
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        img = Image.open(BytesIO(subject_bytes())).convert("RGB")
+        with override_settings(ONNX_OPTIMIZED_MODEL_DIR=directory):
+            saved = metrics.get("onnx_optimized_models_saved_total", model="u2netp")
+            loaded = metrics.get("onnx_optimized_model_loads_total", model="u2netp")
+
+            first = _new_cached_session("u2netp", session_options())
+            path = _optimized_path("u2netp")
+            self.assertTrue(os.path.exists(path))
+            self.assertEqual(os.listdir(directory), [os.path.basename(path)])
+            mtime = os.path.getmtime(path)
+
+            second = _new_cached_session("u2netp", session_options())
+            self.assertEqual(second.download_models(), path)
+            self.assertEqual(os.path.getmtime(path), mtime)
+            self.assertEqual(metrics.get("onnx_optimized_models_saved_total", model="u2netp"), saved + 1)
+            self.assertEqual(metrics.get("onnx_optimized_model_loads_total", model="u2netp"), loaded + 1)
+
+        # Misma máscara con el modelo original y con el optimizado
+        np.testing.assert_array_equal(np.asarray(first.predict(img)[0]), np.asarray(second.predict(img)[0]))
+
+
+def async_urlconf():
+    """
+    URLconf de las vistas asíncronas (las que api.urls usa con
+    API_ASYNC_VIEWS), sin recargar api.urls.
+    """
+    from django.urls import path
+
+    from .async_views import AsyncRemoveBackgroundView
+
+    return type("AsyncUrls", (), {"urlpatterns": [
+        path("api/remove-background/", AsyncRemoveBackgroundView.as_view(), name="remove-background"),
+    ]})
+
+
+@override_settings(PROCESS_POOL_SIZE=0, REMBG_FAST_MASK=False)
+class AsyncViewTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.enterClassContext(override_settings(ROOT_URLCONF=async_urlconf()))
+
+    def setUp(self):
+        from .cache import ResultCache
+
+        # Sin caché, para que la vista síncrona vuelva a ejecutar el modelo
+        patcher = mock.patch("api.views.result_cache", ResultCache(max_bytes=0))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def test_async_view_answers_like_the_sync_view(self):
+        from .views import RemoveBackgroundView
+
+        data = subject_bytes()
+        response = await self.async_client.post(
+            "/api/remove-background/?model=u2netp&output=png",
+            {"file": upload("foto.png", data)},
+            HTTP_HOST="localhost",
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "image/png")
+        self.assertEqual(response["Content-Disposition"], 'attachment; filename="no-bg.png"')
+        expected = RemoveBackgroundView().process_image(data, "u2netp", "png")
+        self.assertEqual(response.content, expected)
+
+    async def test_async_view_errors(self):
+        from .procpool import PoolSaturated
+
+        response = await self.async_client.post("/api/remove-background/", {}, HTTP_HOST="localhost")
+        self.assertEqual(response.status_code, 400)
+
+        response = await self.async_client.post(
+            "/api/remove-background/?model=otro", {"file": upload("foto.png", subject_bytes())},
+            HTTP_HOST="localhost",
+        )
+        self.assertEqual(response.status_code, 400)
+
+        with mock.patch("api.views.RemoveBackgroundView.process_image", side_effect=PoolSaturated("lleno")):
+            response = await self.async_client.post(
+                "/api/remove-background/", {"file": upload("foto.png", subject_bytes())},
+                HTTP_HOST="localhost",
+            )
+        self.assertEqual(response.status_code, 429)
+        self.assertIn("Retry-After", response)
+
+
+class AioTests(SimpleTestCase):
+    def test_stage_semaphore_limits_concurrency(self):
+        import asyncio
+
+        from django.conf import settings
+
+        from .aio import stage
+
+        active, peak = 0, 0
+
+        async def request():
+            nonlocal active, peak
+            async with stage("rembg"):
+                active += 1
+                peak = max(peak, active)
+                await asyncio.sleep(0.01)
+                active -= 1
+
+        async def main():
+            await asyncio.gather(*(request() for _ in range(8)))
+
+        for limit in (1, 3):
+            with self.subTest(limit=limit), \
+                    override_settings(ASYNC_STAGE_LIMITS={**settings.ASYNC_STAGE_LIMITS, "rembg": limit}):
+                peak = 0
+                # Cada asyncio.run es un event loop nuevo, con sus semáforos
+                asyncio.run(main())
+                self.assertEqual(peak, limit)
+
+    def test_run_stage_runs_in_the_pool_with_the_request_context(self):
+        import asyncio
+        import contextvars
+
+        from .aio import run_stage
+
+        var = contextvars.ContextVar("var")
+
+        async def main():
+            var.set("petición")
+            return await run_stage("decode", lambda x: (var.get(), x, threading.current_thread().name), 1)
+
+        value, arg, thread = asyncio.run(main())
+        self.assertEqual((value, arg), ("petición", 1))
+        self.assertTrue(thread.startswith("api-cpu"))
+
+    def test_single_flight_shares_one_result(self):
+        import asyncio
+
+        from .aio import AsyncSingleFlight
+
+        flight = AsyncSingleFlight()
+        calls = []
+
+        async def compute():
+            calls.append(1)
+            await asyncio.sleep(0.02)
+            return object()
+
+        async def main():
+            results = await asyncio.gather(*(flight.do("k", compute) for _ in range(5)))
+            # Terminada la primera, la siguiente vuelve a ejecutarse
+            again = await flight.do("k", compute)
+            return results, again
+
+        results, again = asyncio.run(main())
+        self.assertEqual(len(calls), 2)
+        self.assertTrue(all(result is results[0] for result in results))
+        self.assertIsNot(again, results[0])
+
+    def test_single_flight_shares_the_error(self):
+        import asyncio
+
+        from .aio import AsyncSingleFlight
+
+        flight = AsyncSingleFlight()
+        calls = []
+
+        async def compute():
+            calls.append(1)
+            await asyncio.sleep(0.02)
+            raise ValueError("fallo")
+
+        async def main():
+            return await asyncio.gather(*(flight.do("k", compute) for _ in range(3)), return_exceptions=True)
+
+        errors = asyncio.run(main())
+        self.assertEqual(len(calls), 1)
+        self.assertTrue(all(isinstance(error, ValueError) for error in errors))
+
+
+@override_settings(GEMINI_RETRY_ATTEMPTS=3, GEMINI_RETRY_INITIAL_DELAY=0.01, GEMINI_RETRY_MAX_DELAY=0.01)
+class GeminiStubTests(SimpleTestCase):
+    model = "gemini-2.5-flash-image-preview"
+
+    def setUp(self):
+        from .management.commands.gemini_stub import start_stub
+
+        self.stub = start_stub()
+        self.addCleanup(self.stub.server_close)
+        self.addCleanup(self.stub.shutdown)
+        stub_settings = override_settings(GEMINI_BASE_URL=self.stub.url)
+        stub_settings.enable()
+        self.addCleanup(stub_settings.disable)
+        # Cliente nuevo apuntando al stub
+        for patcher in (mock.patch.dict(os.environ, {"GOOGLE_API_KEY": "stub"}), mock.patch("api.gemini._client", None)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def generate(self):
+        from .gemini import generate_image
+
+        with redirect_stdout(StringIO()):
+            return generate_image(subject_bytes(), "prompt", self.model)
+
+    def test_reuses_one_connection_for_several_requests(self):
+        for _ in range(3):
+            with Image.open(BytesIO(self.generate())) as img:
+                self.assertEqual((img.format, img.size), ("PNG", (96, 64)))
+        self.assertEqual(self.stub.stats["requests"], 3)
+        self.assertEqual(self.stub.stats["connections"], 1)
+
+    def test_sends_small_images_inline_and_uploads_large_ones(self):
+        self.assertIsNotNone(self.generate())
+        self.assertEqual((self.stub.stats["inline"], self.stub.stats["uploads"]), (1, 0))
+
+        with override_settings(GEMINI_INLINE_MAX_BYTES=100):
+            result = self.generate()
+        # El stub colorea la imagen que recibe: también la subida llegó entera
+        with Image.open(BytesIO(result)) as img:
+            self.assertEqual(img.size, (96, 64))
+        self.assertEqual((self.stub.stats["inline"], self.stub.stats["uploads"]), (1, 1))
+
+    def test_retries_transient_errors(self):
+        from google.genai import errors
+
+        from .metrics import metrics
+
+        retries = metrics.get("gemini_retries_total")
+        self.stub.fail_rate = 0.5
+        # La primera respuesta es un 503 y la segunda la imagen
+        with mock.patch("random.random", side_effect=[0.0, 1.0]):
+            self.assertIsNotNone(self.generate())
+        self.assertEqual((self.stub.stats["requests"], self.stub.stats["failures"]), (2, 1))
+        self.assertEqual(metrics.get("gemini_retries_total"), retries + 1)
+
+        # Si el error persiste, tras GEMINI_RETRY_ATTEMPTS intentos se propaga
+        self.stub.fail_rate = 1.0
+        with self.assertRaises(errors.ServerError):
+            self.generate()
+        self.assertEqual(self.stub.stats["failures"], 1 + 3)
+
+    def test_async_client_shares_its_connection(self):
+        import asyncio
+
+        from .gemini import agenerate_image
+
+        async def main():
+            return [await agenerate_image(subject_bytes(), "prompt", self.model) for _ in range(3)]
+
+        with redirect_stdout(StringIO()):
+            results = asyncio.run(main())
+        self.assertTrue(all(results))
+        self.assertEqual((self.stub.stats["requests"], self.stub.stats["connections"]), (3, 1))
+
+
+@override_settings(REMBG_DEFAULT_MODEL="u2netp", REMBG_FAST_MASK=False, PROCESS_POOL_SIZE=0)
+class BenchApiSmokeTests(SimpleTestCase):
+    def test_runs_every_endpoint_against_the_stub(self):
+        import json
+
+        from django.core.management import call_command
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        output = os.path.join(directory, "bench.json")
+        stdout = StringIO()
+        # bench_api cambia settings (deshechos con override_settings), el
+        # entorno y el cliente de Gemini del proceso: se restauran al salir
+        with override_settings(GEMINI_BASE_URL=None), \
+                mock.patch.dict(os.environ), \
+                mock.patch("api.gemini._client", None), \
+                redirect_stdout(StringIO()):
+            call_command(
+                "bench_api", "--sizes", "64x48", "--requests", "2", "--warmup", "0",
+                "--gemini-latency", "0", "--output", output, stdout=stdout, stderr=StringIO(),
+            )
+
+        with open(output) as f:
+            report = json.load(f)
+        self.assertEqual(
+            [(s["endpoint"], s["size"], s["requests"], s["errors"]) for s in report["scenarios"]],
+            [(name, "64x48", 2, 0) for name in ("remove-background", "remove-background2", "jurassic-explorer")],
+        )
+        self.assertTrue(all("p50_ms" in s for s in report["scenarios"]))
+        self.assertEqual(report["generated_cache"]["mode"], "temp")
+        self.assertFalse(report["generated_cache"]["warm"])
+        self.assertEqual(report["settings"]["REMBG_DEFAULT_MODEL"], "u2netp")
+        self.assertIn("jurassic-explorer", stdout.getvalue())
+
+
+def sleep_task(flag, seconds):
+    """
+    Tarea del pool para las pruebas: ocupa el proceso `seconds` segundos.
+    """
+    time.sleep(seconds)
+    return flag
+
+
+class ProcessPoolTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        from .procpool import ProcessPool
+
+        super().setUpClass()
+        cls.directory = tempfile.mkdtemp()
+        cls.addClassCleanup(shutil.rmtree, cls.directory)
+        # Los procesos del pool leen los settings del entorno: un modelo que
+        # está en disco, sin caché de imágenes generadas y los artefactos en
+        # un directorio propio, compartido con el proceso de las pruebas
+        cls.enterClassContext(mock.patch.dict(os.environ, {
+            "REMBG_DEFAULT_MODEL": "u2netp", "GENERATED_CACHE_PATH": "", "ARTIFACT_DIR": cls.directory,
+        }))
+        cls.enterClassContext(override_settings(
+            REMBG_DEFAULT_MODEL="u2netp", GENERATED_CACHE_PATH=None, ARTIFACT_DIR=cls.directory,
+            REMBG_FAST_MASK=False, PROCESS_POOL_QUEUE_TIMEOUT=0,
+        ))
+        cls.pool = ProcessPool(size=1, queue_size=0)
+        cls.addClassCleanup(cls.pool.shutdown)
+        cls.pool.start()
+
+    def shared_blocks(self):
+        return {name for name in os.listdir("/dev/shm") if name.startswith("psm_")}
+
+    def test_shared_memory_round_trip(self):
+        from .procpool import _share, _take
+
+        for data in (b"", b"imagen" * 1000):
+            with self.subTest(size=len(data)):
+                buffer = _share(data)
+                self.assertEqual(buffer.size, len(data))
+                self.assertEqual(_take(buffer), data)
+                # Quien lo lee lo libera
+                self.assertNotIn(buffer.name.lstrip("/"), self.shared_blocks())
+
+    def test_cutout_task_matches_the_in_process_result_and_frees_the_blocks(self):
+        from .batch import cutout_images
+        from .procpool import cutout_task
+        from .tracing import start_trace
+        import contextvars
+
+        data = subject_bytes()
+        before = self.shared_blocks()
+
+        def traced():
+            trace, _ = start_trace()
+            return self.pool.run(cutout_task, data, model_name="u2netp", output="png"), trace.stages()
+
+        result, stages = contextvars.Context().run(traced)
+        self.assertEqual(result, cutout_images([data], "u2netp", "png")[0])
+        # Las etapas medidas en el hijo llegan a la traza de la petición
+        self.assertIn("rembg", stages)
+        self.assertEqual(self.shared_blocks(), before)
+
+    def test_view_tasks_return_artifacts_readable_by_the_parent(self):
+        from .artifacts import artifact_store
+        from .procpool import compose_jurassic_task, remove_background2_task
+
+        data = subject_bytes()
+        refs = self.pool.run(remove_background2_task, data, model_name="u2netp")
+        self.assertEqual(set(refs), {"image_no_bg", "image_with_new_bg", "transition_video"})
+        refs.update(("jurassic_" + name, ref) for name, ref in self.pool.run(
+            compose_jurassic_task, data, subject_bytes(color=(90, 60, 20))
+        ).items())
+        for name, ref in refs.items():
+            with self.subTest(artifact=name):
+                self.assertTrue(os.path.getsize(artifact_store.path(ref["id"])) > 0)
+        self.assertEqual(artifact_store.read(refs["jurassic_transition_video"]["id"])[4:8], b"ftyp")
+
+    def test_saturated_pool_rejects_with_429_unless_waiting(self):
+        from .procpool import PoolSaturated, waiting
+
+        busy = threading.Thread(target=self.pool.run, args=(sleep_task, b"ocupado"), kwargs={"seconds": 0.5})
+        busy.start()
+        self.addCleanup(busy.join)
+        time.sleep(0.1)
+
+        with self.assertRaises(PoolSaturated):
+            self.pool.run(sleep_task, b"otra", seconds=0)
+
+        with mock.patch("api.views.process_pool", self.pool), \
+                mock.patch("api.views.result_cache.get", return_value=None):
+            response = self.client.post(
+                "/api/remove-background/", {"file": upload("foto.png", subject_bytes())}, HTTP_HOST="localhost",
+            )
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response["Retry-After"], str(settings.PROCESS_POOL_RETRY_AFTER))
+
+        # Los trabajos de la cola esperan su turno
+        with waiting():
+            self.assertEqual(self.pool.run(sleep_task, b"en cola", seconds=0), b"en cola")
@@ -0,0 +1,143 @@
+"""
+Tiempo de cada etapa del procesamiento de una petición.
+
+Con API_TRACING, api.middleware.TracingMiddleware abre una traza por
+petición y cada bloque marcado con `span` suma su duración a la etapa:
+
+    with span("rembg"):
+        masks = predict_masks(...)
+
+Al terminar la petición la respuesta lleva la cabecera `Server-Timing`
+(visible en las herramientas de desarrollo del navegador), se escribe una
+línea JSON en el logger `api.trace` (a nivel DEBUG) y cada etapa se acumula
+en el histograma `stage_seconds`, publicado en /metrics.
+
+Sin traza activa (API_TRACING desactivado, o código que no atiende una
+petición, como la cola de trabajos) `span` sólo consulta una ContextVar.
+"""
+import contextvars
+import json
+import logging
+import threading
+import time
+
+from .metrics import metrics
+
+logger = logging.getLogger("api.trace")
+
+_current = contextvars.ContextVar("api_trace", default=None)
+
+
+class Trace:
+    """
+    Duración acumulada de cada etapa de una petición, en el orden en que
+    empezaron. Las etapas pueden ejecutarse en otros hilos (pool de las
+    vistas asíncronas).
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self._stages = {}
+        self._lock = threading.Lock()
+
+    def add(self, name, seconds):
+        with self._lock:
+            self._stages[name] = self._stages.get(name, 0.0) + seconds
+
+    def stages(self):
+        with self._lock:
+            return dict(self._stages)
+
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+    def server_timing(self, total):
+        """
+        Valor de la cabecera Server-Timing (duraciones en ms).
+        """
+        entries = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.stages().items()]
+        entries.append(f"total;dur={total * 1000:.1f}")
+        return ", ".join(entries)
+
+
+class _Span:
+    __slots__ = ("trace", "name", "start")
+
+    def __init__(self, trace, name):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        seconds = time.perf_counter() - self.start
+        self.trace.add(self.name, seconds)
+        metrics.observe("stage_seconds", seconds, stage=self.name)
+        return False
+
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+def span(name):
+    """
+    Context manager que mide el bloque como la etapa `name` de la traza
+    actual (no hace nada si no hay traza).
+    """
+    trace = _current.get()
+    if trace is None:
+        return _NO_SPAN
+    return _Span(trace, name)
+
+
+def current_trace():
+    """
+    Traza del contexto actual, o None.
+    """
+    return _current.get()
+
+
+def start_trace():
+    """
+    Abre una traza en el contexto actual. Devuelve (traza, token para
+    `end_trace`).
+    """
+    trace = Trace()
+    return trace, _current.set(trace)
+
+
+def end_trace(trace, token, request, response):
+    """
+    Cierra la traza: añade Server-Timing a `response`, registra la duración
+    de la petición y escribe la línea de log.
+    """
+    _current.reset(token)
+    total = trace.elapsed()
+    match = getattr(request, "resolver_match", None)
+    view = match.url_name if match and match.url_name else "other"
+    status = getattr(response, "status_code", 500)
+
+    if response is not None:
+        response["Server-Timing"] = trace.server_timing(total)
+    metrics.observe("request_seconds", total, view=view)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(json.dumps({
+            "method": request.method,
+            "path": request.path,
+            "view": view,
+            "status": status,
+            "duration_ms": round(total * 1000, 1),
+            "stages_ms": {name: round(seconds * 1000, 1) for name, seconds in trace.stages().items()},
+        }))
@@ -0,0 +1,120 @@
+"""
+Video de transición "cortinilla vertical": la imagen final baja desde arriba
+y cubre la original.
+
+Antes se montaba con CompositeVideoClip de moviepy, que recompone cada frame
+de forma genérica (conversiones a Pillow, canvas RGBA y un array nuevo por
+frame). Como la transición sólo desplaza una imagen sobre otra, aquí cada
+frame se rellena con copias de slices de NumPy sobre un único buffer
+reservado al principio. El resultado es idéntico píxel a píxel al de moviepy.
+
+Cuando la cortinilla termina, el resto del video es el mismo frame repetido;
+ese tramo no se renderiza y el codificador sólo mantiene el último frame en
+pantalla (ver `static_tail` en api.video).
+"""
+import numpy as np
+from django.conf import settings
+
+from .video import encode_mp4
+
+# Segundos que tarda la imagen final en bajar y duración total del video
+WIPE_DURATION = 5
+TOTAL_DURATION = 8
+FPS = 24
+
+
+class VerticalWipe:
+    """
+    Iterable de frames de la transición.
+
+    El tamaño del video es el de `original`; `final` puede tener otro tamaño
+    y se recorta igual que lo hacía moviepy. Una vez terminada la cortinilla
+    la imagen original desaparece, y lo que `final` no cubra queda en negro.
+
+    Todos los frames se escriben en el mismo buffer: cada frame deja de ser
+    válido en cuanto se pide el siguiente.
+    """
+
+    def __init__(self, original, final, duration=WIPE_DURATION,
+                 total_duration=TOTAL_DURATION, fps=FPS):
+        self.original = np.ascontiguousarray(original, dtype=np.uint8)
+        self.final = np.ascontiguousarray(final, dtype=np.uint8)
+        self.duration = duration
+        self.total_duration = total_duration
+        self.fps = fps
+        height, width = self.original.shape[:2]
+        self.size = (width, height)
+
+    def __len__(self):
+        return int(self.total_duration * self.fps)
+
+    @property
+    def static_tail(self):
+        """
+        Número de frames del final iguales al primer frame con la cortinilla
+        terminada (que no se cuenta).
+        """
+        for index in range(len(self)):
+            if index / self.fps >= self.duration:
+                return len(self) - index - 1
+        return 0
+
+    def offset(self, t):
+        """
+        Posición vertical de la imagen final en el instante `t`, con el mismo
+        cálculo y el mismo truncado a entero que moviepy.
+        """
+        if t < self.duration:
+            height = self.size[1]
+            return int(-height + (height * t / self.duration))
+        return 0
+
+    def render(self, t, out):
+        """
+        Escribe en `out` el frame del instante `t`.
+        """
+        height, width = self.original.shape[:2]
+        final_height, final_width = self.final.shape[:2]
+        y = self.offset(t)
+
+        # Filas del video cubiertas por la imagen final y columnas que ocupa
+        covered = max(0, min(height, y + final_height))
+        cols = min(width, final_width)
+
+        if t < self.duration:
+            out[covered:] = self.original[covered:]
+            if cols < width:
+                out[:covered, cols:] = self.original[:covered, cols:]
+        else:
+            if covered < height:
+                out[covered:] = 0
+            if cols < width:
+                out[:covered, cols:] = 0
+
+        if covered:
+            out[:covered, :cols] = self.final[-y:covered - y, :cols]
+        return out
+
+    def frames(self, stop=None):
+        """
+        Genera los frames desde el principio hasta `stop` (sin incluirlo).
+        """
+        buffer = np.empty_like(self.original)
+        for index in range(len(self) if stop is None else stop):
+            yield self.render(index / self.fps, buffer)
+
+    def __iter__(self):
+        return self.frames()
+
+
+def render_transition(original, final, path=None):
+    """
+    Genera el MP4 de la transición entre dos imágenes RGB (arrays de NumPy).
+    Devuelve sus bytes o, con `path`, lo escribe en ese fichero.
+    """
+    wipe = VerticalWipe(original, final)
+    static_tail = wipe.static_tail if settings.VIDEO_SKIP_STATIC_TAIL else 0
+    return encode_mp4(
+        wipe.frames(len(wipe) - static_tail), wipe.size, len(wipe), wipe.fps, static_tail,
+        path=path,
+    )
@@ -1,8 +1,39 @@
+from django.conf import settings
 from django.urls import path
-from .views import RemoveBackgroundView, RemoveBackgroundView2, JurassicExplorerView
+from .endpoints import enabled_endpoints
+from .views import HealthView, RemoveBackgroundBatchView, JobSubmitView, JobStatusView, ArtifactView
+
+if settings.API_ASYNC_VIEWS:
+    # Servidor ASGI: vistas asíncronas para los endpoints lentos
+    from .async_views import AsyncRemoveBackgroundView as RemoveBackgroundView
+    from .async_views import AsyncRemoveBackgroundView2 as RemoveBackgroundView2
+    from .async_views import AsyncJurassicExplorerView as JurassicExplorerView
+else:
+    from .views import RemoveBackgroundView, RemoveBackgroundView2, JurassicExplorerView
+
+# Rutas de cada endpoint que se puede desactivar con API_ENABLED_ENDPOINTS
+# (ver api.endpoints)
+endpoint_patterns = {
+    'remove-background': [
+        path('remove-background/', RemoveBackgroundView.as_view(), name='remove-background'),
+    ],
+    'remove-background-batch': [
+        path('remove-background/batch/', RemoveBackgroundBatchView.as_view(), name='remove-background-batch'),
+    ],
+    'remove-background2': [
+        path('remove-background2/', RemoveBackgroundView2.as_view(), name='remove-background2'),
+    ],
+    'jurassic-explorer': [
+        path('jurassic-explorer/', JurassicExplorerView.as_view(), name='jurassic-explorer'),
+    ],
+    'jobs': [
+        path('jobs/', JobSubmitView.as_view(), name='job-submit'),
+        path('jobs/<str:job_id>/', JobStatusView.as_view(), name='job-status'),
+    ],
+}
 
 urlpatterns = [
-    path('remove-background/', RemoveBackgroundView.as_view(), name='remove-background'),
-    path('remove-background2/', RemoveBackgroundView2.as_view(), name='remove-background2'),
-    path('jurassic-explorer/', JurassicExplorerView.as_view(), name='jurassic-explorer'),
+    path('health/', HealthView.as_view(), name='health'),
+    *(pattern for name in enabled_endpoints() for pattern in endpoint_patterns[name]),
+    path('artifacts/<str:artifact_id>/', ArtifactView.as_view(), name='artifact'),
 ]
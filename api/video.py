@@ -0,0 +1,232 @@
+"""
+Codificación de video sin ficheros intermedios.
+
+moviepy sólo sabe escribir el MP4 en disco, y las vistas lo volvían a leer
+entero después. Aquí los frames se envían directamente a la entrada estándar
+de ffmpeg y el MP4 se recoge de su salida estándar. Un MP4 escrito a un pipe
+no puede reescribir su cabecera al final, así que se genera fragmentado
+(compatible con los navegadores).
+
+Para salidas muy grandes se puede volver al disco (VIDEO_ENCODE_MODE): ffmpeg
+escribe en un fichero temporal que se lee y se borra al terminar.
+
+Si el video termina con un tramo estático (`static_tail` frames iguales al
+último), ese tramo no se renderiza ni se codifica: ffmpeg recibe los frames
+distintos y, una vez más, el último, con el PTS del último frame del video
+(filtro `setpts`). El video empieza y acaba igual que el completo y al
+decodificarlo a frame rate constante da los mismos frames, pero ffmpeg
+codifica muchos menos.
+"""
+import os
+import subprocess
+import tempfile
+import threading
+
+import numpy as np
+from django.conf import settings
+from moviepy.config import FFMPEG_BINARY
+
+from .metrics import metrics
+
+CHUNK_SIZE = 64 * 1024
+
+
+class VideoEncodingError(Exception):
+    """
+    ffmpeg terminó con error.
+    """
+
+
+def _ffmpeg_command(size, fps, output, fragmented, hold=None):
+    width, height = size
+    cmd = [
+        FFMPEG_BINARY,
+        "-y",
+        "-loglevel", "error",
+        "-f", "rawvideo",
+        "-vcodec", "rawvideo",
+        "-s", f"{width}x{height}",
+        "-pix_fmt", "rgb24",
+        "-r", f"{fps:.02f}",
+        "-an",
+        "-i", "-",
+        "-vcodec", "libx264",
+        "-preset", settings.VIDEO_X264_PRESET,
+    ]
+    if hold is not None:
+        cmd.extend(_hold_options(*hold, fps))
+    # Igual que moviepy: yuv420p sólo si las dos dimensiones son pares
+    if width % 2 == 0 and height % 2 == 0:
+        cmd.extend(["-pix_fmt", "yuv420p"])
+    if fragmented:
+        # Sin lista de edición (empty_moov), el retardo de los B-frames haría
+        # empezar el video en 2 frames en lugar de en 0; con
+        # negative_cts_offsets empieza en 0, igual que el MP4 en fichero
+        cmd.extend(["-movflags", "frag_keyframe+empty_moov+default_base_moof+negative_cts_offsets"])
+    else:
+        cmd.extend(["-movflags", "+faststart"])
+    # El formato se indica siempre: la salida puede ser un pipe o un temporal
+    # sin extensión .mp4
+    cmd.extend(["-f", "mp4"])
+    cmd.append(output)
+    return cmd
+
+
+def _hold_options(last_index, nframes, fps):
+    """
+    Opciones de ffmpeg para un video de `nframes` frames del que se envían
+    los frames hasta `last_index` y después otra vez el último:
+
+    - `setpts` pone el frame repetido en el último instante del video, y
+      `-fps_mode vfr` evita que ffmpeg rellene el hueco duplicando frames.
+      Los demás conservan sus tiempos, así que el primero sigue en 0.
+    - `setts` da a cada paquete la duración de un frame y alarga el último
+      en orden de decodificación (con B-frames no es el último que se
+      muestra) para que la pista dure `nframes` frames: tanto el MP4
+      fragmentado como el normal miden la pista como la suma de las
+      duraciones desde el primer DTS.
+    """
+    held = last_index + 1
+    return [
+        "-vf", f"setpts=if(eq(N\\,{held})\\,{nframes - 1}/({fps}*TB)\\,PTS)",
+        "-fps_mode", "vfr",
+        "-bsf:v", _setts(held, nframes, fps),
+    ]
+
+
+def _setts(last_packet, nframes, fps):
+    """
+    Expresión de `setts` para `_hold_options`. Hay que dar `pts` y `dts`
+    aunque no cambien: sin ellos ffmpeg 7.0 pone el PTS igual al DTS.
+    """
+    return (
+        "setts=pts=PTS:dts=DTS:duration="
+        f"if(eq(N\\,{last_packet})\\,{nframes}/({fps}*TB)-(DTS-STARTDTS)\\,1/({fps}*TB))"
+    )
+
+
+def _feed(proc, frames, errors, repeat_last=False):
+    try:
+        data = None
+        for frame in frames:
+            data = np.ascontiguousarray(frame, dtype=np.uint8).data
+            proc.stdin.write(data)
+        if repeat_last and data is not None:
+            # El frame que se mantiene hasta el final (ver `_hold_options`)
+            proc.stdin.write(data)
+    except BrokenPipeError:
+        # ffmpeg se cerró antes de tiempo; su stderr explica el motivo
+        pass
+    except Exception as e:
+        errors.append(e)
+    finally:
+        try:
+            proc.stdin.close()
+        except BrokenPipeError:
+            pass
+
+
+def _hold(nframes, static_tail):
+    """
+    (índice del último frame enviado, frames totales) o None si no hay
+    tramo estático que saltar.
+    """
+    if nframes is None or static_tail < 1:
+        return None
+    return nframes - static_tail - 1, nframes
+
+
+def _start(frames, size, fps, output, fragmented, stdout, hold=None):
+    proc = subprocess.Popen(
+        _ffmpeg_command(size, fps, output, fragmented, hold),
+        stdin=subprocess.PIPE,
+        stdout=stdout,
+        stderr=subprocess.PIPE,
+    )
+    errors = []
+    feeder = threading.Thread(target=_feed, args=(proc, frames, errors, hold is not None), daemon=True)
+    feeder.start()
+    return proc, feeder, errors
+
+
+def _finish(proc, feeder, errors):
+    feeder.join()
+    stderr = proc.stderr.read()
+    proc.wait()
+    if errors:
+        raise errors[0]
+    if proc.returncode != 0:
+        raise VideoEncodingError(
+            f"ffmpeg terminó con código {proc.returncode}: {stderr.decode(errors='replace').strip()}"
+        )
+
+
+def iter_mp4(frames, size, fps=24, nframes=None, static_tail=0):
+    """
+    Codifica `frames` (arrays RGB uint8 de tamaño `size`) y genera los bytes
+    del MP4 fragmentado a medida que ffmpeg los produce.
+
+    Con `static_tail`, `frames` trae sólo los `nframes - static_tail`
+    primeros frames y el último se mantiene hasta completar `nframes`.
+    """
+    hold = _hold(nframes, static_tail)
+    proc, feeder, errors = _start(frames, size, fps, "pipe:1", True, subprocess.PIPE, hold)
+    completed = False
+    try:
+        while True:
+            chunk = proc.stdout.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+        completed = True
+    finally:
+        if not completed:
+            # El consumidor abandonó el generador a medias (p. ej. el cliente
+            # cerró la conexión): no tiene sentido seguir codificando
+            proc.kill()
+        proc.stdout.close()
+    _finish(proc, feeder, errors)
+
+
+def _encode_to_file(frames, size, fps, hold, path):
+    proc, feeder, errors = _start(frames, size, fps, path, False, subprocess.DEVNULL, hold)
+    _finish(proc, feeder, errors)
+
+
+def _encode_to_disk(frames, size, fps, hold):
+    fd, path = tempfile.mkstemp(suffix=".mp4", dir=settings.VIDEO_TEMP_DIR)
+    os.close(fd)
+    try:
+        _encode_to_file(frames, size, fps, hold, path)
+        with open(path, "rb") as f:
+            return f.read()
+    finally:
+        os.unlink(path)
+
+
+def use_disk(size, nframes):
+    mode = settings.VIDEO_ENCODE_MODE
+    if mode == "auto":
+        return size[0] * size[1] * nframes > settings.VIDEO_PIPE_MAX_PIXELS
+    return mode == "disk"
+
+
+def encode_mp4(frames, size, nframes, fps=24, static_tail=0, path=None):
+    """
+    Codifica los frames y devuelve los bytes del MP4 de `nframes` frames.
+    Usa el pipe salvo que VIDEO_ENCODE_MODE indique lo contrario.
+
+    Con `path`, ffmpeg escribe el MP4 (no fragmentado) directamente en ese
+    fichero y no se devuelve nada: el video nunca pasa entero por memoria.
+    """
+    if static_tail:
+        metrics.increment("video_static_frames_skipped_total", static_tail)
+    if path is not None:
+        metrics.increment("video_encodes_total", mode="file")
+        return _encode_to_file(frames, size, fps, _hold(nframes, static_tail), path)
+    if use_disk(size, nframes):
+        metrics.increment("video_encodes_total", mode="disk")
+        return _encode_to_disk(frames, size, fps, _hold(nframes, static_tail))
+    metrics.increment("video_encodes_total", mode="pipe")
+    return b"".join(iter_mp4(frames, size, fps, nframes, static_tail))
+
@@ -1,68 +1,177 @@
 from rest_framework.views import APIView
 from rest_framework.response import Response # La usamos para los errores
-from django.http import HttpResponse # La usamos para la respuesta de imagen
+from django.http import HttpResponse, StreamingHttpResponse # La usamos para la respuesta de imagen
 from rest_framework import status
+from django.urls import reverse
 from rest_framework.parsers import MultiPartParser, FormParser
-from rembg import remove
-from PIL import Image
-from io import BytesIO
-import base64
+from .sessions import resolve_model, SessionPoolTimeout
+from .cache import result_cache, make_key
+from .generated import generated_cache, generation_key
+from .masks import mask_params, cutout
+from .outputs import output_format, output_params, content_type, extension
+from .singleflight import single_flight
+from .assets import asset_cache, background_path, LOGO_PATHS
+from .artifacts import artifact_store, ArtifactNotFound
+from .ingest import read_upload, check_request_size, UploadError
+from .responses import response_mode, render_artifacts, artifact_urls, artifact_data_urls, file_response
+from . import warmup
+from .jobs import InvalidCallback, job_queue, QueueFull
+from .procpool import process_pool, PoolSaturated, cutout_task, remove_background2_task, compose_jurassic_task
+from .pipeline import PipelineImage
+from .metrics import render_prometheus
+from .tracing import span
+from .endpoints import is_enabled
 import os
-import tempfile
+import secrets
+import shutil
 import traceback
-import numpy as np
-from moviepy import *
-from moviepy import vfx
-from moviepy.video.VideoClip import ImageClip
-from moviepy.video.compositing.CompositeVideoClip import CompositeVideoClip
-import time
 
 
 
 from django.conf import settings
-import tempfile
 from dotenv import load_dotenv
 
 # Cargar variables de entorno
 load_dotenv()
 
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-output_dir = os.path.join(BASE_DIR, "media", "videos")  # por ejemplo: ./media/videos
+class ProcessingError(Exception):
+    """
+    Error esperado del procesamiento; su mensaje se devuelve tal cual al cliente.
+    """
+
+
+# Modelo de Gemini y prompt del explorador del Jurásico
+JURASSIC_MODEL = "gemini-2.5-flash-image-preview"
+# Versión del prompt: subirla al cambiarlo invalida las imágenes ya generadas
+# (ver api.generated)
+JURASSIC_PROMPT_VERSION = 1
+JURASSIC_PROMPT = """Analiza esta imagen y transforma EXACTAMENTE el rostro y pose de TODAS las personas manteniendo 100% fiel cada rostro original (ojos, nariz, boca, forma de cara, expresión, edad, género). CONSERVA las poses, posturas y posiciones corporales originales. Viste a cada persona con trajes de explorador del Jurásico (chaqueta de cuero marrón, botas altas, sombrero de explorador, cinturón con herramientas) manteniendo su pose original. Fondo: período Jurásico con dinosaurios, vegetación prehistórica y volcanes. Si hay múltiples personas, mantén la misma composición espacial original. Iluminación dramática y cinematográfica. Estilo realista como película de aventuras."""
+
+
+class HealthView(APIView):
+    """
+    Health check del worker. Responde 503 mientras el warm-up no ha terminado
+    o si ha fallado, así el balanceador no envía tráfico a un worker que aún
+    está cargando modelos o que no ha podido cargarlos.
+    """
+    def get(self, request, *args, **kwargs):
+        data = warmup.state.as_dict()
+        if not warmup.state.ready or warmup.state.error is not None:
+            return Response(data, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        return Response(data, status=status.HTTP_200_OK)
+
+
+class MetricsView(APIView):
+    """
+    Métricas del worker en el formato de texto de Prometheus (ver
+    api.metrics). Cada worker publica las suyas.
+
+    Hay que enviar `Authorization: Bearer <METRICS_TOKEN>`; sin token
+    configurado responde siempre 403. No se confía en la dirección de origen:
+    detrás de un proxy todas las peticiones llegan desde una dirección interna.
+    """
+    def allowed(self, request):
+        token = settings.METRICS_TOKEN
+        if not token:
+            return False
+        return secrets.compare_digest(request.headers.get('Authorization', ''), f"Bearer {token}")
+
+    def get(self, request, *args, **kwargs):
+        if not self.allowed(request):
+            return Response({"error": "No autorizado"}, status=status.HTTP_403_FORBIDDEN)
+        return HttpResponse(render_prometheus(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+def requested_model(request, endpoint):
+    """
+    Modelo de rembg de la petición (parámetro `model`, en la query o en el
+    formulario) o el del endpoint. Lanza UnknownModel si no está permitido.
+    """
+    return resolve_model(request.GET.get('model') or request.POST.get('model'), endpoint)
+
+
+def busy_response(error):
+    """
+    429 con Retry-After cuando el pool de procesos está saturado (ver api.procpool).
+    """
+    response = Response({"error": str(error)}, status=status.HTTP_429_TOO_MANY_REQUESTS)
+    response['Retry-After'] = str(settings.PROCESS_POOL_RETRY_AFTER)
+    return response
+
 
 class BaseRemoveBackgroundView(APIView):
     """
     Vista base para eliminar el fondo de una imagen.
     Encapsula la lógica común para la validación de archivos y el manejo de errores.
+    El modelo de rembg se elige con el parámetro `model` y el formato de la
+    imagen con `output` (ver api.outputs).
     """
     parser_classes = (MultiPartParser, FormParser)
+    # Nombre de la URL, para el modelo por defecto del endpoint (REMBG_ENDPOINT_MODELS)
+    endpoint = 'remove-background'
 
     def post(self, request, *args, **kwargs):
+        # Antes de acceder a request.data, que lee y procesa todo el cuerpo
+        try:
+            check_request_size(request)
+        except UploadError as e:
+            return Response({"error": str(e)}, status=e.status_code)
+
         if 'file' not in request.data:
             return Response({"error": "No se proporcionó ningún archivo"}, status=status.HTTP_400_BAD_REQUEST)
 
+        try:
+            model_name = requested_model(request, self.endpoint)
+            output = output_format(request)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
         file_obj = request.data['file']
 
         try:
-            input_image_bytes = file_obj.read()
+            input_image_bytes = read_upload(file_obj)
             
             # Procesar la imagen
-            output_image_bytes = self.process_image(input_image_bytes)
+            output_image_bytes = self.process_image(input_image_bytes, model_name, output)
 
             # Crear una respuesta HTTP con la imagen procesada
-            response = HttpResponse(output_image_bytes, content_type='image/png')
-            response['Content-Disposition'] = 'attachment; filename="no-bg.png"'
+            response = HttpResponse(output_image_bytes, content_type=content_type(output))
+            filename = ('mask' if output == 'mask' else 'no-bg') + extension(output)
+            response['Content-Disposition'] = f'attachment; filename="{filename}"'
             
             return response
+        except UploadError as e:
+            return Response({"error": str(e)}, status=e.status_code)
+        except SessionPoolTimeout as e:
+            return Response({"error": str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        except PoolSaturated as e:
+            return busy_response(e)
         except Exception as e:
             return Response({"error": f"Error al procesar la imagen: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-    def process_image(self, image_bytes):
+    def process_image(self, image_bytes, model_name=None, output="png"):
         """
         Procesa la imagen. Este método está diseñado para ser sobrescrito
         por subclases si necesitan realizar un procesamiento adicional.
+        Sin `model_name` se usa el modelo por defecto del endpoint.
         """
-        # Usar rembg para quitar el fondo
-        return remove(image_bytes)
+        model_name = model_name or resolve_model(None, self.endpoint)
+
+        def compute():
+            if process_pool.enabled:
+                return process_pool.run(cutout_task, image_bytes, model_name=model_name, output=output)
+            # api.batch sólo lo usan los endpoints de rembg (que ApiConfig.ready
+            # ya ha importado, ver api.endpoints)
+            from .batch import cutout_images
+
+            # Mismo resultado que rembg.remove, con una sesión del pool del
+            # proceso (el modelo ONNX se carga una sola vez por worker). Con
+            # `output=mask` no llega a construirse la imagen RGBA.
+            return cutout_images([image_bytes], model_name, output)[0]
+
+        # Las fotos repetidas se sirven desde el caché sin volver a ejecutar el modelo
+        key = make_key(image_bytes, model_name, **mask_params(), **output_params(output))
+        return result_cache.get_or_set(key, compute)
 
 
 class RemoveBackgroundView(BaseRemoveBackgroundView):
@@ -72,132 +181,217 @@ class RemoveBackgroundView(BaseRemoveBackgroundView):
     pass
 
 
-class RemoveBackgroundView2(BaseRemoveBackgroundView):
+class RemoveBackgroundBatchView(APIView):
     """
-    Una vista que elimina el fondo, lo reemplaza con una imagen fija
-    y devuelve un objeto JSON con dos imágenes:
-    1. La imagen sin fondo.
-    2. La imagen con el nuevo fondo y un video de transición.
-    Ambas imágenes se devuelven codificadas en base64.
+    Elimina el fondo de varias imágenes en una sola petición (campo `files`,
+    repetido) y devuelve un ZIP con un archivo por imagen, en el mismo orden
+    y en el formato de `output`.
+    Las imágenes se resuelven juntas en lotes de inferencia.
     """
+    parser_classes = (MultiPartParser, FormParser)
+
     def post(self, request, *args, **kwargs):
-        if 'file' not in request.data:
+        try:
+            check_request_size(request, max_files=settings.REMBG_MAX_BATCH_SIZE)
+        except UploadError as e:
+            return Response({"error": str(e)}, status=e.status_code)
+
+        files = request.FILES.getlist('files')
+        if not files:
             return Response({"error": "No se proporcionó ningún archivo"}, status=status.HTTP_400_BAD_REQUEST)
 
-        file_obj = request.data['file']
+        max_batch_size = settings.REMBG_MAX_BATCH_SIZE
+        if len(files) > max_batch_size:
+            return Response(
+                {"error": f"Se admiten como máximo {max_batch_size} archivos por petición"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
 
         try:
-            input_image_bytes = file_obj.read()
-
-            # 1. Quitar el fondo usando la lógica de la clase base
-            no_bg_image_bytes = super().process_image(input_image_bytes)
+            model_name = requested_model(request, 'remove-background-batch')
+            output = output_format(request)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
-            # --- 2. Proceso adicional: añadir un nuevo fondo desde un archivo ---
+        images = []
+        for f in files:
+            try:
+                images.append(read_upload(f))
+            except UploadError as e:
+                return Response({"error": f"{f.name}: {e}"}, status=e.status_code)
 
-            # Abrir la imagen original para obtener sus dimensiones
-            original_image = Image.open(BytesIO(input_image_bytes))
-            # Abrir la imagen sin fondo para pegarla
-            no_bg_image = Image.open(BytesIO(no_bg_image_bytes))
+        from .batch import remove_background_batch, iter_zip
 
-            # Cargar la imagen de fondo desde el servidor.
-            # **NOTA**: Asegúrate de que esta ruta sea correcta y que la imagen exista.
-            # Por ejemplo, crea una carpeta 'static/images' en la raíz de tu proyecto Django.
-            background_path = os.path.join(settings.BASE_DIR, 'static', 'images', 'forest.jpg')
+        try:
+            outputs = remove_background_batch(images, model_name, output)
+        except SessionPoolTimeout as e:
+            return Response({"error": str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        except Exception as e:
+            return Response({"error": f"Error al procesar las imágenes: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-            if not os.path.exists(background_path):
-                error_msg = f"La imagen de fondo no se encuentra en la ruta esperada: {background_path}"
-                print(error_msg) # Log to console for debugging
-                return Response({"error": error_msg}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        # El índice delante del nombre evita colisiones entre archivos con el mismo nombre
+        names = [
+            f"{index:03d}-{os.path.splitext(os.path.basename(f.name or 'image'))[0]}"
+            f"-{'mask' if output == 'mask' else 'no-bg'}{extension(output)}"
+            for index, f in enumerate(files)
+        ]
+        response = StreamingHttpResponse(iter_zip(zip(names, outputs)), content_type='application/zip')
+        response['Content-Disposition'] = 'attachment; filename="no-bg.zip"'
+        return response
 
-            background_image = Image.open(background_path).convert("RGBA")
 
-            # Adaptar el tamaño del fondo al de la imagen original
-            background_image_resized = background_image.resize(original_image.size)
+class RemoveBackgroundView2(BaseRemoveBackgroundView):
+    """
+    Una vista que elimina el fondo, lo reemplaza con una imagen fija
+    y devuelve dos imágenes:
+    1. La imagen sin fondo.
+    2. La imagen con el nuevo fondo y un video de transición.
+    El formato de la respuesta (URLs, multipart o data URLs en base64) se
+    elige con `?response=` (ver api.responses).
+    """
+    endpoint = 'remove-background2'
 
-            # Pegar la imagen sin fondo sobre el nuevo fondo
-            background_image_resized.paste(no_bg_image, (0, 0), no_bg_image)
+    def post(self, request, *args, **kwargs):
+        # Antes de acceder a request.data, que lee y procesa todo el cuerpo
+        try:
+            check_request_size(request)
+        except UploadError as e:
+            return Response({"error": str(e)}, status=e.status_code)
 
-            # Guardar la imagen final con el nuevo fondo en un buffer de bytes
-            final_image_buffer = BytesIO()
-            background_image_resized.save(final_image_buffer, format='PNG')
-            image_with_new_bg_bytes = final_image_buffer.getvalue()
+        if 'file' not in request.data:
+            return Response({"error": "No se proporcionó ningún archivo"}, status=status.HTTP_400_BAD_REQUEST)
 
-            # --- 3. Proceso adicional: Crear un video de transición ---
+        try:
+            mode = response_mode(request)
+            model_name = requested_model(request, self.endpoint)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
-            # Convertir imágenes a formato que moviepy pueda usar (arrays de numpy en RGB)
-            original_np = np.array(original_image.convert("RGB"))
-            final_np = np.array(background_image_resized.convert("RGB"))
+        file_obj = request.data['file']
 
-            # Crear clips de imagen con una duración de 5 segundos
-            duration = 5
-            original_clip = ImageClip(original_np).with_duration(duration)
-            final_clip = ImageClip(final_np).with_duration(8)
-            # Obtén el tamaño del video
-            video_size = original_clip.size  # (width, height)
+        try:
+            input_image_bytes = read_upload(file_obj)
 
-            # Define una función de posición que baja la imagen desde arriba
-            def vertical_wipe(t):
-                # t es el tiempo en segundos
-                if t < duration:
+            refs = self.build_result(input_image_bytes, model_name=model_name)
+            return render_artifacts(request, refs, mode)
 
-                    y = -video_size[1] + (video_size[1] * t / duration)
-                else:
-                    y=0
-                return (0, y)
+        except UploadError as e:
+            return Response({"error": str(e)}, status=e.status_code)
+        except ProcessingError as e:
+            return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        except PoolSaturated as e:
+            return busy_response(e)
+        except Exception as e:
+            # Imprimimos el traceback completo en la consola para una mejor depuración
+            print("--- Ha ocurrido un error en la vista ---")
+            traceback.print_exc()
+            print("------------------------------------")
+            return Response({"error": f"Error al procesar la imagen: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-            # Aplica la animación de entrada
-            final_clip = final_clip.with_position(vertical_wipe)
+    def build_result(self, input_image_bytes, ttl=None, model_name=None):
+        """
+        Genera los ficheros de la respuesta a partir de los bytes de la imagen
+        subida y devuelve sus referencias en el almacén (caducan en `ttl`
+        segundos). Separado de `post` para poder ejecutarlo también desde la
+        cola de trabajos. Las peticiones simultáneas con la misma imagen
+        comparten el cálculo.
+        """
+        model_name = model_name or resolve_model(None, self.endpoint)
+        key = make_key(input_image_bytes, model_name, view='remove-background2', ttl=ttl)
+        return single_flight.do(key, lambda: self.compute_result(input_image_bytes, ttl, model_name))
 
-            # Combina los clips
-            video = CompositeVideoClip([original_clip, final_clip])
+    def compute_result(self, input_image_bytes, ttl=None, model_name=None):
+        """
+        Quita el fondo, compone la imagen con el nuevo fondo y genera el video.
+        La subida se decodifica una sola vez y las etapas se pasan imágenes
+        ya decodificadas (ver api.pipeline). Con el pool de procesos todo se
+        ejecuta en uno de ellos.
+        """
+        if process_pool.enabled:
+            return process_pool.run(
+                remove_background2_task, input_image_bytes, ttl=ttl, model_name=model_name
+            )
+        original = PipelineImage(input_image_bytes)
+        # 1. Quitar el fondo
+        no_bg = self.cutout(original, model_name)
+        return self.compose_result(original, no_bg, ttl)
 
-            # original_clip = original_clip.with_effects([vfx.FadeOut(duration)])
-            # final_clip = final_clip.with_effects([vfx.FadeIn(duration)])
+    def cutout(self, original, model_name=None):
+        """
+        La imagen sin fondo de `original` (PipelineImage). Comparte el caché
+        de resultados con remove-background: el PNG que se guarda es el
+        mismo que devolvería `process_image`.
+        """
+        model_name = model_name or resolve_model(None, self.endpoint)
+        key = make_key(original.data, model_name, **mask_params(), **output_params("png"))
+        cached = result_cache.get(key)
+        if cached is not None:
+            return PipelineImage(cached)
+
+        # api.batch sólo lo usan los endpoints de rembg (que ApiConfig.ready
+        # ya ha importado, ver api.endpoints)
+        from .batch import image_masks
+
+        mask = image_masks([original.image], model_name)[0]
+        with span("mask"):
+            no_bg = PipelineImage(image=cutout(original.image, mask))
+        result_cache.set(key, no_bg.png())
+        return no_bg
+
+    def compose_result(self, original, no_bg, ttl=None):
+        """
+        Pega la imagen sin fondo sobre el fondo fijo, genera el video y guarda
+        los ficheros. `original` y `no_bg` son PipelineImage: sólo se
+        codifica lo que se guarda. Separado para que la vista asíncrona
+        ejecute cada etapa por su cuenta.
+        """
+        # --- 2. Proceso adicional: añadir un nuevo fondo desde un archivo ---
 
+        with span("composite"):
+            # Cargar la imagen de fondo desde el servidor.
+            # **NOTA**: Asegúrate de que esta ruta sea correcta y que la imagen exista.
+            # Por ejemplo, crea una carpeta 'static/images' en la raíz de tu proyecto Django.
+            background_image_path = background_path()
 
-            # # Crear la transición de fundido cruzado (crossfade)
-            # video = CompositeVideoClip([original_clip, final_clip])
+            if not os.path.exists(background_image_path):
+                error_msg = f"La imagen de fondo no se encuentra en la ruta esperada: {background_image_path}"
+                print(error_msg) # Log to console for debugging
+                raise ProcessingError(error_msg)
 
-            filename = f"transicion_{int(time.time())}.mp4"
-            output_path = os.path.join(output_dir, filename)
+            # Fondo ya decodificado y adaptado al tamaño de la imagen original. La
+            # variante está en el caché y se comparte: pegamos sobre una copia.
+            background_image_resized = asset_cache.resized(background_image_path, original.size).copy()
 
+            # Pegar la imagen sin fondo sobre el nuevo fondo
+            no_bg_image = no_bg.image
+            background_image_resized.paste(no_bg_image, (0, 0), no_bg_image)
+            final = PipelineImage(image=background_image_resized)
 
-            # Escribir el video en un archivo temporal para obtener sus bytes
-            # Escribir el archivo directamente en la ruta deseada
-            video.write_videofile(
-                output_path,
-                codec='libx264',
-                audio=False,
-                fps=24,
-                logger=None
-            )
+        # --- 3. Proceso adicional: Crear un video de transición ---
 
-            # Leer los bytes si los necesitas
-            with open(output_path, "rb") as f:
-                video_bytes = f.read()
+        with span("video"):
+            from .transitions import render_transition
 
+            # Arrays RGB de las imágenes ya decodificadas
+            original_np = original.rgb()
+            final_np = final.rgb()
 
-            # --- 4. Codificar todo para la respuesta JSON ---
-            no_bg_base64 = base64.b64encode(no_bg_image_bytes).decode('utf-8')
-            with_new_bg_base64 = base64.b64encode(image_with_new_bg_bytes).decode('utf-8')
-            video_base64 = base64.b64encode(video_bytes).decode('utf-8')
+            # La imagen con el nuevo fondo baja desde arriba sobre la original.
+            # ffmpeg escribe el MP4 directamente en el almacén de ficheros.
+            video_ref = artifact_store.put_from(
+                lambda path: render_transition(original_np, final_np, path), "video/mp4", ttl
+            )
 
-            # 5. Crear la respuesta JSON, añadiendo el prefijo Data URL para uso directo en el frontend.
-            data = {
-                "image_no_bg": f"data:image/png;base64,{no_bg_base64}",
-                "image_with_new_bg": f"data:image/png;base64,{with_new_bg_base64}",
-                "transition_video": f"data:video/mp4;base64,{video_base64}"
+        # --- 4. Codificar y guardar los ficheros para servirlos en el formato pedido ---
+        no_bg_image_bytes = no_bg.png()
+        image_with_new_bg_bytes = final.png()
+        with span("store"):
+            return {
+                "image_no_bg": artifact_store.put(no_bg_image_bytes, "image/png", ttl),
+                "image_with_new_bg": artifact_store.put(image_with_new_bg_bytes, "image/png", ttl),
+                "transition_video": video_ref,
             }
 
-            return Response(data, status=status.HTTP_200_OK)
-
-        except Exception as e:
-            # Imprimimos el traceback completo en la consola para una mejor depuración
-            print("--- Ha ocurrido un error en la vista ---")
-            traceback.print_exc()
-            print("------------------------------------")
-            return Response({"error": f"Error al procesar la imagen: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-
 
 class JurassicExplorerView(APIView):
     """
@@ -207,124 +401,171 @@ class JurassicExplorerView(APIView):
     parser_classes = (MultiPartParser, FormParser)
 
     def post(self, request, *args, **kwargs):
+        # Antes de acceder a request.data, que lee y procesa todo el cuerpo
+        try:
+            check_request_size(request)
+        except UploadError as e:
+            return Response({"error": str(e)}, status=e.status_code)
+
         if 'file' not in request.data:
             return Response({"error": "No se proporcionó ningún archivo"}, status=status.HTTP_400_BAD_REQUEST)
 
+        try:
+            mode = response_mode(request)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
         file_obj = request.data['file']
 
         try:
             # Leer los bytes de la imagen
-            input_image_bytes = file_obj.read()
-            
-            # Procesar la imagen usando la funcionalidad del script
-            jurassic_image_bytes = self.generate_jurassic_explorer(input_image_bytes)
-            
-            if jurassic_image_bytes is None:
-                return Response({"error": "No se pudo generar la imagen del explorador del Jurásico"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            input_image_bytes = read_upload(file_obj)
 
-            # Agregar logos a la imagen del explorador del Jurásico
-            jurassic_image_with_logos = self.add_logos_to_image(jurassic_image_bytes)
+            refs = self.build_result(input_image_bytes)
+            return render_artifacts(request, refs, mode)
 
-            # --- Crear video de transición optimizado ---
-            original_image = Image.open(BytesIO(input_image_bytes))
-            jurassic_image = Image.open(BytesIO(jurassic_image_with_logos))
+        except UploadError as e:
+            return Response({"error": str(e)}, status=e.status_code)
+        except ProcessingError as e:
+            return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        except PoolSaturated as e:
+            return busy_response(e)
+        except Exception as e:
+            print("--- Error en JurassicExplorerView ---")
+            traceback.print_exc()
+            print("------------------------------------")
+            return Response({"error": f"Error al procesar la imagen: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-            # Convertir imágenes a formato que moviepy pueda usar (arrays de numpy en RGB)
-            original_np = np.array(original_image.convert("RGB"))
-            jurassic_np = np.array(jurassic_image.convert("RGB"))
+    def build_result(self, input_image_bytes, ttl=None):
+        """
+        Genera los ficheros de la respuesta a partir de los bytes de la imagen
+        subida y devuelve sus referencias en el almacén (caducan en `ttl`
+        segundos). Separado de `post` para poder ejecutarlo también desde la
+        cola de trabajos. Las peticiones simultáneas con la misma imagen
+        comparten el cálculo (y una sola llamada a Gemini).
+        """
+        key = make_key(input_image_bytes, None, view='jurassic-explorer', ttl=ttl)
+        return single_flight.do(key, lambda: self.compute_result(input_image_bytes, ttl))
 
-            # Crear clips de imagen con duración optimizada
-            duration = 5
-            original_clip = ImageClip(original_np).with_duration(duration)
-            jurassic_clip = ImageClip(jurassic_np).with_duration(8)
-            
-            # Obtener el tamaño del video
-            video_size = original_clip.size
+    def compute_result(self, input_image_bytes, ttl=None):
+        """
+        Genera la imagen del explorador con Gemini (o la toma del caché de
+        imágenes generadas), añade los logos y crea el video.
+        """
+        key = self.generation_key(input_image_bytes)
+        jurassic_image_bytes = generated_cache.get(key, "image")
+        if jurassic_image_bytes is None:
+            # Procesar la imagen usando la funcionalidad del script
+            jurassic_image_bytes = self.generate_jurassic_explorer(input_image_bytes)
+            if jurassic_image_bytes is not None:
+                generated_cache.set(key, "image", jurassic_image_bytes, **self.generation_params())
+        return self.compose_result(input_image_bytes, jurassic_image_bytes, ttl, key)
 
-            # Función de posición optimizada para la animación
-            def vertical_wipe(t):
-                if t < duration:
-                    y = -video_size[1] + (video_size[1] * t / duration)
-                else:
-                    y = 0
-                return (0, y)
-
-            # Aplicar la animación de entrada
-            jurassic_clip = jurassic_clip.with_position(vertical_wipe)
-
-            # Combinar los clips
-            video = CompositeVideoClip([original_clip, jurassic_clip])
-
-            # Generar nombre de archivo único
-            filename = f"jurassic_transicion_{int(time.time())}.mp4"
-            output_path = os.path.join(output_dir, filename)
-
-            # Escribir el video con configuración optimizada
-            video.write_videofile(
-                output_path,
-                codec='libx264',
-                audio=False,
-                fps=24,
-                logger=None,
-                temp_audiofile='temp-audio.m4a',
-                remove_temp=True
-            )
+    @staticmethod
+    def generation_key(input_image_bytes):
+        return generation_key(input_image_bytes, JURASSIC_MODEL, JURASSIC_PROMPT_VERSION)
 
-            # Leer los bytes del video
-            with open(output_path, "rb") as f:
-                video_bytes = f.read()
+    @staticmethod
+    def generation_params():
+        return {"model": JURASSIC_MODEL, "prompt_version": JURASSIC_PROMPT_VERSION}
 
-            # Codificar todo para la respuesta JSON
-            original_base64 = base64.b64encode(input_image_bytes).decode('utf-8')
-            jurassic_base64 = base64.b64encode(jurassic_image_with_logos).decode('utf-8')
-            video_base64 = base64.b64encode(video_bytes).decode('utf-8')
+    def compose_result(self, input_image_bytes, jurassic_image_bytes, ttl=None, key=None):
+        """
+        Añade los logos a la imagen generada, crea el video y guarda los
+        ficheros. Separado de la llamada a Gemini para que la vista asíncrona
+        lo ejecute en el pool de hilos (o en el de procesos). La imagen con
+        logos y el video se guardan también en el caché de imágenes
+        generadas, con `key`. Cada imagen se decodifica y se codifica como
+        mucho una vez (ver api.pipeline).
+        """
+        if jurassic_image_bytes is None:
+            raise ProcessingError("No se pudo generar la imagen del explorador del Jurásico")
+        if key is None:
+            key = self.generation_key(input_image_bytes)
+        if process_pool.enabled:
+            return process_pool.run(
+                compose_jurassic_task, input_image_bytes, jurassic_image_bytes, ttl=ttl, key=key
+            )
 
-            # Crear la respuesta JSON
-            data = {
-                "image_no_bg": f"data:image/jpeg;base64,{original_base64}",
-                "image_with_new_bg": f"data:image/png;base64,{jurassic_base64}",
-                "transition_video": f"data:video/mp4;base64,{video_base64}"
-            }
+        original = PipelineImage(input_image_bytes)
+        jurassic = PipelineImage(jurassic_image_bytes)
+
+        # Agregar logos a la imagen del explorador del Jurásico
+        cached_logos = generated_cache.get(key, "logos")
+        if cached_logos is not None:
+            with_logos = PipelineImage(cached_logos)
+        else:
+            with span("logos"):
+                with_logos = self.add_logos_to_image(jurassic)
+            # Sin logos (fallo al añadirlos) no se guarda
+            if with_logos is not jurassic:
+                generated_cache.set(key, "logos", with_logos.png(), **self.generation_params())
+
+        # El video del caché se copia de fichero a fichero, sin leerlo entero
+        video_ref = None
+        cached_video = generated_cache.get_file(key, "video")
+        if cached_video is not None:
+            try:
+                video_ref = artifact_store.put_from(
+                    lambda path: shutil.copyfile(cached_video, path), "video/mp4", ttl
+                )
+            except FileNotFoundError:
+                # Otro worker lo expulsó del caché entre medias
+                pass
+        if video_ref is None:
+            # --- Crear video de transición ---
+            with span("video"):
+                from .transitions import render_transition
+
+                # Arrays RGB de las imágenes (la de logos ya está decodificada
+                # si se acaba de generar)
+                original_np = original.rgb()
+                jurassic_np = with_logos.rgb()
+
+                # La imagen del explorador baja desde arriba sobre la original.
+                # ffmpeg escribe el MP4 directamente en el almacén de ficheros.
+                video_ref = artifact_store.put_from(
+                    lambda path: render_transition(original_np, jurassic_np, path), "video/mp4", ttl
+                )
+            generated_cache.set_file(
+                key, "video", artifact_store.path(video_ref["id"]), **self.generation_params()
+            )
 
-            return Response(data, status=status.HTTP_200_OK)
-            
-        except Exception as e:
-            print("--- Error en JurassicExplorerView ---")
-            traceback.print_exc()
-            print("------------------------------------")
-            return Response({"error": f"Error al procesar la imagen: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        # Guardar los ficheros para servirlos en el formato pedido
+        jurassic_image_with_logos = with_logos.png()
+        with span("store"):
+            return {
+                "image_no_bg": artifact_store.put(input_image_bytes, "image/jpeg", ttl),
+                "image_with_new_bg": artifact_store.put(jurassic_image_with_logos, "image/png", ttl),
+                "transition_video": video_ref,
+            }
 
-    def add_logos_to_image(self, image_bytes):
+    def add_logos_to_image(self, image):
         """
-        Agrega los logos de Titan en las esquinas superiores de la imagen
+        Agrega los logos de Titan en las esquinas superiores de la imagen.
+        Recibe y devuelve un PipelineImage (el mismo si no se pudieron añadir).
         """
         try:
-            # Abrir la imagen principal
-            main_image = Image.open(BytesIO(image_bytes)).convert("RGBA")
+            # Imagen principal en RGBA (una copia: la original no se modifica)
+            main_image = image.image.convert("RGBA")
             main_width, main_height = main_image.size
             
             # Calcular el tamaño de los logos (10% del ancho de la imagen, máximo 150px)
             logo_size = min(int(main_width * 0.5), 330)
             
             # Rutas de los logos
-            logo1_path = os.path.join(BASE_DIR, "media", "images", "lgo2titan.png")
-            logo2_path = os.path.join(BASE_DIR, "media", "images", "lgo1titan.png")
+            logo1_path, logo2_path = LOGO_PATHS
             
             # Verificar que los logos existan
             if not os.path.exists(logo1_path) or not os.path.exists(logo2_path):
                 print("⚠️ No se encontraron los logos, retornando imagen sin logos")
-                return image_bytes
+                return image
             
-            # Cargar y redimensionar los logos
-            logo1 = Image.open(logo1_path).convert("RGBA")
-            logo2 = Image.open(logo2_path).convert("RGBA")
+            # Logos redimensionados manteniendo la proporción (desde el caché)
+            logo1 = asset_cache.thumbnail(logo1_path, logo_size)
+            logo2 = asset_cache.thumbnail(logo2_path, logo_size)
             
-            # Redimensionar manteniendo la proporción
-            logo1.thumbnail((logo_size, logo_size), Image.Resampling.LANCZOS)
-            logo2.thumbnail((logo_size, logo_size), Image.Resampling.LANCZOS)
-            
-            # Crear una copia de la imagen principal para no modificar la original
-            result_image = main_image.copy()
+            result_image = main_image
             
             # Posiciones de los logos (esquinas superiores con margen)
             margin = 20
@@ -335,112 +576,26 @@ class JurassicExplorerView(APIView):
             result_image.paste(logo1, logo1_position, logo1)
             result_image.paste(logo2, logo2_position, logo2)
             
-            # Convertir de vuelta a bytes
-            output_buffer = BytesIO()
-            result_image.save(output_buffer, format='PNG')
-            return output_buffer.getvalue()
+            # Se codifica al guardar la respuesta
+            return PipelineImage(image=result_image)
             
         except Exception as e:
             print(f"⚠️ Error al agregar logos: {e}")
             # Si hay error, retornar la imagen original sin logos
-            return image_bytes
+            return image
 
     def generate_jurassic_explorer(self, image_bytes):
         """
-        Genera explorador del Jurásico usando la funcionalidad del script original
-        Optimizado para mejor rendimiento y manejo de errores
+        Genera el explorador del Jurásico con Gemini (ver api.gemini).
+        Devuelve los bytes de la imagen o None si falla.
         """
         try:
-            # Importar la librería
-            from google import genai
-            from google.genai import types
-            
-            print("✅ Librería google-genai importada correctamente")
-            
-            # Crear cliente
-            api_key = os.getenv("GOOGLE_API_KEY")
-            if not api_key:
-                print("❌ No se encontró GOOGLE_API_KEY")
-                return None
-            
-            client = genai.Client(api_key=api_key)
-            print("✅ Cliente creado correctamente")
-            
-            # Crear archivo temporal con la imagen recibida
-            with tempfile.NamedTemporaryFile(suffix='.jpg', delete=False) as temp_file:
-                temp_file.write(image_bytes)
-                temp_file_path = temp_file.name
-            
-            try:
-                print("📸 Imagen temporal creada")
-                
-                # Modelo optimizado
-                model = "gemini-2.5-flash-image-preview"
-                
-                # Subir la imagen
-                print("📤 Subiendo imagen temporal...")
-                uploaded_file = client.files.upload(file=temp_file_path)
-                print("✅ Imagen subida correctamente")
-                
-                # Prompt optimizado y más conciso
-                prompt = """Analiza esta imagen y transforma EXACTAMENTE el rostro y pose de TODAS las personas manteniendo 100% fiel cada rostro original (ojos, nariz, boca, forma de cara, expresión, edad, género). CONSERVA las poses, posturas y posiciones corporales originales. Viste a cada persona con trajes de explorador del Jurásico (chaqueta de cuero marrón, botas altas, sombrero de explorador, cinturón con herramientas) manteniendo su pose original. Fondo: período Jurásico con dinosaurios, vegetación prehistórica y volcanes. Si hay múltiples personas, mantén la misma composición espacial original. Iluminación dramática y cinematográfica. Estilo realista como película de aventuras."""
-                
-                print("🎯 Generando explorador del Jurásico...")
-                
-                # Configuración optimizada
-                contents = [
-                    types.Content(
-                        role="user",
-                        parts=[
-                            types.Part.from_text(text=prompt),
-                            types.Part.from_uri(
-                                file_uri=uploaded_file.uri,
-                                mime_type="image/jpeg"
-                            )
-                        ],
-                    ),
-                ]
-                
-                generate_content_config = types.GenerateContentConfig(
-                    response_modalities=["IMAGE", "TEXT"],
-                )
-                
-                # Procesar la respuesta de manera más eficiente
-                for chunk in client.models.generate_content_stream(
-                    model=model,
-                    contents=contents,
-                    config=generate_content_config,
-                ):
-                    # Verificación optimizada
-                    if not (chunk.candidates and 
-                           chunk.candidates[0].content and 
-                           chunk.candidates[0].content.parts):
-                        continue
-                    
-                    part = chunk.candidates[0].content.parts[0]
-                    
-                    # Verificar si hay datos de imagen
-                    if (part.inline_data and 
-                        part.inline_data.data):
-                        print("✅ ¡Explorador del Jurásico generado exitosamente!")
-                        return part.inline_data.data
-                    
-                    # Log de texto si existe
-                    if hasattr(chunk, 'text') and chunk.text:
-                        print(f"📝 Texto generado: {chunk.text}")
-                
-                print("⚠️ No se generó imagen en la respuesta")
-                return None
-                
-            finally:
-                # Limpiar archivo temporal de manera segura
-                try:
-                    if os.path.exists(temp_file_path):
-                        os.unlink(temp_file_path)
-                        print("🗑️ Archivo temporal eliminado")
-                except OSError as e:
-                    print(f"⚠️ Error al eliminar archivo temporal: {e}")
-                
+            print("🎯 Generando explorador del Jurásico...")
+            # google-genai se importa con la primera llamada
+            from . import gemini
+
+            with span("gemini"):
+                image_data = gemini.generate_image(image_bytes, JURASSIC_PROMPT, JURASSIC_MODEL)
         except ImportError as e:
             print(f"❌ Error de importación: {e}")
             print("Instala la librería: pip install google-genai")
@@ -448,3 +603,129 @@ class JurassicExplorerView(APIView):
         except Exception as e:
             print(f"❌ Error en generate_jurassic_explorer: {e}")
             return None
+
+        if image_data:
+            print("✅ ¡Explorador del Jurásico generado exitosamente!")
+        else:
+            print("⚠️ No se generó imagen en la respuesta")
+        return image_data
+
+
+class JobSubmitView(APIView):
+    """
+    Encola un trabajo de generación de video y responde 202 con su id.
+
+    Campos: `file` (imagen), `kind` (remove-background2 o jurassic-explorer),
+    `priority` opcional (entero, mayor se ejecuta antes; se limita a
+    ±JOBS_MAX_PRIORITY) y `callback_url`
+    opcional, que recibe un POST con el estado final del trabajo (https y a
+    un host de JOBS_CALLBACK_ALLOWED_HOSTS).
+    """
+    parser_classes = (MultiPartParser, FormParser)
+
+    def post(self, request, *args, **kwargs):
+        # Antes de acceder a request.data, que lee y procesa todo el cuerpo
+        try:
+            check_request_size(request)
+        except UploadError as e:
+            return Response({"error": str(e)}, status=e.status_code)
+
+        if 'file' not in request.data:
+            return Response({"error": "No se proporcionó ningún archivo"}, status=status.HTTP_400_BAD_REQUEST)
+
+        kind = request.data.get('kind')
+        if kind not in job_queue.kinds():
+            return Response(
+                {"error": f"Tipo de trabajo no válido. Opciones: {', '.join(job_queue.kinds())}"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        try:
+            priority = int(request.data.get('priority', 0))
+        except (TypeError, ValueError):
+            return Response({"error": "La prioridad debe ser un número entero"}, status=status.HTTP_400_BAD_REQUEST)
+        # El cliente no debe poder adelantar a todos los demás
+        limit = settings.JOBS_MAX_PRIORITY
+        priority = max(-limit, min(priority, limit))
+
+        try:
+            input_image_bytes = read_upload(request.data['file'])
+        except UploadError as e:
+            return Response({"error": str(e)}, status=e.status_code)
+
+        try:
+            job = job_queue.submit(
+                kind,
+                input_image_bytes,
+                priority=priority,
+                callback_url=request.data.get('callback_url') or None,
+                base_url=request.build_absolute_uri('/'),
+            )
+        except InvalidCallback as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except QueueFull as e:
+            response = Response({"error": str(e)}, status=status.HTTP_429_TOO_MANY_REQUESTS)
+            response['Retry-After'] = str(settings.JOBS_RETRY_AFTER)
+            return response
+
+        data = job.as_dict()
+        data["status_url"] = request.build_absolute_uri(reverse('job-status', args=[job.id]))
+        return Response(data, status=status.HTTP_202_ACCEPTED)
+
+
+class JobStatusView(APIView):
+    """
+    Estado de un trabajo; cuando ha terminado con éxito incluye `result`,
+    con los mismos campos que la respuesta del endpoint síncrono: URLs de
+    descarga o, con `?response=dataurl`, data URLs en base64.
+    """
+    def get(self, request, job_id, *args, **kwargs):
+        try:
+            mode = response_mode(request)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        job = job_queue.get(job_id)
+        if job is None:
+            return Response({"error": "Trabajo no encontrado"}, status=status.HTTP_404_NOT_FOUND)
+
+        data = job.as_dict(include_result=False)
+        if job.result is not None:
+            try:
+                if mode == "dataurl":
+                    data["result"] = artifact_data_urls(job.result)
+                else:
+                    data["result"] = artifact_urls(request, job.result)
+            except ArtifactNotFound:
+                return Response({"error": "El resultado del trabajo ha caducado"}, status=status.HTTP_410_GONE)
+        return Response(data, status=status.HTTP_200_OK)
+
+
+class ArtifactView(APIView):
+    """
+    Descarga de un fichero generado (imagen o video) mientras no caduque.
+    Admite peticiones Range, así el video se puede reproducir y buscar sin
+    descargarlo entero.
+    """
+    def get(self, request, artifact_id, *args, **kwargs):
+        try:
+            path = artifact_store.path(artifact_id)
+        except ArtifactNotFound:
+            return Response({"error": "Fichero no encontrado o caducado"}, status=status.HTTP_404_NOT_FOUND)
+        response = file_response(request, path, artifact_store.content_type(artifact_id))
+        response['Cache-Control'] = 'private, max-age=300'
+        return response
+
+
+# Trabajos que se pueden enviar a la cola (los de los endpoints activos).
+# Sus ficheros duran lo mismo que el resultado del trabajo.
+if is_enabled('remove-background2'):
+    job_queue.register(
+        'remove-background2',
+        lambda payload: RemoveBackgroundView2().build_result(payload, settings.JOBS_RESULT_TTL),
+    )
+if is_enabled('jurassic-explorer'):
+    job_queue.register(
+        'jurassic-explorer',
+        lambda payload: JurassicExplorerView().build_result(payload, settings.JOBS_RESULT_TTL),
+    )
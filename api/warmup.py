@@ -0,0 +1,207 @@
+"""
+Calentamiento del worker al arrancar.
+
+Sin calentamiento, la primera petición de cada worker paga la carga del
+modelo ONNX, la primera inferencia (cuando ONNX Runtime optimiza el grafo),
+la importación de moviepy y la decodificación de las imágenes de fondo y
+logos. Con API_WARMUP activado todo eso se hace en ApiConfig.ready y el
+endpoint de salud responde 503 hasta terminar (y sigue respondiendo 503 si
+el warm-up falla). Sólo se carga lo que usan los
+endpoints activos (API_ENABLED_ENDPOINTS).
+"""
+import importlib
+import logging
+import threading
+import time
+
+from django.conf import settings
+
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Módulos pesados que conviene tener importados antes de la primera petición
+WARMUP_MODULES = (
+    "numpy",
+)
+# Los de rembg y los del video, sólo si algún endpoint activo los usa (ver
+# api.endpoints)
+REMBG_WARMUP_MODULES = (
+    "api.batch",
+)
+VIDEO_WARMUP_MODULES = (
+    "moviepy.config",
+    "api.transitions",
+)
+
+
+class WarmupState:
+    """
+    Estado del calentamiento del proceso, consultado por el health check.
+    """
+
+    def __init__(self):
+        self._ready = threading.Event()
+        self._finished = threading.Event()
+        self.started_at = None
+        self.duration = None
+        self.steps = {}
+        self.error = None
+
+    @property
+    def ready(self):
+        return self._ready.is_set()
+
+    def mark_ready(self):
+        self._ready.set()
+        self._finished.set()
+
+    def mark_failed(self, error):
+        self.error = error
+        self._finished.set()
+
+    def wait(self, timeout=None):
+        """
+        Espera a que el warm-up termine, bien o mal; devuelve si está listo.
+        """
+        self._finished.wait(timeout)
+        return self.ready
+
+    def as_dict(self):
+        if self.error is not None:
+            status = "failed"
+        else:
+            status = "ready" if self.ready else "warming"
+        return {
+            "status": status,
+            "warmup_seconds": self.duration,
+            "steps": dict(self.steps),
+            "error": self.error,
+        }
+
+
+state = WarmupState()
+
+
+def _timed(name, func):
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    state.steps[name] = round(elapsed, 4)
+    logger.info("Warm-up %s: %.3fs", name, elapsed)
+
+
+def _dummy_image():
+    from PIL import Image
+
+    # Un degradado en lugar de un color plano: con una imagen uniforme la
+    # normalización de algunos modelos divide por cero.
+    return Image.linear_gradient("L").convert("RGB")
+
+
+def _warm_model(model_name):
+    from rembg import remove
+
+    from .sessions import session_registry
+
+    with session_registry.session(model_name) as session:
+        remove(_dummy_image(), session=session)
+
+
+def _warm_imports():
+    from .endpoints import rembg_enabled, video_enabled
+
+    modules = WARMUP_MODULES
+    if rembg_enabled():
+        modules += REMBG_WARMUP_MODULES
+    if video_enabled():
+        modules += VIDEO_WARMUP_MODULES
+    for module in modules:
+        importlib.import_module(module)
+    # Resolver las URLs importa api.views y con él el resto de dependencias
+    from django.urls import get_resolver
+
+    get_resolver().url_patterns
+
+
+def _warm_assets():
+    from .assets import LOGO_PATHS, asset_cache, background_path
+    from .endpoints import is_enabled
+
+    paths = []
+    if is_enabled("remove-background2"):
+        paths.append(background_path())
+    if is_enabled("jurassic-explorer"):
+        paths.extend(LOGO_PATHS)
+    asset_cache.preload(paths)
+
+
+def _warm_models():
+    from .endpoints import rembg_enabled
+    from .procpool import process_pool
+
+    if not rembg_enabled():
+        return
+    if process_pool.enabled:
+        # rembg se ejecuta en los procesos del pool, que cargan sus propias
+        # sesiones al arrancar (el endpoint por lotes carga las del worker
+        # con su primera petición)
+        _timed("process_pool", process_pool.start)
+        return
+    for model_name in settings.API_WARMUP_MODELS:
+        _timed(f"model:{model_name}", lambda: _warm_model(model_name))
+
+
+def _run(steps, start):
+    """
+    Ejecuta los pasos del warm-up y marca el proceso como listo sólo si
+    todos terminan bien; si alguno falla el error queda en el estado y el
+    health check sigue respondiendo 503.
+    """
+    try:
+        for step in steps:
+            step()
+    except Exception as e:
+        state.mark_failed(str(e))
+        logger.exception("Error durante el warm-up")
+    finally:
+        state.duration = round(time.perf_counter() - start, 4)
+        metrics.increment("api_warmup_seconds_total", state.duration)
+    if state.error is None:
+        logger.info("Warm-up completado en %.3fs", state.duration)
+        state.mark_ready()
+
+
+def start_warmup():
+    """
+    Punto de entrada desde ApiConfig.ready: importa el stack de video, carga
+    los modelos configurados y ejecuta una inferencia de prueba con cada uno.
+    """
+    if not settings.API_WARMUP:
+        state.mark_ready()
+        return
+
+    state.started_at = time.time()
+    start = time.perf_counter()
+
+    if settings.API_WARMUP_BLOCKING:
+        _run([
+            lambda: _timed("imports", _warm_imports),
+            lambda: _timed("assets", _warm_assets),
+            _warm_models,
+        ], start)
+        return
+
+    # Los imports se hacen siempre en el hilo principal: pymatting (que
+    # importa rembg) deja colgado el cierre del intérprete si se importa
+    # por primera vez desde otro hilo.
+    try:
+        _timed("imports", _warm_imports)
+        _timed("assets", _warm_assets)
+    except Exception as e:
+        state.mark_failed(str(e))
+        logger.exception("Error durante el warm-up")
+        return
+    threading.Thread(
+        target=_run, args=([_warm_models], start), name="api-warmup", daemon=True
+    ).start()
@@ -10,6 +10,8 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 '''
 
+import os
+import tempfile
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -43,6 +45,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # El primero, para que el total incluya todo lo demás
+    'api.middleware.TracingMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -51,10 +55,36 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'api.middleware.PeakMemoryMiddleware',
 ]
 
 ROOT_URLCONF = 'bg_remover.urls'
 
+# Tiempo de cada etapa por petición (ver api.tracing): cabecera Server-Timing,
+# histogramas en /metrics y una línea JSON por petición en el logger
+# `api.trace`, a nivel DEBUG (API_TRACE_LOG_LEVEL=DEBUG para verlas).
+# /metrics (formato Prometheus) se activa con METRICS_ENDPOINT=1 y pide
+# siempre `Authorization: Bearer METRICS_TOKEN`: sin token responde 403 (la
+# dirección de origen no sirve detrás de un proxy).
+API_TRACING = os.getenv('API_TRACING', '1') == '1'
+METRICS_ENDPOINT = os.getenv('METRICS_ENDPOINT', '0') == '1'
+METRICS_TOKEN = os.getenv('METRICS_TOKEN') or None
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'api.trace': {
+            'handlers': ['console'],
+            'level': os.getenv('API_TRACE_LOG_LEVEL', 'INFO'),
+            'propagate': False,
+        },
+    },
+}
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
@@ -132,3 +162,226 @@ CORS_ALLOWED_ORIGINS = [
     "https://c98b215e4ba6.ngrok-free.app",
     "https://informadortitan.salasvirtuales.info",
 ]
+
+# rembg
+# Modelo usado cuando la petición no indica otro y número máximo de sesiones
+# (modelos cargados en memoria) por modelo y por worker. 'bria-rmbg' es el
+# que usa `rembg.remove` sin sesión (el comportamiento original de la API).
+REMBG_DEFAULT_MODEL = os.getenv('REMBG_DEFAULT_MODEL', 'bria-rmbg')
+REMBG_SESSION_POOL_SIZE = int(os.getenv('REMBG_SESSION_POOL_SIZE', '2'))
+# Segundos que una petición espera por una sesión libre (None = sin límite)
+REMBG_SESSION_TIMEOUT = None
+# Modelos que una petición puede elegir con el parámetro `model`
+REMBG_ALLOWED_MODELS = os.getenv(
+    'REMBG_ALLOWED_MODELS', 'bria-rmbg,u2net,u2netp,silueta,isnet-general-use,u2net_human_seg'
+).split(',')
+# Modelo por defecto de cada endpoint (nombre de la URL), p. ej.
+# REMBG_ENDPOINT_MODELS="remove-background2=u2net_human_seg" para tráfico de retratos
+REMBG_ENDPOINT_MODELS = dict(
+    item.split('=', 1) for item in os.getenv('REMBG_ENDPOINT_MODELS', '').split(',') if '=' in item
+)
+
+# ONNX Runtime, aplicado a todas las sesiones de rembg (ver api.runtime).
+# Con varios workers conviene que workers * sesiones * ONNX_INTRA_OP_THREADS
+# no supere el número de núcleos (0 = ONNX Runtime usa todos los núcleos).
+# `python manage.py bench_onnx` compara combinaciones bajo carga.
+ONNX_INTRA_OP_THREADS = int(os.getenv('ONNX_INTRA_OP_THREADS', '0'))
+ONNX_INTER_OP_THREADS = int(os.getenv('ONNX_INTER_OP_THREADS', '1'))
+ONNX_ALLOW_SPINNING = os.getenv('ONNX_ALLOW_SPINNING', '1') == '1'
+# 'disable', 'basic', 'extended' o 'all'
+ONNX_GRAPH_OPTIMIZATION = os.getenv('ONNX_GRAPH_OPTIMIZATION', 'all')
+# Directorio donde guardar los modelos ya optimizados (None = no se guardan)
+ONNX_OPTIMIZED_MODEL_DIR = os.getenv('ONNX_OPTIMIZED_MODEL_DIR') or None
+ONNX_CPU_MEM_ARENA = os.getenv('ONNX_CPU_MEM_ARENA', '1') == '1'
+ONNX_MEM_PATTERN = os.getenv('ONNX_MEM_PATTERN', '1') == '1'
+# Fijar cada worker a su propio grupo de ONNX_INTRA_OP_THREADS núcleos (Linux)
+ONNX_CPU_AFFINITY = os.getenv('ONNX_CPU_AFFINITY', '0') == '1'
+
+# Endpoints que sirve este despliegue (ver api.endpoints), separados por
+# comas: remove-background, remove-background-batch, remove-background2,
+# jurassic-explorer y jobs. Vacío = todos. P. ej. con
+# API_ENABLED_ENDPOINTS=remove-background no se cargan moviepy ni google-genai.
+API_ENABLED_ENDPOINTS = [name.strip() for name in os.getenv('API_ENABLED_ENDPOINTS', '').split(',') if name.strip()]
+
+# Vistas asíncronas (servidor ASGI, p. ej. `uvicorn bg_remover.asgi:application`)
+# para remove-background, remove-background2 y jurassic-explorer. El trabajo
+# de CPU va a un pool de ASYNC_CPU_THREADS hilos y cada etapa admite como
+# mucho ASYNC_STAGE_LIMITS peticiones a la vez; 'rembg' no debería superar
+# REMBG_SESSION_POOL_SIZE (los hilos de más sólo esperarían una sesión).
+API_ASYNC_VIEWS = os.getenv('API_ASYNC_VIEWS', '0') == '1'
+ASYNC_CPU_THREADS = int(os.getenv('ASYNC_CPU_THREADS', str(os.cpu_count() or 1)))
+ASYNC_STAGE_LIMITS = {
+    'decode': 4,
+    'rembg': REMBG_SESSION_POOL_SIZE,
+    'encode': 2,
+    'gemini': int(os.getenv('ASYNC_GEMINI_CONCURRENCY', '200')),
+}
+
+# Pool de procesos para rembg, la composición y el video (ver api.procpool).
+# 0 = sin pool: se ejecutan en el hilo de la petición. Cada proceso carga sus
+# propias sesiones de API_WARMUP_MODELS; conviene que PROCESS_POOL_SIZE *
+# ONNX_INTRA_OP_THREADS no supere el número de núcleos. Con PROCESS_POOL_SIZE
+# tareas en curso y PROCESS_POOL_QUEUE esperando, las peticiones que no
+# consiguen hueco en PROCESS_POOL_QUEUE_TIMEOUT segundos reciben un 429 con
+# Retry-After: PROCESS_POOL_RETRY_AFTER.
+PROCESS_POOL_SIZE = int(os.getenv('PROCESS_POOL_SIZE', '0'))
+PROCESS_POOL_QUEUE = int(os.getenv('PROCESS_POOL_QUEUE', str(2 * PROCESS_POOL_SIZE)))
+PROCESS_POOL_QUEUE_TIMEOUT = float(os.getenv('PROCESS_POOL_QUEUE_TIMEOUT', '0'))
+PROCESS_POOL_RETRY_AFTER = int(os.getenv('PROCESS_POOL_RETRY_AFTER', '5'))
+# 'spawn' (recomendado: los hijos no heredan los hilos de ONNX Runtime) o 'fork'
+PROCESS_POOL_START_METHOD = os.getenv('PROCESS_POOL_START_METHOD', 'spawn')
+
+# Cliente de Gemini (ver api.gemini). GEMINI_BASE_URL apunta a otro servidor,
+# p. ej. el de pruebas de `python manage.py gemini_stub` (http://127.0.0.1:8765).
+GEMINI_BASE_URL = os.getenv('GEMINI_BASE_URL') or None
+# Timeout por petición en segundos
+GEMINI_TIMEOUT = float(os.getenv('GEMINI_TIMEOUT', '120'))
+# Conexiones abiertas a la vez y cuánto se conserva una conexión inactiva
+GEMINI_MAX_CONNECTIONS = int(os.getenv('GEMINI_MAX_CONNECTIONS', str(ASYNC_STAGE_LIMITS['gemini'])))
+GEMINI_KEEPALIVE_SECONDS = float(os.getenv('GEMINI_KEEPALIVE_SECONDS', '60'))
+# La imagen se envía reducida a este lado máximo y en JPEG
+GEMINI_MAX_IMAGE_DIMENSION = int(os.getenv('GEMINI_MAX_IMAGE_DIMENSION', '1024'))
+GEMINI_JPEG_QUALITY = int(os.getenv('GEMINI_JPEG_QUALITY', '90'))
+# Por debajo de este tamaño la imagen va en la petición; por encima se sube antes
+GEMINI_INLINE_MAX_BYTES = int(os.getenv('GEMINI_INLINE_MAX_BYTES', str(4 * 1024 * 1024)))
+# Reintentos con espera exponencial ante 429, 5xx y errores de red
+GEMINI_RETRY_ATTEMPTS = int(os.getenv('GEMINI_RETRY_ATTEMPTS', '4'))
+GEMINI_RETRY_INITIAL_DELAY = float(os.getenv('GEMINI_RETRY_INITIAL_DELAY', '1'))
+GEMINI_RETRY_MAX_DELAY = float(os.getenv('GEMINI_RETRY_MAX_DELAY', '20'))
+
+# Warm-up del worker al arrancar (carga de modelos e imports pesados).
+# Desactivado por defecto; con API_WARMUP_BLOCKING el arranque espera a que
+# termine en lugar de hacerlo en segundo plano.
+API_WARMUP = os.getenv('API_WARMUP', '0') == '1'
+API_WARMUP_BLOCKING = os.getenv('API_WARMUP_BLOCKING', '0') == '1'
+API_WARMUP_MODELS = sorted({REMBG_DEFAULT_MODEL, *REMBG_ENDPOINT_MODELS.values()})
+
+# Endpoint por lotes: máximo de archivos por petición y de imágenes por
+# ejecución de ONNX Runtime
+REMBG_MAX_BATCH_SIZE = int(os.getenv('REMBG_MAX_BATCH_SIZE', '32'))
+REMBG_INFERENCE_BATCH_SIZE = int(os.getenv('REMBG_INFERENCE_BATCH_SIZE', '8'))
+
+# Cola de trabajos para los endpoints de video.
+# JOBS_BROKER: 'api.jobs.SQLiteBroker' (compartido entre los workers de la
+# máquina a través de JOBS_SQLITE_PATH) o 'api.jobs.InMemoryBroker' (por
+# proceso: sólo con un único worker, si no la consulta del estado puede
+# llegar a otro worker y devolver 404).
+JOBS_BROKER = os.getenv('JOBS_BROKER', 'api.jobs.SQLiteBroker')
+JOBS_SQLITE_PATH = os.getenv(
+    'JOBS_SQLITE_PATH', os.path.join(tempfile.gettempdir(), 'bg-remover-jobs.sqlite3')
+)
+JOBS_MAX_WORKERS = int(os.getenv('JOBS_MAX_WORKERS', '2'))
+# Con un broker compartido cada worker arranca sus hilos al iniciarse, ya
+# que el trabajo puede haberlo encolado otro. manage.py lo desactiva salvo
+# en runserver, para que los comandos no reclamen trabajos.
+JOBS_AUTOSTART = os.getenv('JOBS_AUTOSTART', '1') == '1'
+JOBS_MAX_PENDING = 100
+# Rango de `priority` que puede pedir un cliente (se limita a
+# ±JOBS_MAX_PRIORITY); 0 = todos los trabajos con la misma prioridad
+JOBS_MAX_PRIORITY = int(os.getenv('JOBS_MAX_PRIORITY', '0'))
+JOBS_RESULT_TTL = 60 * 60
+JOBS_CALLBACK_TIMEOUT = 10
+# Hosts a los que se puede enviar el callback de un trabajo (mismo formato
+# que ALLOWED_HOSTS: '.example.com' incluye los subdominios). Vacío = no se
+# admiten callbacks. Sólo https y nunca a direcciones privadas o locales.
+JOBS_CALLBACK_ALLOWED_HOSTS = [
+    host.strip() for host in os.getenv('JOBS_CALLBACK_ALLOWED_HOSTS', '').split(',') if host.strip()
+]
+# SQLiteBroker: segundos sin renovar tras los que un trabajo en ejecución se
+# da por perdido (su worker murió) y vuelve a la cola, como mucho
+# JOBS_MAX_ATTEMPTS veces
+JOBS_LEASE_SECONDS = int(os.getenv('JOBS_LEASE_SECONDS', '60'))
+JOBS_MAX_ATTEMPTS = int(os.getenv('JOBS_MAX_ATTEMPTS', '3'))
+JOBS_RETRY_AFTER = 30
+
+# Codificación de video: 'pipe' (frames a ffmpeg y MP4 en memoria), 'disk'
+# (fichero temporal) o 'auto' (disco sólo si ancho * alto * frames supera
+# VIDEO_PIPE_MAX_PIXELS).
+VIDEO_ENCODE_MODE = os.getenv('VIDEO_ENCODE_MODE', 'auto')
+VIDEO_PIPE_MAX_PIXELS = 3840 * 2160 * 192  # 8 s de video 4K a 24 fps
+VIDEO_TEMP_DIR = None  # None = directorio temporal del sistema
+VIDEO_X264_PRESET = 'medium'
+# No codificar el tramo final estático de la transición (tiempos de frame variables)
+VIDEO_SKIP_STATIC_TAIL = True
+
+# Caché de resultados de rembg por hash de la imagen, modelo y parámetros.
+# RESULT_CACHE_MAX_BYTES: tamaño máximo en memoria por worker (0 = sin caché
+# en memoria). RESULT_CACHE_DIR: directorio del caché en disco, compartido
+# entre workers (None = desactivado), con caducidad RESULT_CACHE_TTL segundos.
+RESULT_CACHE_MAX_BYTES = int(os.getenv('RESULT_CACHE_MAX_BYTES', str(256 * 1024 * 1024)))
+RESULT_CACHE_DIR = os.getenv('RESULT_CACHE_DIR') or None
+RESULT_CACHE_TTL = int(os.getenv('RESULT_CACHE_TTL', str(24 * 60 * 60)))
+
+# Caché persistente de las imágenes generadas con Gemini (y de la imagen con
+# logos y el video hechos a partir de ellas), compartido entre workers
+# (ver api.generated). Por defecto va al directorio temporal del sistema,
+# fuera del código; en producción conviene un volumen de datos persistente.
+# Los videos se guardan como ficheros en GENERATED_CACHE_PATH + '.files'.
+# GENERATED_CACHE_PATH vacío lo desactiva. Al pasar de
+# GENERATED_CACHE_MAX_BYTES se borran las entradas usadas hace más tiempo;
+# `python manage.py purge_generated` lo vacía a mano.
+GENERATED_CACHE_PATH = os.getenv(
+    'GENERATED_CACHE_PATH', os.path.join(tempfile.gettempdir(), 'bg-remover-generated.sqlite3')
+) or None
+GENERATED_CACHE_MAX_BYTES = int(os.getenv('GENERATED_CACHE_MAX_BYTES', str(1024 * 1024 * 1024)))
+
+# Deduplicación de peticiones idénticas simultáneas (remove-background2 y
+# jurassic-explorer). Dentro de cada worker siempre está activa; con
+# SINGLEFLIGHT_LOCK_DIR también entre workers de la máquina, que comparten
+# el resultado durante SINGLEFLIGHT_RESULT_TTL segundos.
+SINGLEFLIGHT_LOCK_DIR = os.getenv('SINGLEFLIGHT_LOCK_DIR') or None
+SINGLEFLIGHT_RESULT_TTL = int(os.getenv('SINGLEFLIGHT_RESULT_TTL', '60'))
+
+# Caché de las imágenes de fondo y logos ya decodificadas y redimensionadas:
+# tamaño máximo en memoria de las variantes por worker
+ASSET_CACHE_MAX_BYTES = int(os.getenv('ASSET_CACHE_MAX_BYTES', str(128 * 1024 * 1024)))
+
+# Formato de respuesta por defecto de remove-background2 y jurassic-explorer:
+# 'dataurl' (JSON con data URLs en base64, el formato de siempre), 'urls'
+# (JSON con URLs de descarga) o 'multipart' (multipart/mixed). Cada petición
+# puede pedir otro con ?response=. Las URLs de descarga (también las de los
+# trabajos de /api/jobs/) no llevan firma ni autenticación: sólo las protege
+# su id aleatorio (144 bits) y caducan a los ARTIFACT_TTL segundos, así que
+# quien obtenga una URL puede descargar el fichero hasta entonces.
+API_RESPONSE_MODE = os.getenv('API_RESPONSE_MODE', 'dataurl')
+# Formato por defecto de la imagen sin fondo: 'png' (RGBA), 'mask' (sólo la
+# máscara), 'webp', 'webp-lossy' o 'png8' (paleta). Cada petición puede pedir
+# otro con el parámetro `output` (ver api.outputs).
+API_OUTPUT_FORMAT = os.getenv('API_OUTPUT_FORMAT', 'png')
+# Compresión: nivel zlib de los PNG (0-9), colores de 'png8', calidad de
+# 'webp-lossy' (0-100) y esfuerzo del codificador WebP (0-6)
+OUTPUT_PNG_COMPRESS_LEVEL = int(os.getenv('OUTPUT_PNG_COMPRESS_LEVEL', '6'))
+OUTPUT_PNG_COLORS = 256
+OUTPUT_WEBP_QUALITY = int(os.getenv('OUTPUT_WEBP_QUALITY', '80'))
+OUTPUT_WEBP_METHOD = int(os.getenv('OUTPUT_WEBP_METHOD', '4'))
+# Ficheros generados que se sirven por URL: directorio compartido entre
+# workers (None = directorio temporal del sistema) y segundos hasta que caducan
+ARTIFACT_DIR = os.getenv('ARTIFACT_DIR') or None
+ARTIFACT_TTL = int(os.getenv('ARTIFACT_TTL', str(15 * 60)))
+# Delegar el envío de los ficheros al servidor web: None (lo sirve Django),
+# 'x-accel-redirect' (nginx, con una location `internal` en
+# ARTIFACT_ACCEL_PREFIX que apunte a ARTIFACT_DIR) o 'x-sendfile'
+ARTIFACT_SENDFILE = os.getenv('ARTIFACT_SENDFILE') or None
+ARTIFACT_ACCEL_PREFIX = '/_artifacts/'
+
+# Subidas de imágenes. Las que superan FILE_UPLOAD_MAX_MEMORY_SIZE se guardan
+# en un fichero temporal en lugar de en memoria. UPLOAD_MAX_BYTES: tamaño
+# máximo por archivo. UPLOAD_MAX_PIXELS: imágenes más grandes se rechazan sin
+# decodificarlas. UPLOAD_MAX_DIMENSION: lado máximo (0 = sin límite); las
+# más grandes se rechazan o, con UPLOAD_DOWNSCALE=1, se reducen al recibirlas
+# (el resultado sale entonces más pequeño que la imagen subida).
+FILE_UPLOAD_MAX_MEMORY_SIZE = 2 * 1024 * 1024
+UPLOAD_MAX_BYTES = int(os.getenv('UPLOAD_MAX_BYTES', str(25 * 1024 * 1024)))
+UPLOAD_MAX_PIXELS = int(os.getenv('UPLOAD_MAX_PIXELS', str(100_000_000)))
+UPLOAD_MAX_DIMENSION = int(os.getenv('UPLOAD_MAX_DIMENSION', '0'))
+UPLOAD_DOWNSCALE = os.getenv('UPLOAD_DOWNSCALE', '0') == '1'
+
+# Modo rápido de máscara: el modelo trabaja sobre una copia reducida de la
+# imagen (lado mayor REMBG_FAST_MASK_SIZE) y sólo el alfa se amplía al tamaño
+# original. Con REMBG_MASK_REFINE la ampliación sigue los bordes de la imagen
+# (guided filter de radio REMBG_MASK_REFINE_RADIUS píxeles de la copia reducida).
+REMBG_FAST_MASK = os.getenv('REMBG_FAST_MASK', '0') == '1'
+REMBG_FAST_MASK_SIZE = int(os.getenv('REMBG_FAST_MASK_SIZE', '1024'))
+REMBG_MASK_REFINE = os.getenv('REMBG_MASK_REFINE', '0') == '1'
+REMBG_MASK_REFINE_RADIUS = 4
+REMBG_MASK_REFINE_EPS = 1e-3
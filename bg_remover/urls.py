@@ -14,10 +14,17 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+from django.conf import settings
 from django.contrib import admin
 from django.urls import path, include
 
+from api.views import MetricsView
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('api.urls')),
 ]
+
+if settings.METRICS_ENDPOINT:
+    # Para Prometheus: con token o sólo desde la red interna (ver MetricsView)
+    urlpatterns.append(path('metrics', MetricsView.as_view(), name='metrics'))
@@ -7,6 +7,9 @@ import sys
 def main():
     """Run administrative tasks."""
     os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'bg_remover.settings')
+    if sys.argv[1:2] != ['runserver']:
+        # Los comandos no deben reclamar trabajos de la cola (JOBS_AUTOSTART)
+        os.environ.setdefault('JOBS_AUTOSTART', '0')
     try:
         from django.core.management import execute_from_command_line
     except ImportError as exc: